@@ -1,7 +1,28 @@
-import os
-import psycopg2
-from server.db_setup import get_connection
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from server.cache import reference_cache, row_cache, start_row_cache, stop_row_cache
+from server.http_cache import (
+    cache_headers,
+    is_not_modified,
+    not_modified_response,
+    page_etag,
+    row_etag,
+)
+from server.message_stream import (
+    STREAM_HEADERS,
+    message_hub,
+    start_message_stream,
+    stop_message_stream,
+)
+from server.notify import listener
+from server.stats import group_stats, stats_refresher
+from server.responses import (
+    EXPORT_MEDIA_TYPES,
+    CompressionMiddleware,
+    FastJSONResponse,
+    encode_export,
+)
+from server.pool import PoolTimeout, close_pool, connection, get_db, get_pool
+from fastapi import FastAPI, HTTPException, Request
 from server.schemas import (
     ListingCreate,
     UserCreate,
@@ -10,20 +31,35 @@ from server.schemas import (
     FeatureCreate,
     ListingPriceUpdate,
     ListingStatusUpdate,
+    ConversationRead,
     MessageCreate,
+    SavedSearchCreate,
+    ListingFilters,
+    ListingExport,
+    ListingClusters,
+    ListingBatch,
+    PageParams,
+    StatsDimension,
 )
 
 from fastapi import Depends
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from psycopg2.extras import RealDictCursor
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from server.db import (
     create_listing,
+    save_listings_batch,
     delete_listing,
     update_listing,
     get_all_listings_full,
+    iter_listing_batches,
     get_one_listing_full,
+    get_listing_detail,
+    get_listing_clusters,
+    get_listing_facets,
+    listing_query,
     get_all_users,
     create_user,
     get_one_user,
@@ -44,14 +80,43 @@ from server.db import (
     create_feature,
     delete_feature,
     update_feature,
+    get_all_property_types,
+    get_all_statuses,
+    get_all_roles,
     update_listing_price,
     update_listing_status,
     create_message,
+    get_conversation_messages,
+    get_conversations_for_user,
     get_messages_for_listing,
     get_messages_for_user,
+    mark_conversation_read,
+    get_saved_searches_for_user,
+    create_saved_search,
+    delete_saved_search,
+    get_alerts_for_user,
+    get_listing_stats,
 )
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Every worker listens for changed listings and users, so it can cache them
+    start_row_cache(listener)
+    # Pushes new messages to the users' open streams
+    start_message_stream(listener)
+    # Keeps the precomputed /stats up to date
+    stats_refresher.start()
+    yield
+    stats_refresher.stop()
+    stop_message_stream(listener)
+    stop_row_cache(listener)
+    listener.stop()
+    # Close all pooled connections when the server stops
+    close_pool()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 
 app.add_middleware(
@@ -67,10 +132,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Big responses (pages of listings) are sent brotli or gzip compressed
+app.add_middleware(CompressionMiddleware)
+
 
 security = HTTPBasic()
 
 
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request, exc):
+    # All connections are busy, ask the client to try again shortly
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+@app.get("/pool/stats")
+def read_pool_stats():
+    return get_pool().stats()
+
+
 def get_user_by_email(con, email: str):
     with con.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("SELECT * FROM users WHERE mail = %s", (email,))
@@ -78,17 +157,13 @@ def get_user_by_email(con, email: str):
 
 
 @app.post("/login")
-def login(credentials: HTTPBasicCredentials = Depends(security)):
-    con = get_connection()
-    try:
-        user = get_user_by_email(con, credentials.username)
-        if not user or user["password"] != credentials.password:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        # Don’t expose password to the client
-        user.pop("password", None)
-        return {"user": user}
-    finally:
-        con.close()
+def login(credentials: HTTPBasicCredentials = Depends(security), con=Depends(get_db)):
+    user = get_user_by_email(con, credentials.username)
+    if not user or user["password"] != credentials.password:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    # Don’t expose password to the client
+    user.pop("password", None)
+    return {"user": user}
 
 
 # This code is for the website.
@@ -107,27 +182,93 @@ but will have different HTTP-verbs.
 
 
 @app.get("/listings")
-def read_listings():
-    con = get_connection()
-    listings = get_all_listings_full(con)
-    con.close()
-    return {"listings": listings}
+def read_listings(
+    request: Request,
+    filters: ListingFilters = Depends(),
+    con=Depends(get_db),
+):
+    try:
+        listings, next_cursor = get_all_listings_full(con, filters)
+        facets = get_listing_facets(con, filters) if filters.facets else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 304 when no listing on this page (and no facet count) changed since
+    # the client fetched it
+    headers = cache_headers(page_etag(request.url.query, listings, next_cursor, facets))
+    if is_not_modified(request, headers["ETag"]):
+        return not_modified_response(headers)
+    content = {"listings": listings, "next_cursor": next_cursor}
+    if facets is not None:
+        content["facets"] = facets
+    return FastJSONResponse(content, headers=headers)
+
+
+@app.get("/listings/export")
+def export_listings(filters: ListingExport = Depends()):
+    """
+    Every listing matching the search, streamed as NDJSON or CSV.
+    Memory use stays the same however many listings there are.
+    """
+    # Once the response has started it is too late for a 400
+    try:
+        listing_query(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def chunks():
+        # The connection is taken here and not with Depends(get_db), so it
+        # stays ours for as long as the response is streaming
+        with connection() as con:
+            for number, rows in enumerate(iter_listing_batches(con, filters)):
+                yield encode_export(rows, filters.format, first=number == 0)
+
+    return StreamingResponse(
+        chunks(),
+        media_type=EXPORT_MEDIA_TYPES[filters.format],
+        headers={
+            "Content-Disposition": f'attachment; filename="listings.{filters.format}"'
+        },
+    )
+
+
+@app.get("/listings/clusters")
+def read_listing_clusters(filters: ListingClusters = Depends(), con=Depends(get_db)):
+    """
+    The listings in a map viewport grouped into clusters for the zoom level,
+    with their number, center and price range. A cluster of one listing
+    has its listing_id.
+    """
+    try:
+        clusters = get_listing_clusters(con, filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"clusters": clusters})
 
 
 @app.get("/listings/{id}")
-def read_one_listing(id: int):
-    con = get_connection()
+def read_one_listing(id: int, request: Request, con=Depends(get_db)):
     listing = get_one_listing_full(con, id)
-    con.close()
     if listing is None:
         raise HTTPException(status_code=404, detail="Listing not found")
-    return listing
 
+    headers = cache_headers(row_etag("listing", listing), listing["updated_at"])
+    if is_not_modified(request, headers["ETag"], listing["updated_at"]):
+        return not_modified_response(headers)
+    return FastJSONResponse(listing, headers=headers)
 
-@app.post("/listings")
-def add_listing(listing: ListingCreate):
-    con = get_connection()
 
+@app.get("/listings/{id}/detail")
+def read_listing_detail(id: int, con=Depends(get_db)):
+    # Everything the listing page needs in one request
+    listing = get_listing_detail(con, id)
+    if listing is None:
+        raise HTTPException(status_code=404, detail="Listing not found")
+    return FastJSONResponse(listing)
+
+
+@app.post("/listings")
+def add_listing(listing: ListingCreate, con=Depends(get_db)):
     # We take the data from the "listing" variable (the Schema)
     new_id = create_listing(
         con,
@@ -148,17 +289,30 @@ def add_listing(listing: ListingCreate):
     )
 
     con.commit()  # IMPORTANT: Save the changes!
-    con.close()
 
     return {"message": "Listing created successfully", "id": new_id}
 
 
+@app.post("/listings/batch")
+def save_listings(batch: ListingBatch, con=Depends(get_db)):
+    # Many listings in one request and one transaction. Items with an id
+    # update that listing, the others are created. Items with unknown ids get
+    # an error, the rest are saved.
+    results = save_listings_batch(con, batch.listings)
+    statuses = [result.get("status", "failed") for result in results]
+    return {
+        "created": statuses.count("created"),
+        "updated": statuses.count("updated"),
+        "unchanged": statuses.count("unchanged"),
+        "failed": statuses.count("failed"),
+        "results": results,
+    }
+
+
 @app.delete("/listings/{id}")
-def remove_listing(id: int):
-    con = get_connection()
+def remove_listing(id: int, con=Depends(get_db)):
     deleted_id = delete_listing(con, id)
     con.commit()
-    con.close()
 
     if deleted_id is None:
         raise HTTPException(status_code=404, detail="Listing not found")
@@ -166,9 +320,7 @@ def remove_listing(id: int):
 
 
 @app.put("/listings/{id}")
-def change_listing(id: int, listing: ListingCreate):
-    con = get_connection()
-
+def change_listing(id: int, listing: ListingCreate, con=Depends(get_db)):
     updated_row = update_listing(
         con,
         id,
@@ -189,7 +341,6 @@ def change_listing(id: int, listing: ListingCreate):
     )
 
     con.commit()
-    con.close()
 
     if updated_row is None:
         raise HTTPException(status_code=404, detail="Listing not found.")
@@ -200,16 +351,16 @@ def change_listing(id: int, listing: ListingCreate):
 
 
 @app.get("/users")
-def read_users():
-    con = get_connection()
-    users = get_all_users(con)
-    con.close()
-    return {"users": users}
+def read_users(page: PageParams = Depends(), con=Depends(get_db)):
+    try:
+        users, next_cursor = get_all_users(con, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"users": users, "next_cursor": next_cursor})
 
 
 @app.post("/users")
-def add_user(user: UserCreate):
-    con = get_connection()
+def add_user(user: UserCreate, con=Depends(get_db)):
     new_id = create_user(
         con,
         user.first_name,
@@ -223,34 +374,28 @@ def add_user(user: UserCreate):
         user.company_id,
     )
     con.commit()
-    con.close()
     return {"message": "User created successfully", "id": new_id}
 
 
 @app.get("/users/{id}")
-def read_one_user(id: int):
-    con = get_connection()
+def read_one_user(id: int, con=Depends(get_db)):
     user = get_one_user(con, id)
-    con.close()
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 
 @app.delete("/users/{id}")
-def remove_user(id: int):
-    con = get_connection()
+def remove_user(id: int, con=Depends(get_db)):
     deleted_id = delete_user(con, id)
     con.commit()
-    con.close()
     if deleted_id is None:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted successfully"}
 
 
 @app.put("/users/{id}")
-def change_user(id: int, user: UserCreate):
-    con = get_connection()
+def change_user(id: int, user: UserCreate, con=Depends(get_db)):
     updated_row = update_user(
         con,
         id,
@@ -265,7 +410,6 @@ def change_user(id: int, user: UserCreate):
         user.company_id,
     )
     con.commit()
-    con.close()
     if updated_row is None:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User updated successfully"}
@@ -275,49 +419,42 @@ def change_user(id: int, user: UserCreate):
 
 
 @app.get("/companies")
-def read_companies():
-    con = get_connection()
-    companies = get_all_companies(con)
-    con.close()
-    return {"companies": companies}
+def read_companies(page: PageParams = Depends(), con=Depends(get_db)):
+    try:
+        companies, next_cursor = get_all_companies(con, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"companies": companies, "next_cursor": next_cursor})
 
 
 @app.get("/companies/{id}")
-def read_one_company(id: int):
-    con = get_connection()
+def read_one_company(id: int, con=Depends(get_db)):
     company = get_one_company(con, id)
-    con.close()
     if company is None:
         raise HTTPException(status_code=404, detail="Company not found")
     return company
 
 
 @app.post("/companies")
-def add_company(company: CompanyCreate):
-    con = get_connection()
+def add_company(company: CompanyCreate, con=Depends(get_db)):
     new_id = create_company(con, company.name, company.address_id)
     con.commit()
-    con.close()
     return {"message": "Company created successfully", "id": new_id}
 
 
 @app.delete("/companies/{id}")
-def remove_company(id: int):
-    con = get_connection()
+def remove_company(id: int, con=Depends(get_db)):
     deleted_id = delete_company(con, id)
     con.commit()
-    con.close()
     if deleted_id is None:
         raise HTTPException(status_code=404, detail="Company not found")
     return {"message": "Company deleted successfully"}
 
 
 @app.put("/companies/{id}")
-def change_company(id: int, company: CompanyCreate):
-    con = get_connection()
+def change_company(id: int, company: CompanyCreate, con=Depends(get_db)):
     updated_id = update_company(con, id, company.name, company.address_id)
     con.commit()
-    con.close()
     if updated_id is None:
         raise HTTPException(status_code=404, detail="Company not found")
     return {"message": "Company updated successfully"}
@@ -327,53 +464,59 @@ def change_company(id: int, company: CompanyCreate):
 
 
 @app.get("/addresses")
-def read_addresses():
-    con = get_connection()
-    addresses = get_all_addresses(con)
-    con.close()
-    return {"addresses": addresses}
+def read_addresses(page: PageParams = Depends(), con=Depends(get_db)):
+    try:
+        addresses, next_cursor = get_all_addresses(con, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"addresses": addresses, "next_cursor": next_cursor})
 
 
 @app.get("/addresses/{id}")
-def read_one_address(id: int):
-    con = get_connection()
+def read_one_address(id: int, con=Depends(get_db)):
     address = get_one_address(con, id)
-    con.close()
     if address is None:
         raise HTTPException(status_code=404, detail="Address not found")
     return address
 
 
 @app.post("/addresses")
-def add_address(address: AddressCreate):
-    con = get_connection()
+def add_address(address: AddressCreate, con=Depends(get_db)):
     new_id = create_address(
-        con, address.street, address.city, address.postcode, address.country
+        con,
+        address.street,
+        address.city,
+        address.postcode,
+        address.country,
+        address.latitude,
+        address.longitude,
     )
     con.commit()
-    con.close()
     return {"message": "Address created successfully", "id": new_id}
 
 
 @app.delete("/addresses/{id}")
-def remove_address(id: int):
-    con = get_connection()
+def remove_address(id: int, con=Depends(get_db)):
     deleted_id = delete_address(con, id)
     con.commit()
-    con.close()
     if deleted_id is None:
         raise HTTPException(status_code=404, detail="Address not found")
     return {"message": "Address deleted successfully"}
 
 
 @app.put("/addresses/{id}")
-def change_address(id: int, address: AddressCreate):
-    con = get_connection()
+def change_address(id: int, address: AddressCreate, con=Depends(get_db)):
     updated_id = update_address(
-        con, id, address.street, address.city, address.postcode, address.country
+        con,
+        id,
+        address.street,
+        address.city,
+        address.postcode,
+        address.country,
+        address.latitude,
+        address.longitude,
     )
     con.commit()
-    con.close()
     if updated_id is None:
         raise HTTPException(status_code=404, detail="Address not found")
     return {"message": "Address updated successfully"}
@@ -383,64 +526,146 @@ def change_address(id: int, address: AddressCreate):
 
 
 @app.get("/features")
-def read_features():
-    con = get_connection()
-    features = get_all_features(con)
-    con.close()
-    return {"features": features}
+def read_features(page: PageParams = Depends(), con=Depends(get_db)):
+    try:
+        features, next_cursor = get_all_features(con, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"features": features, "next_cursor": next_cursor})
 
 
 @app.get("/features/{id}")
-def read_one_feature(id: int):
-    con = get_connection()
+def read_one_feature(id: int, con=Depends(get_db)):
     feature = get_one_feature(con, id)
-    con.close()
     if feature is None:
         raise HTTPException(status_code=404, detail="Feature not found")
     return feature
 
 
 @app.post("/features")
-def add_feature(feature: FeatureCreate):
-    con = get_connection()
+def add_feature(feature: FeatureCreate, con=Depends(get_db)):
     new_id = create_feature(con, feature.name)
     con.commit()
-    con.close()
     return {"message": "Feature created successfully", "id": new_id}
 
 
 @app.delete("/features/{id}")
-def remove_feature(id: int):
-    con = get_connection()
+def remove_feature(id: int, con=Depends(get_db)):
     deleted_id = delete_feature(con, id)
     con.commit()
-    con.close()
     if deleted_id is None:
         raise HTTPException(status_code=404, detail="Feature not found")
     return {"message": "Feature deleted successfully"}
 
 
 @app.put("/features/{id}")
-def change_feature(id: int, feature: FeatureCreate):
-    con = get_connection()
+def change_feature(id: int, feature: FeatureCreate, con=Depends(get_db)):
     updated_id = update_feature(con, id, feature.name)
     con.commit()
-    con.close()
     if updated_id is None:
         raise HTTPException(status_code=404, detail="Feature not found")
     return {"message": "Feature updated successfully"}
 
 
+# LOOKUPS (served from the in-process cache)
+
+
+@app.get("/property-types")
+def read_property_types(con=Depends(get_db)):
+    return {"property_types": get_all_property_types(con)}
+
+
+@app.get("/statuses")
+def read_statuses(con=Depends(get_db)):
+    return {"statuses": get_all_statuses(con)}
+
+
+@app.get("/roles")
+def read_roles(con=Depends(get_db)):
+    return {"roles": get_all_roles(con)}
+
+
+@app.get("/cache/stats")
+def read_cache_stats():
+    return {"reference": reference_cache.stats(), "rows": row_cache.stats()}
+
+
+# SAVED SEARCHES
+
+
+@app.get("/saved-searches/user/{user_id}")
+def list_saved_searches_for_user(
+    user_id: int, page: PageParams = Depends(), con=Depends(get_db)
+):
+    try:
+        saved_searches, next_cursor = get_saved_searches_for_user(con, user_id, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(
+        {"saved_searches": saved_searches, "next_cursor": next_cursor}
+    )
+
+
+@app.post("/saved-searches")
+def add_saved_search(search: SavedSearchCreate, con=Depends(get_db)):
+    try:
+        new_id = create_saved_search(con, search)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    con.commit()
+    return {"message": "Saved search created successfully", "id": new_id}
+
+
+@app.delete("/saved-searches/{id}")
+def remove_saved_search(id: int, con=Depends(get_db)):
+    deleted_id = delete_saved_search(con, id)
+    con.commit()
+    if deleted_id is None:
+        raise HTTPException(status_code=404, detail="Saved search not found")
+    return {"message": "Saved search deleted successfully"}
+
+
+@app.get("/saved-searches/user/{user_id}/alerts")
+def list_alerts_for_user(
+    user_id: int, page: PageParams = Depends(), con=Depends(get_db)
+):
+    try:
+        alerts, next_cursor = get_alerts_for_user(con, user_id, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"alerts": alerts, "next_cursor": next_cursor})
+
+
+# STATS ENDPOINTS
+
+
+@app.get("/stats")
+def read_stats(con=Depends(get_db)):
+    """
+    Market statistics over all listings and per city, property type and
+    status: number of listings, price and price per m² percentiles and
+    average living area. Precomputed, see server/stats.py.
+    """
+    rows, refreshed_at = get_listing_stats(con)
+    return FastJSONResponse({"refreshed_at": refreshed_at, **group_stats(rows)})
+
+
+@app.get("/stats/{dimension}")
+def read_stats_by(dimension: StatsDimension, con=Depends(get_db)):
+    rows, refreshed_at = get_listing_stats(con, dimension)
+    return FastJSONResponse(
+        {"refreshed_at": refreshed_at, "stats": group_stats(rows)[dimension]}
+    )
+
+
 # PATCH LISTINGS
 
 
 @app.patch("/listings/{id}/price")
-def update_price(id: int, update: ListingPriceUpdate):
-    con = get_connection()
+def update_price(id: int, update: ListingPriceUpdate, con=Depends(get_db)):
     # Adding the new price
     updated_id = update_listing_price(con, id, update.price)
     con.commit()
-    con.close()
 
     if updated_id is None:
         raise HTTPException(status_code=404, detail="Listing not found")
@@ -449,12 +674,10 @@ def update_price(id: int, update: ListingPriceUpdate):
 
 
 @app.patch("/listings/{id}/status")
-def update_status(id: int, update: ListingStatusUpdate):
-    con = get_connection()
+def update_status(id: int, update: ListingStatusUpdate, con=Depends(get_db)):
     # Adding the new status
     updated_id = update_listing_status(con, id, update.status_id)
     con.commit()
-    con.close()
 
     if updated_id is None:
         raise HTTPException(status_code=404, detail="Listing not found")
@@ -466,35 +689,91 @@ def update_status(id: int, update: ListingStatusUpdate):
 
 
 @app.post("/messages")
-def add_message(payload: MessageCreate):
-    con = get_connection()
-    try:
-        msg = create_message(
-            con,
-            payload.sender_id,
-            payload.receiver_id,
-            payload.listing_id,
-            payload.content,
-        )
-        con.commit()
-        return msg
-    finally:
-        con.close()
+def add_message(payload: MessageCreate, con=Depends(get_db)):
+    msg = create_message(
+        con,
+        payload.sender_id,
+        payload.receiver_id,
+        payload.listing_id,
+        payload.content,
+    )
+    con.commit()
+    return msg
 
 
 @app.get("/messages/listing/{listing_id}")
-def list_messages_for_listing(listing_id: int):
-    con = get_connection()
+def list_messages_for_listing(
+    listing_id: int, page: PageParams = Depends(), con=Depends(get_db)
+):
     try:
-        return get_messages_for_listing(con, listing_id)
-    finally:
-        con.close()
+        messages, next_cursor = get_messages_for_listing(con, listing_id, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"messages": messages, "next_cursor": next_cursor})
 
 
 @app.get("/messages/user/{user_id}")
-def list_messages_for_user(user_id: int):
-    con = get_connection()
+def list_messages_for_user(
+    user_id: int, page: PageParams = Depends(), con=Depends(get_db)
+):
+    try:
+        messages, next_cursor = get_messages_for_user(con, user_id, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"messages": messages, "next_cursor": next_cursor})
+
+
+@app.get("/messages/user/{user_id}/stream")
+async def stream_messages_for_user(user_id: int):
+    """
+    New messages sent or received by the user, as Server-Sent Events.
+    See server/message_stream.py for the events.
+    """
+    return StreamingResponse(
+        message_hub.events(user_id),
+        media_type="text/event-stream",
+        headers=STREAM_HEADERS,
+    )
+
+
+@app.get("/messages/user/{user_id}/conversations")
+def list_conversations_for_user(
+    user_id: int, page: PageParams = Depends(), con=Depends(get_db)
+):
     try:
-        return get_messages_for_user(con, user_id)
-    finally:
-        con.close()
+        conversations, next_cursor, unread_total = get_conversations_for_user(
+            con, user_id, page
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(
+        {
+            "conversations": conversations,
+            "unread_total": unread_total,
+            "next_cursor": next_cursor,
+        }
+    )
+
+
+@app.get("/messages/conversation/{conversation_id}")
+def list_conversation_messages(
+    conversation_id: int, page: PageParams = Depends(), con=Depends(get_db)
+):
+    try:
+        messages, next_cursor = get_conversation_messages(con, conversation_id, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"messages": messages, "next_cursor": next_cursor})
+
+
+@app.post("/messages/conversation/{conversation_id}/read")
+def read_conversation(
+    conversation_id: int, payload: ConversationRead, con=Depends(get_db)
+):
+    read_id = mark_conversation_read(con, conversation_id, payload.user_id)
+    con.commit()
+
+    if read_id is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    return {"message": "Conversation marked as read"}
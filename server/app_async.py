@@ -0,0 +1,786 @@
+"""
+The same API as server/app.py, but with async endpoints on top of the
+async data access layer in server/db_async.py.
+
+Run it next to the sync app to compare them:
+    uvicorn server.app:app --port 8000
+    uvicorn server.app_async:app --port 8001
+"""
+
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from psycopg.rows import dict_row
+from psycopg_pool import PoolTimeout
+
+from server.cache import reference_cache, row_cache, start_row_cache, stop_row_cache
+from server.http_cache import (
+    cache_headers,
+    is_not_modified,
+    not_modified_response,
+    page_etag,
+    row_etag,
+)
+from server.message_stream import (
+    STREAM_HEADERS,
+    message_hub,
+    start_message_stream,
+    stop_message_stream,
+)
+from server.notify import listener
+from server.stats import group_stats, stats_refresher
+from server.responses import (
+    EXPORT_MEDIA_TYPES,
+    CompressionMiddleware,
+    FastJSONResponse,
+    encode_export,
+)
+from server.pool_async import async_pool, get_async_db
+from server.schemas import (
+    ListingCreate,
+    UserCreate,
+    CompanyCreate,
+    AddressCreate,
+    FeatureCreate,
+    ListingPriceUpdate,
+    ListingStatusUpdate,
+    ConversationRead,
+    MessageCreate,
+    SavedSearchCreate,
+    ListingFilters,
+    ListingExport,
+    ListingClusters,
+    ListingBatch,
+    PageParams,
+    StatsDimension,
+)
+from server.db_async import (
+    create_listing,
+    save_listings_batch,
+    delete_listing,
+    update_listing,
+    get_all_listings_full,
+    iter_listing_batches,
+    get_one_listing_full,
+    get_listing_detail,
+    get_listing_clusters,
+    get_listing_facets,
+    listing_query,
+    get_all_users,
+    create_user,
+    get_one_user,
+    delete_user,
+    update_user,
+    get_all_companies,
+    get_one_company,
+    create_company,
+    delete_company,
+    update_company,
+    get_all_addresses,
+    get_one_address,
+    create_address,
+    delete_address,
+    update_address,
+    get_all_features,
+    get_one_feature,
+    create_feature,
+    delete_feature,
+    update_feature,
+    get_all_property_types,
+    get_all_statuses,
+    get_all_roles,
+    update_listing_price,
+    update_listing_status,
+    create_message,
+    get_conversation_messages,
+    get_conversations_for_user,
+    get_messages_for_listing,
+    get_messages_for_user,
+    mark_conversation_read,
+    get_saved_searches_for_user,
+    create_saved_search,
+    delete_saved_search,
+    get_alerts_for_user,
+    get_listing_stats,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await async_pool.open()
+    # Every worker listens for changed listings and users, so it can cache them
+    start_row_cache(listener)
+    # Pushes new messages to the users' open streams
+    start_message_stream(listener)
+    # Keeps the precomputed /stats up to date
+    stats_refresher.start()
+    yield
+    stats_refresher.stop()
+    stop_message_stream(listener)
+    stop_row_cache(listener)
+    listener.stop()
+    await async_pool.close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[
+        "http://localhost:5173",
+        "http://127.0.0.1:5173",
+        "http://localhost:5174",
+        "http://127.0.0.1:5174",
+    ],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Big responses (pages of listings) are sent brotli or gzip compressed
+app.add_middleware(CompressionMiddleware)
+
+
+security = HTTPBasic()
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request, exc):
+    # All connections are busy, ask the client to try again shortly
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
+@app.get("/pool/stats")
+async def read_pool_stats():
+    return async_pool.get_stats()
+
+
+async def get_user_by_email(con, email: str):
+    async with con.cursor(row_factory=dict_row) as cur:
+        await cur.execute("SELECT * FROM users WHERE mail = %s", (email,))
+        return await cur.fetchone()
+
+
+@app.post("/login")
+async def login(
+    credentials: HTTPBasicCredentials = Depends(security),
+    con=Depends(get_async_db),
+):
+    user = await get_user_by_email(con, credentials.username)
+    if not user or user["password"] != credentials.password:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    user.pop("password", None)
+    return {"user": user}
+
+
+@app.get("/listings")
+async def read_listings(
+    request: Request,
+    filters: ListingFilters = Depends(),
+    con=Depends(get_async_db),
+):
+    try:
+        listings, next_cursor = await get_all_listings_full(con, filters)
+        facets = await get_listing_facets(con, filters) if filters.facets else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 304 when no listing on this page (and no facet count) changed since
+    # the client fetched it
+    headers = cache_headers(page_etag(request.url.query, listings, next_cursor, facets))
+    if is_not_modified(request, headers["ETag"]):
+        return not_modified_response(headers)
+    content = {"listings": listings, "next_cursor": next_cursor}
+    if facets is not None:
+        content["facets"] = facets
+    return FastJSONResponse(content, headers=headers)
+
+
+@app.get("/listings/export")
+async def export_listings(filters: ListingExport = Depends()):
+    """
+    Every listing matching the search, streamed as NDJSON or CSV.
+    Memory use stays the same however many listings there are.
+    """
+    # Once the response has started it is too late for a 400
+    try:
+        listing_query(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def chunks():
+        # The connection is taken here and not with Depends(get_async_db), so
+        # it stays ours for as long as the response is streaming
+        async with async_pool.connection() as con:
+            number = 0
+            async for rows in iter_listing_batches(con, filters):
+                yield encode_export(rows, filters.format, first=number == 0)
+                number += 1
+
+    return StreamingResponse(
+        chunks(),
+        media_type=EXPORT_MEDIA_TYPES[filters.format],
+        headers={
+            "Content-Disposition": f'attachment; filename="listings.{filters.format}"'
+        },
+    )
+
+
+@app.get("/listings/clusters")
+async def read_listing_clusters(
+    filters: ListingClusters = Depends(), con=Depends(get_async_db)
+):
+    """
+    The listings in a map viewport grouped into clusters for the zoom level,
+    with their number, center and price range. A cluster of one listing
+    has its listing_id.
+    """
+    try:
+        clusters = await get_listing_clusters(con, filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"clusters": clusters})
+
+
+@app.get("/listings/{id}")
+async def read_one_listing(id: int, request: Request, con=Depends(get_async_db)):
+    listing = await get_one_listing_full(con, id)
+    if listing is None:
+        raise HTTPException(status_code=404, detail="Listing not found")
+
+    headers = cache_headers(row_etag("listing", listing), listing["updated_at"])
+    if is_not_modified(request, headers["ETag"], listing["updated_at"]):
+        return not_modified_response(headers)
+    return FastJSONResponse(listing, headers=headers)
+
+
+@app.get("/listings/{id}/detail")
+async def read_listing_detail(id: int, con=Depends(get_async_db)):
+    # Everything the listing page needs in one request
+    listing = await get_listing_detail(con, id)
+    if listing is None:
+        raise HTTPException(status_code=404, detail="Listing not found")
+    return FastJSONResponse(listing)
+
+
+@app.post("/listings")
+async def add_listing(listing: ListingCreate, con=Depends(get_async_db)):
+    # We take the data from the "listing" variable (the Schema)
+    new_id = await create_listing(
+        con,
+        listing.title,
+        listing.description,
+        listing.price,
+        listing.living_area,
+        listing.lot_size,
+        listing.room_count,
+        listing.year_built,
+        listing.floor_number,
+        listing.energy_class,
+        listing.renovation_year,
+        listing.address_id,
+        listing.property_type_id,
+        listing.realtor_id,
+        listing.status_id,
+    )
+
+    await con.commit()  # IMPORTANT: Save the changes!
+
+    return {"message": "Listing created successfully", "id": new_id}
+
+
+@app.post("/listings/batch")
+async def save_listings(batch: ListingBatch, con=Depends(get_async_db)):
+    # Many listings in one request and one transaction. Items with an id
+    # update that listing, the others are created. Items with unknown ids get
+    # an error, the rest are saved.
+    results = await save_listings_batch(con, batch.listings)
+    await con.commit()
+    statuses = [result.get("status", "failed") for result in results]
+    return {
+        "created": statuses.count("created"),
+        "updated": statuses.count("updated"),
+        "unchanged": statuses.count("unchanged"),
+        "failed": statuses.count("failed"),
+        "results": results,
+    }
+
+
+@app.delete("/listings/{id}")
+async def remove_listing(id: int, con=Depends(get_async_db)):
+    deleted_id = await delete_listing(con, id)
+    await con.commit()
+
+    if deleted_id is None:
+        raise HTTPException(status_code=404, detail="Listing not found")
+    return {"message": "Listing deleted successfully"}
+
+
+@app.put("/listings/{id}")
+async def change_listing(id: int, listing: ListingCreate, con=Depends(get_async_db)):
+    updated_row = await update_listing(
+        con,
+        id,
+        listing.title,
+        listing.description,
+        listing.price,
+        listing.living_area,
+        listing.lot_size,
+        listing.room_count,
+        listing.year_built,
+        listing.floor_number,
+        listing.energy_class,
+        listing.renovation_year,
+        listing.address_id,
+        listing.property_type_id,
+        listing.realtor_id,
+        listing.status_id,
+    )
+
+    await con.commit()
+
+    if updated_row is None:
+        raise HTTPException(status_code=404, detail="Listing not found.")
+    return {"message": "Listing updated successfully!"}
+
+
+# USER
+
+
+@app.get("/users")
+async def read_users(page: PageParams = Depends(), con=Depends(get_async_db)):
+    try:
+        users, next_cursor = await get_all_users(con, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"users": users, "next_cursor": next_cursor})
+
+
+@app.post("/users")
+async def add_user(user: UserCreate, con=Depends(get_async_db)):
+    new_id = await create_user(
+        con,
+        user.first_name,
+        user.surname,
+        user.mail,
+        user.password,
+        user.phone_number,
+        user.birthdate,
+        user.role_id,
+        user.address_id,
+        user.company_id,
+    )
+    await con.commit()
+    return {"message": "User created successfully", "id": new_id}
+
+
+@app.get("/users/{id}")
+async def read_one_user(id: int, con=Depends(get_async_db)):
+    user = await get_one_user(con, id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+
+@app.delete("/users/{id}")
+async def remove_user(id: int, con=Depends(get_async_db)):
+    deleted_id = await delete_user(con, id)
+    await con.commit()
+    if deleted_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"message": "User deleted successfully"}
+
+
+@app.put("/users/{id}")
+async def change_user(id: int, user: UserCreate, con=Depends(get_async_db)):
+    updated_row = await update_user(
+        con,
+        id,
+        user.first_name,
+        user.surname,
+        user.mail,
+        user.password,
+        user.phone_number,
+        user.birthdate,
+        user.role_id,
+        user.address_id,
+        user.company_id,
+    )
+    await con.commit()
+    if updated_row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"message": "User updated successfully"}
+
+
+# COMPANIES ENDPOINTS
+
+
+@app.get("/companies")
+async def read_companies(page: PageParams = Depends(), con=Depends(get_async_db)):
+    try:
+        companies, next_cursor = await get_all_companies(con, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"companies": companies, "next_cursor": next_cursor})
+
+
+@app.get("/companies/{id}")
+async def read_one_company(id: int, con=Depends(get_async_db)):
+    company = await get_one_company(con, id)
+    if company is None:
+        raise HTTPException(status_code=404, detail="Company not found")
+    return company
+
+
+@app.post("/companies")
+async def add_company(company: CompanyCreate, con=Depends(get_async_db)):
+    new_id = await create_company(con, company.name, company.address_id)
+    await con.commit()
+    return {"message": "Company created successfully", "id": new_id}
+
+
+@app.delete("/companies/{id}")
+async def remove_company(id: int, con=Depends(get_async_db)):
+    deleted_id = await delete_company(con, id)
+    await con.commit()
+    if deleted_id is None:
+        raise HTTPException(status_code=404, detail="Company not found")
+    return {"message": "Company deleted successfully"}
+
+
+@app.put("/companies/{id}")
+async def change_company(id: int, company: CompanyCreate, con=Depends(get_async_db)):
+    updated_id = await update_company(con, id, company.name, company.address_id)
+    await con.commit()
+    if updated_id is None:
+        raise HTTPException(status_code=404, detail="Company not found")
+    return {"message": "Company updated successfully"}
+
+
+# ADDRESSES ENDPOINTS
+
+
+@app.get("/addresses")
+async def read_addresses(page: PageParams = Depends(), con=Depends(get_async_db)):
+    try:
+        addresses, next_cursor = await get_all_addresses(con, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"addresses": addresses, "next_cursor": next_cursor})
+
+
+@app.get("/addresses/{id}")
+async def read_one_address(id: int, con=Depends(get_async_db)):
+    address = await get_one_address(con, id)
+    if address is None:
+        raise HTTPException(status_code=404, detail="Address not found")
+    return address
+
+
+@app.post("/addresses")
+async def add_address(address: AddressCreate, con=Depends(get_async_db)):
+    new_id = await create_address(
+        con,
+        address.street,
+        address.city,
+        address.postcode,
+        address.country,
+        address.latitude,
+        address.longitude,
+    )
+    await con.commit()
+    return {"message": "Address created successfully", "id": new_id}
+
+
+@app.delete("/addresses/{id}")
+async def remove_address(id: int, con=Depends(get_async_db)):
+    deleted_id = await delete_address(con, id)
+    await con.commit()
+    if deleted_id is None:
+        raise HTTPException(status_code=404, detail="Address not found")
+    return {"message": "Address deleted successfully"}
+
+
+@app.put("/addresses/{id}")
+async def change_address(id: int, address: AddressCreate, con=Depends(get_async_db)):
+    updated_id = await update_address(
+        con,
+        id,
+        address.street,
+        address.city,
+        address.postcode,
+        address.country,
+        address.latitude,
+        address.longitude,
+    )
+    await con.commit()
+    if updated_id is None:
+        raise HTTPException(status_code=404, detail="Address not found")
+    return {"message": "Address updated successfully"}
+
+
+# FEATURE ENDPOINTS
+
+
+@app.get("/features")
+async def read_features(page: PageParams = Depends(), con=Depends(get_async_db)):
+    try:
+        features, next_cursor = await get_all_features(con, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"features": features, "next_cursor": next_cursor})
+
+
+@app.get("/features/{id}")
+async def read_one_feature(id: int, con=Depends(get_async_db)):
+    feature = await get_one_feature(con, id)
+    if feature is None:
+        raise HTTPException(status_code=404, detail="Feature not found")
+    return feature
+
+
+@app.post("/features")
+async def add_feature(feature: FeatureCreate, con=Depends(get_async_db)):
+    new_id = await create_feature(con, feature.name)
+    await con.commit()
+    return {"message": "Feature created successfully", "id": new_id}
+
+
+@app.delete("/features/{id}")
+async def remove_feature(id: int, con=Depends(get_async_db)):
+    deleted_id = await delete_feature(con, id)
+    await con.commit()
+    if deleted_id is None:
+        raise HTTPException(status_code=404, detail="Feature not found")
+    return {"message": "Feature deleted successfully"}
+
+
+@app.put("/features/{id}")
+async def change_feature(id: int, feature: FeatureCreate, con=Depends(get_async_db)):
+    updated_id = await update_feature(con, id, feature.name)
+    await con.commit()
+    if updated_id is None:
+        raise HTTPException(status_code=404, detail="Feature not found")
+    return {"message": "Feature updated successfully"}
+
+
+# LOOKUPS (served from the in-process cache)
+
+
+@app.get("/property-types")
+async def read_property_types(con=Depends(get_async_db)):
+    return {"property_types": await get_all_property_types(con)}
+
+
+@app.get("/statuses")
+async def read_statuses(con=Depends(get_async_db)):
+    return {"statuses": await get_all_statuses(con)}
+
+
+@app.get("/roles")
+async def read_roles(con=Depends(get_async_db)):
+    return {"roles": await get_all_roles(con)}
+
+
+@app.get("/cache/stats")
+async def read_cache_stats():
+    return {"reference": reference_cache.stats(), "rows": row_cache.stats()}
+
+
+# SAVED SEARCHES
+
+
+@app.get("/saved-searches/user/{user_id}")
+async def list_saved_searches_for_user(
+    user_id: int, page: PageParams = Depends(), con=Depends(get_async_db)
+):
+    try:
+        saved_searches, next_cursor = await get_saved_searches_for_user(
+            con, user_id, page
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(
+        {"saved_searches": saved_searches, "next_cursor": next_cursor}
+    )
+
+
+@app.post("/saved-searches")
+async def add_saved_search(search: SavedSearchCreate, con=Depends(get_async_db)):
+    try:
+        new_id = await create_saved_search(con, search)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await con.commit()
+    return {"message": "Saved search created successfully", "id": new_id}
+
+
+@app.delete("/saved-searches/{id}")
+async def remove_saved_search(id: int, con=Depends(get_async_db)):
+    deleted_id = await delete_saved_search(con, id)
+    await con.commit()
+    if deleted_id is None:
+        raise HTTPException(status_code=404, detail="Saved search not found")
+    return {"message": "Saved search deleted successfully"}
+
+
+@app.get("/saved-searches/user/{user_id}/alerts")
+async def list_alerts_for_user(
+    user_id: int, page: PageParams = Depends(), con=Depends(get_async_db)
+):
+    try:
+        alerts, next_cursor = await get_alerts_for_user(con, user_id, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"alerts": alerts, "next_cursor": next_cursor})
+
+
+# STATS ENDPOINTS
+
+
+@app.get("/stats")
+async def read_stats(con=Depends(get_async_db)):
+    """
+    Market statistics over all listings and per city, property type and
+    status: number of listings, price and price per m² percentiles and
+    average living area. Precomputed, see server/stats.py.
+    """
+    rows, refreshed_at = await get_listing_stats(con)
+    return FastJSONResponse({"refreshed_at": refreshed_at, **group_stats(rows)})
+
+
+@app.get("/stats/{dimension}")
+async def read_stats_by(dimension: StatsDimension, con=Depends(get_async_db)):
+    rows, refreshed_at = await get_listing_stats(con, dimension)
+    return FastJSONResponse(
+        {"refreshed_at": refreshed_at, "stats": group_stats(rows)[dimension]}
+    )
+
+
+# PATCH LISTINGS
+
+
+@app.patch("/listings/{id}/price")
+async def update_price(id: int, update: ListingPriceUpdate, con=Depends(get_async_db)):
+    # Adding the new price
+    updated_id = await update_listing_price(con, id, update.price)
+    await con.commit()
+
+    if updated_id is None:
+        raise HTTPException(status_code=404, detail="Listing not found")
+
+    return {"message": "Price updated successfully"}
+
+
+@app.patch("/listings/{id}/status")
+async def update_status(
+    id: int, update: ListingStatusUpdate, con=Depends(get_async_db)
+):
+    # Adding the new status
+    updated_id = await update_listing_status(con, id, update.status_id)
+    await con.commit()
+
+    if updated_id is None:
+        raise HTTPException(status_code=404, detail="Listing not found")
+
+    return {"message": "Status updated successfully"}
+
+
+# MESSAGE LISTINGS
+
+
+@app.post("/messages")
+async def add_message(payload: MessageCreate, con=Depends(get_async_db)):
+    msg = await create_message(
+        con,
+        payload.sender_id,
+        payload.receiver_id,
+        payload.listing_id,
+        payload.content,
+    )
+    await con.commit()
+    return msg
+
+
+@app.get("/messages/listing/{listing_id}")
+async def list_messages_for_listing(
+    listing_id: int, page: PageParams = Depends(), con=Depends(get_async_db)
+):
+    try:
+        messages, next_cursor = await get_messages_for_listing(con, listing_id, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"messages": messages, "next_cursor": next_cursor})
+
+
+@app.get("/messages/user/{user_id}")
+async def list_messages_for_user(
+    user_id: int, page: PageParams = Depends(), con=Depends(get_async_db)
+):
+    try:
+        messages, next_cursor = await get_messages_for_user(con, user_id, page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"messages": messages, "next_cursor": next_cursor})
+
+
+@app.get("/messages/user/{user_id}/stream")
+async def stream_messages_for_user(user_id: int):
+    """
+    New messages sent or received by the user, as Server-Sent Events.
+    See server/message_stream.py for the events.
+    """
+    return StreamingResponse(
+        message_hub.events(user_id),
+        media_type="text/event-stream",
+        headers=STREAM_HEADERS,
+    )
+
+
+@app.get("/messages/user/{user_id}/conversations")
+async def list_conversations_for_user(
+    user_id: int, page: PageParams = Depends(), con=Depends(get_async_db)
+):
+    try:
+        conversations, next_cursor, unread_total = await get_conversations_for_user(
+            con, user_id, page
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse(
+        {
+            "conversations": conversations,
+            "unread_total": unread_total,
+            "next_cursor": next_cursor,
+        }
+    )
+
+
+@app.get("/messages/conversation/{conversation_id}")
+async def list_conversation_messages(
+    conversation_id: int, page: PageParams = Depends(), con=Depends(get_async_db)
+):
+    try:
+        messages, next_cursor = await get_conversation_messages(
+            con, conversation_id, page
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return FastJSONResponse({"messages": messages, "next_cursor": next_cursor})
+
+
+@app.post("/messages/conversation/{conversation_id}/read")
+async def read_conversation(
+    conversation_id: int, payload: ConversationRead, con=Depends(get_async_db)
+):
+    read_id = await mark_conversation_read(con, conversation_id, payload.user_id)
+    await con.commit()
+
+    if read_id is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    return {"message": "Conversation marked as read"}
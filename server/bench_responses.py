@@ -0,0 +1,86 @@
+"""
+Benchmark of the /listings response pipeline: bytes and CPU time per
+response, for the old pipeline (jsonable_encoder + JSONResponse) and the
+new one (FastJSONResponse), uncompressed and compressed.
+
+    python -m server.bench_responses --limit 100 --repeat 200
+
+Uses the rows of the first page of GET /listings from the database in
+.env, so seed it first (e.g. python -m server.seed --bulk).
+"""
+
+import argparse
+import gzip
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from server.db import get_all_listings_full
+from server.db_setup import get_connection
+from server.responses import BROTLI_QUALITY, GZIP_LEVEL, FastJSONResponse, brotli
+from server.schemas import ListingFilters
+
+
+def cpu_ms(func, repeat):
+    """CPU time of one call to func in milliseconds, averaged over repeat calls."""
+    start = time.process_time()
+    for _ in range(repeat):
+        result = func()
+    return (time.process_time() - start) * 1000 / repeat, result
+
+
+def run(limit, repeat, fields):
+    con = get_connection()
+    try:
+        listings, next_cursor = get_all_listings_full(
+            con, ListingFilters(limit=limit, fields=fields)
+        )
+    finally:
+        con.close()
+    content = {"listings": listings, "next_cursor": next_cursor}
+    print(f"{len(listings)} listings (fields={fields}), {repeat} runs each\n")
+
+    before_ms, before = cpu_ms(
+        lambda: JSONResponse(jsonable_encoder(content)).body, repeat
+    )
+    after_ms, after = cpu_ms(lambda: FastJSONResponse(content).body, repeat)
+
+    results = [
+        ("before: jsonable_encoder + json", before_ms, len(before)),
+        ("after: orjson", after_ms, len(after)),
+    ]
+
+    gzip_ms, gzipped = cpu_ms(
+        lambda: gzip.compress(after, compresslevel=GZIP_LEVEL), repeat
+    )
+    results.append(
+        (f"after + gzip level {GZIP_LEVEL}", after_ms + gzip_ms, len(gzipped))
+    )
+    if brotli is not None:
+        br_ms, compressed = cpu_ms(
+            lambda: brotli.compress(after, quality=BROTLI_QUALITY), repeat
+        )
+        results.append(
+            (
+                f"after + brotli quality {BROTLI_QUALITY}",
+                after_ms + br_ms,
+                len(compressed),
+            )
+        )
+    else:
+        print("(brotli is not installed, skipping it)\n")
+
+    print(f"{'pipeline':<36} {'CPU ms':>8} {'bytes':>9}")
+    for name, ms, size in results:
+        print(f"{name:<36} {ms:>8.3f} {size:>9}")
+    print(f"\nSerialization is {before_ms / after_ms:.1f}x faster with orjson")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /listings responses")
+    parser.add_argument("--limit", type=int, default=100, help="listings per page")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--fields", choices=["full", "card"], default="full")
+    args = parser.parse_args()
+    run(args.limit, args.repeat, args.fields)
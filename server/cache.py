@@ -0,0 +1,169 @@
+"""
+In-process caches, so hot reads don't have to go to Postgres.
+
+reference_cache holds reference data (features, property types, statuses,
+roles). These tables are tiny and almost never change. Code that changes a
+table calls invalidate() with the table name, which drops every entry for
+it in this process. Other worker processes pick the change up when their
+entries expire, so keep CACHE_TTL short if you run several workers.
+
+row_cache holds single listings and users. Triggers on those tables NOTIFY
+every worker about changed rows (see server/notify.py), so a write made by
+any worker drops the row everywhere within milliseconds.
+
+Entries expire after their TTL, and when a cache is full the least
+recently used entry is dropped.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Cache settings, can be changed in .env
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "1024"))
+
+
+class TTLCache:
+    """
+    Thread safe key/value cache with a time to live and LRU eviction.
+    Keys are tuples that start with the table name, e.g. ("features", 3).
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_size=CACHE_MAX_SIZE, enabled=True):
+        self.ttl = ttl
+        self.max_size = max_size
+        # A disabled cache never stores anything
+        self.enabled = enabled
+        # key -> (expires_at, value), oldest used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        # Bumped on every invalidation, see get_or_load()
+        self.version = 0
+
+    def get(self, key):
+        """The cached value, or None if key isn't cached (or expired)."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def set(self, key, value, version=None):
+        """
+        Cache value under key. With version, nothing is cached if anything
+        was invalidated since that version was read.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get_or_load(self, key, load):
+        """
+        Return the cached value for key, or call load() and cache what it
+        returns. None (row not found) is not cached.
+        """
+        value = self.get(key)
+        if value is None:
+            # If the row changes while we load it, the invalidation comes
+            # in before our set() and the old row must not be cached
+            version = self.version
+            value = load()
+            if value is not None:
+                self.set(key, value, version)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self.version += 1
+            self._stats["invalidations"] += 1
+
+    def invalidate(self, table):
+        """Drop every entry for the given table."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == table]:
+                del self._entries[key]
+            self.version += 1
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.version += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "enabled": self.enabled,
+                "hit_ratio": round(self._stats["hits"] / lookups, 3) if lookups else 0,
+            }
+
+
+# Features, property types, statuses and roles
+reference_cache = TTLCache()
+
+# Single listings and users. These change more often, so every worker drops
+# changed rows when Postgres notifies it (see migration 0005 and
+# invalidate_from_notification below).
+ROW_CACHE_TTL = float(os.getenv("ROW_CACHE_TTL", "60"))
+ROW_CACHE_MAX_SIZE = int(os.getenv("ROW_CACHE_MAX_SIZE", "10000"))
+INVALIDATION_CHANNEL = "cache_invalidation"
+
+# Only enabled while a listener delivers the invalidations, see
+# start_row_cache(). Without one the rows could go stale.
+row_cache = TTLCache(ttl=ROW_CACHE_TTL, max_size=ROW_CACHE_MAX_SIZE, enabled=False)
+
+
+def invalidate_from_notification(payload):
+    """
+    Listener callback for the cache_invalidation channel. The payload is
+    "<table>:<id>" or "<table>:*".
+    """
+    if payload is None:
+        # The listener reconnected and may have missed notifications
+        row_cache.clear()
+        return
+    table, _, row_id = payload.partition(":")
+    if row_id == "*":
+        row_cache.invalidate(table)
+    else:
+        row_cache.delete((table, int(row_id)))
+
+
+def start_row_cache(listener):
+    """Subscribe the row cache to invalidations and turn it on."""
+    listener.subscribe(INVALIDATION_CHANNEL, invalidate_from_notification)
+    listener.start()
+    # Changes made before the listener is up would never be invalidated
+    if listener.wait_ready(timeout=5):
+        row_cache.enabled = True
+    else:
+        print("Could not start the cache listener, row cache is off")
+
+
+def stop_row_cache(listener):
+    row_cache.enabled = False
+    row_cache.clear()
+    listener.unsubscribe(INVALIDATION_CHANNEL, invalidate_from_notification)
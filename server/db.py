@@ -1,47 +1,761 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import math
+
+from psycopg2.extras import RealDictCursor, execute_values
+from server.cache import reference_cache, row_cache
+from server.pagination import (
+    BY_ID,
+    Sort,
+    fetch_page,
+    nulls_last,
+    page_query,
+    page_result,
+    sorted_query,
+)
+from server.schemas import ListingExport, ListingFilters, PageParams
 
 
 # LISTINGS FUNCTIONS
 
 
-def get_all_listings_full(con):
-    with con, con.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
+# Sort options for GET /listings. Price and living area may be NULL, those
+# listings come last (created_at is NOT NULL since migration 0019).
+LISTING_SORTS = {
+    "newest": Sort("l.created_at", "created_at", "DESC", "timestamptz", "l.id"),
+    "price_asc": nulls_last("l.price", "price", "ASC", id_column="l.id"),
+    "price_desc": nulls_last("l.price", "price", "DESC", id_column="l.id"),
+    "area_desc": nulls_last("l.living_area", "living_area", "DESC", id_column="l.id"),
+}
+
+
+# The listing columns we send to clients (not the internal search_vector)
+LISTING_FIELDS = """
+    l.id, l.address_id, l.property_type_id, l.realtor_id, l.status_id,
+    l.title, l.description, l.price, l.living_area, l.lot_size,
+    l.room_count, l.year_built, l.floor_number, l.energy_class,
+    l.created_at, l.renovation_year, l.updated_at
+"""
+
+LISTINGS_FULL_SQL = f"""
+    SELECT
+        {LISTING_FIELDS},
+        a.street AS address,
+        a.city,
+        a.postcode,
+        a.country,
+        a.latitude,
+        a.longitude,
+        pt.name AS property_type
+    FROM listings l
+    LEFT JOIN addresses a ON l.address_id = a.id
+    LEFT JOIN property_types pt ON l.property_type_id = pt.id
+"""
+
+
+# The columns a listing card on the main page needs (fields=card)
+LISTING_CARD_FIELDS = """
+    l.id, l.realtor_id, l.title, l.price, l.living_area, l.room_count,
+    l.created_at, l.updated_at
+"""
+
+# Cover image and feature names per listing. These are scalar subqueries
+# rather than joins so Postgres only runs them for the rows on the page,
+# after sorting and LIMIT.
+LISTING_CARD_EXTRAS = """
+    (
+        SELECT li.url FROM listing_images li
+        WHERE li.listing_id = l.id
+        ORDER BY li.id
+        LIMIT 1
+    ) AS image_url,
+    ARRAY(
+        SELECT f.name FROM listing_features lf
+        JOIN features f ON f.id = lf.feature_id
+        WHERE lf.listing_id = l.id
+        ORDER BY f.name
+    ) AS features
+"""
+
+
+def listing_select(fields="full", search=False, near=False):
+    """
+    The SELECT for listing lists. fields="card" only returns the columns a
+    card needs. With search=True the search rank is added, which takes the
+    search text as a parameter. search="street" adds a rank of 0 instead,
+    for listings found only by their street. With near=True the distance in
+    km from a point is added, which takes its latitude and longitude as
+    parameters.
+    """
+    if fields == "card":
+        columns = f"{LISTING_CARD_FIELDS}, a.street AS address, a.city"
+    else:
+        columns = (
+            f"{LISTING_FIELDS}, a.street AS address, a.city, a.postcode, a.country"
+        )
+    rank = ""
+    query = ""
+    if search == "street":
+        rank = f", {STREET_RANK_SQL} AS rank"
+    elif search:
+        rank = ", ts_rank(l.search_vector, query) AS rank"
+        query = "CROSS JOIN websearch_to_tsquery('swedish', %s) AS query"
+    distance = f", {DISTANCE_SQL} AS distance_km" if near else ""
+    center = (
+        "CROSS JOIN (SELECT %s::float8 AS lat, %s::float8 AS lon) AS center"
+        if near
+        else ""
+    )
+    return f"""
+        SELECT
+            {columns},
+            a.latitude,
+            a.longitude,
+            pt.name AS property_type,
+            {LISTING_CARD_EXTRAS}
+            {rank}
+            {distance}
+        FROM listings l
+        {query}
+        {center}
+        LEFT JOIN addresses a ON l.address_id = a.id
+        LEFT JOIN property_types pt ON l.property_type_id = pt.id
+    """
+
+
+# Best matches first. Listings found only by street name rank 0.
+RELEVANCE_SORT = Sort("ts_rank(l.search_vector, query)", "rank", "DESC", "real", "l.id")
+# They all rank the same, so a page of them is read backwards by id
+STREET_RANK_SQL = "0::real"
+STREET_RELEVANCE_SORT = RELEVANCE_SORT._replace(column=STREET_RANK_SQL)
+
+# Distance from the center of a radius search (distance_km is in 0009)
+DISTANCE_SQL = "distance_km(center.lat, center.lon, a.latitude, a.longitude)"
+DISTANCE_SORT = Sort(DISTANCE_SQL, "distance_km", "ASC", "float8", "l.id")
+
+KM_PER_DEGREE = 111.32  # of latitude, and of longitude at the equator
+
+# The spatial index (0010) is on exactly this expression
+LOCATION_IN_BOX_SQL = (
+    "point(a.longitude, a.latitude) <@ box(point(%s, %s), point(%s, %s))"
+)
+
+
+def viewport(filters):
+    """(lat_min, lat_max, lon_min, lon_max) of the filters, or None."""
+    box = (filters.lat_min, filters.lat_max, filters.lon_min, filters.lon_max)
+    if all(value is None for value in box):
+        return None
+    if any(value is None for value in box):
+        raise ValueError("lat_min, lat_max, lon_min and lon_max must be given together")
+    if filters.lat_min > filters.lat_max:
+        raise ValueError("lat_min must not be larger than lat_max")
+    if filters.lon_min > filters.lon_max:
+        # A viewport across the 180th meridian, not needed for our maps
+        raise ValueError("lon_min must not be larger than lon_max")
+    return box
+
+
+def radius_search(filters):
+    """(lat, lon, radius_km) of the filters, or None."""
+    circle = (filters.lat, filters.lon, filters.radius_km)
+    if all(value is None for value in circle):
+        return None
+    if any(value is None for value in circle):
+        raise ValueError("lat, lon and radius_km must be given together")
+    return circle
+
+
+def radius_box(lat, lon, radius_km):
+    """
+    The box around a circle, so a radius search can use the spatial index
+    first and only compute exact distances for the listings inside it.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    if abs(lat) + lat_delta >= 90:
+        # The circle contains a pole
+        return max(-90, lat - lat_delta), min(90, lat + lat_delta), -180, 180
+    # A degree of longitude is shortest on the edge closest to the pole
+    lon_delta = radius_km / (
+        KM_PER_DEGREE * math.cos(math.radians(abs(lat) + lat_delta))
+    )
+    return (
+        lat - lat_delta,
+        lat + lat_delta,
+        max(-180, lon - lon_delta),
+        min(180, lon + lon_delta),
+    )
+
+
+def location_conditions(filters):
+    """WHERE conditions and parameters for the map (viewport and radius) search."""
+    where = []
+    params = []
+
+    box = viewport(filters)
+    if box is not None:
+        lat_min, lat_max, lon_min, lon_max = box
+        where.append(LOCATION_IN_BOX_SQL)
+        params += [lon_min, lat_min, lon_max, lat_max]
+
+    circle = radius_search(filters)
+    if circle is not None:
+        lat, lon, radius_km = circle
+        lat_min, lat_max, lon_min, lon_max = radius_box(lat, lon, radius_km)
+        where.append(LOCATION_IN_BOX_SQL)
+        params += [lon_min, lat_min, lon_max, lat_max]
+        where.append("distance_km(%s, %s, a.latitude, a.longitude) <= %s")
+        params += [lat, lon, radius_km]
+
+    return where, params
+
+
+def like_prefix(text):
+    """A LIKE pattern for values starting with text."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+# The search text matches the full text (GIN index on search_vector), or the
+# start of the street name (addresses_street_prefix_idx, 0022)
+TEXT_MATCH_SQL = "l.search_vector @@ websearch_to_tsquery('swedish', %s)"
+STREET_MATCH_SQL = """
+    l.address_id IN (
+        SELECT id FROM addresses WHERE lower(street) LIKE lower(%s)
+    )
+"""
+# Both sides as a UNION of ids, so each one is read from its own index
+SEARCH_MATCH_SQL = """
+    l.id IN (
+        SELECT id FROM listings
+        WHERE search_vector @@ websearch_to_tsquery('swedish', %s)
+        UNION
+        SELECT sl.id FROM listings sl
+        JOIN addresses sa ON sa.id = sl.address_id
+        WHERE lower(sa.street) LIKE lower(%s)
+    )
+"""
+
+# A search text with at most this many full text matches has them looked up
+# in the GIN index and sorted. With more, a page is read in the order of the
+# sort index. The planner can't tell the two apart for a word it has no
+# statistics for: it guesses a few hundred matches, and reads the whole sort
+# index when there are none. So the query counts them first.
+SEARCH_SORT_MAX_MATCHES = 1000
+
+# Up to SEARCH_SORT_MAX_MATCHES + 1 full text matches
+TEXT_MATCH_IDS_SQL = """
+    SELECT id FROM listings
+    WHERE search_vector @@ websearch_to_tsquery('swedish', %s)
+    LIMIT %s
+"""
+FEW_TEXT_MATCHES_SQL = f"""
+    l.id = ANY((
+        SELECT CASE WHEN cardinality(ids) <= %s THEN ids END
+        FROM (SELECT ARRAY({TEXT_MATCH_IDS_SQL}) AS ids) AS matches
+    )::int[])
+"""
+# Refers to no listing column, so Postgres checks it once, before the scan
+MANY_TEXT_MATCHES_SQL = f"(SELECT count(*) > %s FROM ({TEXT_MATCH_IDS_SQL}) AS matches)"
+
+
+def search_conditions(q, branch=None):
+    """
+    The WHERE conditions for the search text q. branch="text" only keeps the
+    full text matches, and "few" and "many" only keep them when there are
+    at most, or more than, SEARCH_SORT_MAX_MATCHES of them. branch="street"
+    only keeps the street matches.
+    """
+    count_params = [SEARCH_SORT_MAX_MATCHES, q, SEARCH_SORT_MAX_MATCHES + 1]
+    if branch == "text":
+        return [TEXT_MATCH_SQL], [q]
+    if branch == "few":
+        return [FEW_TEXT_MATCHES_SQL], count_params
+    if branch == "many":
+        return [TEXT_MATCH_SQL, MANY_TEXT_MATCHES_SQL], [q] + count_params
+    if branch == "street":
+        return [STREET_MATCH_SQL], [like_prefix(q)]
+    return [SEARCH_MATCH_SQL], [q, like_prefix(q)]
+
+
+def listing_filter_conditions(filters, branch=None):
+    """
+    Turn ListingFilters into WHERE conditions and their parameters. branch
+    is passed on to search_conditions.
+    """
+    where = []
+    params = []
+
+    if filters.q:
+        where, params = search_conditions(filters.q, branch)
+    if filters.property_type:
+        where.append("LOWER(pt.name) = LOWER(%s)")
+        params.append(filters.property_type)
+    if filters.rooms_min is not None:
+        where.append("l.room_count >= %s")
+        params.append(filters.rooms_min)
+    if filters.rooms_max is not None:
+        where.append("l.room_count <= %s")
+        params.append(filters.rooms_max)
+    if filters.price_min is not None:
+        where.append("l.price >= %s")
+        params.append(filters.price_min)
+    if filters.price_max is not None:
+        where.append("l.price <= %s")
+        params.append(filters.price_max)
+
+    feature_names = [
+        name.strip() for name in (filters.features or "").split(",") if name.strip()
+    ]
+    if feature_names:
+        # All the features in one GIN index probe on feature_ids (0013). An
+        # unknown name becomes id 0, which no listing has, so nothing matches.
+        where.append(
             """
-            SELECT
-                l.*,
-                a.street AS address,
-                a.city,
-                a.postcode,
-                a.country,
-                pt.name AS property_type
-            FROM listings l
-            LEFT JOIN addresses a ON l.address_id = a.id
-            LEFT JOIN property_types pt ON l.property_type_id = pt.id;
+            l.feature_ids @> ARRAY(
+                SELECT COALESCE(f.id, 0)
+                FROM unnest(%s::text[]) AS wanted(name)
+                LEFT JOIN features f ON LOWER(f.name) = LOWER(wanted.name)
+            )
             """
         )
+        params.append(feature_names)
+
+    location_where, location_params = location_conditions(filters)
+    return where + location_where, params + location_params
+
+
+def listing_query(filters, branch=None):
+    """
+    Build the listing search for ListingFilters.
+    Returns the SELECT, its WHERE conditions, the parameters and the Sort.
+    Raises ValueError for an incomplete viewport or radius search.
+    """
+    where, params = listing_filter_conditions(filters, branch)
+    circle = radius_search(filters)
+    relevance = filters.sort == "relevance" and bool(filters.q)
+    if branch == "street" and relevance:
+        # Here they all rank 0 (see listing_page_queries), so the full text
+        # matches are left to the text branch
+        where.append(f"NOT COALESCE({TEXT_MATCH_SQL}, false)")
+        params.append(filters.q)
+
+    # The search query and the center in the SELECT come before the WHERE
+    # parameters
+    search = "street" if branch == "street" and relevance else bool(filters.q)
+    select_params = []
+    if search is True:
+        select_params.append(filters.q)
+    if circle is not None:
+        select_params += [filters.lat, filters.lon]
+
+    if relevance:
+        sort = STREET_RELEVANCE_SORT if branch == "street" else RELEVANCE_SORT
+    elif filters.sort == "distance" and circle is not None:
+        sort = DISTANCE_SORT
+    else:
+        sort = LISTING_SORTS.get(filters.sort, LISTING_SORTS["newest"])
+
+    select_sql = listing_select(filters.fields, search=search, near=circle is not None)
+    return select_sql, where, select_params + params, sort
+
+
+def merged_sort(sort):
+    """sort over the rows of a UNION of listing SELECTs, by column name."""
+    column = f"l.{sort.field}"
+    if sort.null_value is not None:
+        column = f"COALESCE({column}, '{sort.null_value}'::{sort.sql_type})"
+    return sort._replace(column=column)
+
+
+def listing_page_queries(filters):
+    """
+    The queries for one page of the listing search, and the Sort. The
+    queries are run in order until they have found limit + 1 rows together.
+    Raises ValueError like listing_query.
+
+    With a search text, the full text matches and the street matches are
+    each sorted and cut to one page on their own before they are merged,
+    like the inbox in messages_for_user_query. A common street prefix
+    matches thousands of listings, which we would otherwise sort for
+    every page. A listing matching both comes from both branches with the
+    same values, the UNION keeps one of them.
+
+    By relevance every full text match ranks above the listings found only
+    by their street, so the street query only runs once the full text
+    matches run out.
+    """
+    if not filters.q:
+        select_sql, where, params, sort = listing_query(filters)
+        sql, params = page_query(
+            select_sql, where, params, sort, filters.limit, filters.cursor
+        )
+        return [(sql, params)], sort
+
+    relevance = filters.sort == "relevance"
+    queries = []
+    for branch in ("text", "street") if relevance else ("few", "many", "street"):
+        select_sql, where, params, sort = listing_query(filters, branch)
+        queries.append(
+            page_query(select_sql, where, params, sort, filters.limit, filters.cursor)
+        )
+    if relevance:
+        return queries, RELEVANCE_SORT
+
+    sql, params = page_query(
+        f"SELECT * FROM ({' UNION '.join(f'({sql})' for sql, _ in queries)}) l",
+        [],
+        [param for _, params in queries for param in params],
+        merged_sort(sort),
+        filters.limit,
+    )
+    return [(sql, params)], sort
+
+
+def fetch_listing_page(cur, filters):
+    """Run the listing_page_queries, return the page and the next cursor."""
+    queries, sort = listing_page_queries(filters)
+    rows = []
+    for sql, params in queries:
+        cur.execute(sql, params)
+        rows += cur.fetchall()
+        if len(rows) > filters.limit:
+            break
+    return page_result(rows, sort, filters.limit)
+
+
+def get_all_listings_full(con, filters=None):
+    """
+    Return one page of listings matching the filters, and the cursor
+    for the next page (None when this is the last page).
+    """
+    if filters is None:
+        filters = ListingFilters()
+
+    with con, con.cursor(cursor_factory=RealDictCursor) as cur:
+        return fetch_listing_page(cur, filters)
+
+
+# Facet buckets for the filter panel. Rooms: 1, 2, 3, 4 and 5 or more.
+FACET_MAX_ROOMS = 5
+# Prices in SEK, bucket i holds PRICE_BUCKETS[i - 1] <= price < PRICE_BUCKETS[i]
+PRICE_BUCKETS = [2_000_000, 4_000_000, 6_000_000, 10_000_000]
+
+# Counts per property type, status, room bucket and price bucket in one
+# pass over the matching listings (GROUPING SETS), and per feature. The
+# CTE is used twice, so Postgres computes the matches only once. Names are
+# joined after counting, so only a few rows need them.
+LISTING_FACETS_SQL = """
+    WITH matched AS (
+        SELECT
+            l.id,
+            l.property_type_id,
+            l.status_id,
+            LEAST(l.room_count, %s) AS rooms,
+            width_bucket(l.price, %s::numeric[]) AS price_bucket
+        FROM listings l
+        {joins}
+        {where}
+    ),
+    counts AS (
+        SELECT
+            CASE
+                WHEN GROUPING(property_type_id) = 0 THEN 'property_type'
+                WHEN GROUPING(status_id) = 0 THEN 'status'
+                WHEN GROUPING(rooms) = 0 THEN 'rooms'
+                WHEN GROUPING(price_bucket) = 0 THEN 'price'
+                ELSE 'total'
+            END AS facet,
+            property_type_id,
+            status_id,
+            rooms,
+            price_bucket,
+            COUNT(*) AS count
+        FROM matched
+        GROUP BY GROUPING SETS (
+            (property_type_id), (status_id), (rooms), (price_bucket), ()
+        )
+    ),
+    feature_counts AS (
+        SELECT lf.feature_id, COUNT(*) AS count
+        FROM listing_features lf
+        {feature_join}
+        GROUP BY lf.feature_id
+    )
+    SELECT
+        c.facet,
+        CASE c.facet
+            WHEN 'property_type' THEN pt.name
+            WHEN 'status' THEN s.status
+            WHEN 'rooms' THEN c.rooms::text
+            WHEN 'price' THEN c.price_bucket::text
+        END AS value,
+        c.count
+    FROM counts c
+    LEFT JOIN property_types pt ON pt.id = c.property_type_id
+    LEFT JOIN status s ON s.id = c.status_id
+    UNION ALL
+    SELECT 'feature', f.name, fc.count
+    FROM feature_counts fc
+    JOIN features f ON f.id = fc.feature_id
+"""
+
+
+def listing_facets_query(filters):
+    """Build the facet counts query for ListingFilters. Returns the SQL and parameters."""
+    where, params = listing_filter_conditions(filters)
+
+    # Only join what the filters use: with no joins the matches are read
+    # from listings_facets_idx alone (0012)
+    joins = []
+    if viewport(filters) is not None or radius_search(filters) is not None:
+        joins.append("JOIN addresses a ON l.address_id = a.id")
+    if filters.property_type:
+        joins.append("JOIN property_types pt ON l.property_type_id = pt.id")
+
+    sql = LISTING_FACETS_SQL.format(
+        joins=" ".join(joins),
+        where=f"WHERE {' AND '.join(where)}" if where else "",
+        # Without filters every listing matches, count all its features
+        feature_join=("JOIN matched ON matched.id = lf.listing_id" if where else ""),
+    )
+    return sql, [FACET_MAX_ROOMS, PRICE_BUCKETS] + params
+
+
+def room_bucket(value):
+    rooms = int(value)
+    if rooms >= FACET_MAX_ROOMS:
+        return {"value": f"{FACET_MAX_ROOMS}+", "min": FACET_MAX_ROOMS, "max": None}
+    return {"value": str(rooms), "min": rooms, "max": rooms}
+
+
+def price_bucket(value):
+    # min is inclusive and max exclusive, None means no limit
+    index = int(value)
+    low = PRICE_BUCKETS[index - 1] if index > 0 else None
+    high = PRICE_BUCKETS[index] if index < len(PRICE_BUCKETS) else None
+    label = f"{low or 0}-{high}" if high is not None else f"{low}+"
+    return {"value": label, "min": low, "max": high}
+
+
+def facet_result(rows):
+    """
+    Shape the facet rows as {"total": n, "property_type": [{"value", "count"}],
+    "status": [...], "rooms": [...], "price": [...], "feature": [...]}.
+    Rooms and prices are in bucket order with their min and max, the others
+    have the most common value first.
+    """
+    facets = {
+        "total": 0,
+        "property_type": [],
+        "status": [],
+        "rooms": [],
+        "price": [],
+        "feature": [],
+    }
+    for row in rows:
+        facet, value, count = row["facet"], row["value"], row["count"]
+        if facet == "total":
+            facets["total"] = count
+        elif value is None:
+            # Listings without a type, status, room count or price
+            continue
+        elif facet == "rooms":
+            facets["rooms"].append({**room_bucket(value), "count": count})
+        elif facet == "price":
+            facets["price"].append({**price_bucket(value), "count": count})
+        else:
+            facets[facet].append({"value": value, "count": count})
+
+    for facet in ("property_type", "status", "feature"):
+        facets[facet].sort(key=lambda item: (-item["count"], item["value"]))
+    facets["rooms"].sort(key=lambda item: item["min"])
+    facets["price"].sort(key=lambda item: item["min"] or 0)
+    return facets
+
+
+def get_listing_facets(con, filters):
+    """Facet counts over every listing matching the filters, in one query."""
+    with con, con.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(*listing_facets_query(filters))
+        return facet_result(cur.fetchall())
+
+
+# Map clusters: listings closer to each other than about this many pixels
+# on the map are shown as one cluster
+CLUSTER_CELL_PX = 60
+# Most grid cells one clusters request may cover
+MAX_CLUSTER_CELLS = 2500
+
+
+def cluster_cell_size(zoom, lat):
+    """
+    Size in degrees (latitude, longitude) of one cluster grid cell at a map
+    zoom level, around latitude lat.
+    """
+    # A web map is 256 px wide at zoom 0 and twice as wide per zoom level
+    lon_size = 360 / (256 * 2**zoom) * CLUSTER_CELL_PX
+    # On the (Mercator) map a degree of latitude gets longer away from the
+    # equator, so the same pixels are fewer degrees
+    return lon_size * math.cos(math.radians(lat)), lon_size
+
+
+# The cells are a fixed grid (not relative to the viewport), so a listing
+# stays in the same cluster while the map is panned
+LISTING_CLUSTERS_SQL = """
+    SELECT
+        COUNT(*) AS count,
+        AVG(a.latitude) AS latitude,
+        AVG(a.longitude) AS longitude,
+        MIN(l.price) AS price_min,
+        MAX(l.price) AS price_max,
+        -- A cluster of one is a pin for that listing
+        CASE WHEN COUNT(*) = 1 THEN MIN(l.id) END AS listing_id
+    FROM listings l
+    JOIN addresses a ON l.address_id = a.id
+    LEFT JOIN property_types pt ON l.property_type_id = pt.id
+    WHERE {where}
+    GROUP BY floor(a.latitude / %s), floor(a.longitude / %s)
+    ORDER BY count DESC
+"""
+
+
+def listing_clusters_query(filters):
+    """
+    Build the clusters query for ListingClusters. Returns the SQL and its
+    parameters. Raises ValueError without a viewport, or when the viewport
+    is too large for the zoom level.
+    """
+    box = viewport(filters)
+    if box is None:
+        raise ValueError("lat_min, lat_max, lon_min and lon_max are required")
+    lat_min, lat_max, lon_min, lon_max = box
+
+    lat_size, lon_size = cluster_cell_size(filters.zoom, (lat_min + lat_max) / 2)
+    cells = math.ceil((lat_max - lat_min) / lat_size) * math.ceil(
+        (lon_max - lon_min) / lon_size
+    )
+    if cells > MAX_CLUSTER_CELLS:
+        raise ValueError("The viewport is too large for this zoom level")
+
+    where, params = listing_filter_conditions(filters)
+    sql = LISTING_CLUSTERS_SQL.format(where=" AND ".join(where))
+    return sql, params + [lat_size, lon_size]
+
+
+def get_listing_clusters(con, filters):
+    """The listings matching the filters in the viewport, as map clusters."""
+    sql, params = listing_clusters_query(filters)
+    with con, con.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(sql, params)
         return cur.fetchall()
 
 
+# Rows per round trip when exporting
+EXPORT_BATCH_SIZE = 2000
+
+
+def iter_listing_batches(con, filters=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yield every listing matching the filters, in lists of batch_size rows.
+
+    Uses a server side (named) cursor, so only one batch is in memory at a
+    time however many listings match.
+    """
+    if filters is None:
+        filters = ListingExport()
+
+    select_sql, where, params, sort = listing_query(filters)
+    sql, params = sorted_query(select_sql, where, params, sort)
+
+    with con:
+        with con.cursor(name="listing_export", cursor_factory=RealDictCursor) as cur:
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+
 def get_one_listing_full(con, listing_id):
+    def load():
+        with con, con.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(LISTINGS_FULL_SQL + "WHERE l.id = %s;", (listing_id,))
+            return cur.fetchone()
+
+    # Dropped from the cache by the NOTIFY triggers when the listing changes
+    return row_cache.get_or_load(("listings", listing_id), load)
+
+
+# Everything the listing page shows, in one query. Images, features and the
+# realtor are built as JSON inside Postgres so we don't need extra round trips.
+LISTING_DETAIL_SQL = f"""
+    SELECT
+        {LISTING_FIELDS},
+        a.street AS address,
+        a.city,
+        a.postcode,
+        a.country,
+        a.latitude,
+        a.longitude,
+        pt.name AS property_type,
+        s.status,
+        COALESCE(
+            (
+                SELECT json_agg(
+                    json_build_object('id', li.id, 'caption', li.caption, 'url', li.url)
+                    ORDER BY li.id
+                )
+                FROM listing_images li
+                WHERE li.listing_id = l.id
+            ),
+            '[]'
+        ) AS images,
+        COALESCE(
+            (
+                SELECT json_agg(
+                    json_build_object('id', f.id, 'name', f.name) ORDER BY f.name
+                )
+                FROM listing_features lf
+                JOIN features f ON f.id = lf.feature_id
+                WHERE lf.listing_id = l.id
+            ),
+            '[]'
+        ) AS features,
+        (
+            SELECT json_build_object(
+                'id', u.id,
+                'first_name', u.first_name,
+                'surname', u.surname,
+                'mail', u.mail,
+                'phone_number', u.phone_number,
+                'license_number', ra.license_number,
+                'company', CASE WHEN rc.id IS NOT NULL THEN
+                    json_build_object('id', rc.id, 'name', rc.name)
+                END
+            )
+            FROM users u
+            LEFT JOIN realtor_agent ra ON ra.user_id = u.id
+            LEFT JOIN realtor_companies rc ON rc.id = u.company_id
+            WHERE u.id = l.realtor_id
+        ) AS realtor,
+        (
+            SELECT COUNT(*) FROM messages m WHERE m.listing_id = l.id
+        ) AS message_count
+    FROM listings l
+    LEFT JOIN addresses a ON l.address_id = a.id
+    LEFT JOIN property_types pt ON l.property_type_id = pt.id
+    LEFT JOIN status s ON l.status_id = s.id
+    WHERE l.id = %s;
+"""
+
+
+def get_listing_detail(con, listing_id):
+    """
+    The listing with its images, features, realtor (with agent info and
+    company) and number of messages, or None if it doesn't exist.
+    """
     with con, con.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
-            """
-            SELECT
-                l.*,
-                a.street AS address,
-                a.city,
-                a.postcode,
-                a.country,
-                pt.name AS property_type
-            FROM listings l
-            LEFT JOIN addresses a ON l.address_id = a.id
-            LEFT JOIN property_types pt ON l.property_type_id = pt.id
-            WHERE l.id = %s;
-            """,
-            (listing_id,),
-        )
+        cur.execute(LISTING_DETAIL_SQL, (listing_id,))
         return cur.fetchone()
 
 
@@ -97,6 +811,256 @@ def create_listing(
             return new_id
 
 
+# POST /listings/batch
+
+BATCH_LISTING_COLUMNS = [
+    "id",
+    "title",
+    "description",
+    "price",
+    "living_area",
+    "lot_size",
+    "room_count",
+    "year_built",
+    "floor_number",
+    "energy_class",
+    "renovation_year",
+    "address_id",
+    "property_type_id",
+    "realtor_id",
+    "status_id",
+]
+
+# Which of the ids a batch refers to exist, in one round trip. The listings
+# the batch updates are locked, so they can't be deleted halfway through.
+BATCH_REFERENCES_SQL = """
+    SELECT
+        ARRAY(SELECT id FROM addresses WHERE id = ANY(%(address_ids)s::int[])) AS address_ids,
+        ARRAY(SELECT id FROM property_types WHERE id = ANY(%(property_type_ids)s::int[])) AS property_type_ids,
+        ARRAY(SELECT id FROM users WHERE id = ANY(%(realtor_ids)s::int[])) AS realtor_ids,
+        ARRAY(SELECT id FROM status WHERE id = ANY(%(status_ids)s::int[])) AS status_ids,
+        ARRAY(SELECT id FROM features WHERE id = ANY(%(feature_ids)s::int[])) AS feature_ids,
+        ARRAY(
+            SELECT id FROM listings WHERE id = ANY(%(listing_ids)s::int[])
+            ORDER BY id FOR UPDATE
+        ) AS listing_ids;
+"""
+
+# The array type of each listing column, for unnest
+BATCH_COLUMN_TYPES = {
+    "id": "int[]",
+    "title": "varchar(255)[]",
+    "description": "text[]",
+    "price": "numeric(12,2)[]",
+    "living_area": "numeric(12,2)[]",
+    "lot_size": "numeric(12,2)[]",
+    "room_count": "int[]",
+    "year_built": "int[]",
+    "floor_number": "int[]",
+    "energy_class": "varchar(100)[]",
+    "renovation_year": "int[]",
+    "address_id": "int[]",
+    "property_type_id": "int[]",
+    "realtor_id": "int[]",
+    "status_id": "int[]",
+}
+
+# All updated listings in one statement, one array per column. Like the
+# feed import, rows where nothing changed are not written (and not
+# returned), so their updated_at and ETag stay as they are.
+BATCH_UPDATE_SQL = f"""
+    UPDATE listings l
+    SET {", ".join(f"{c} = v.{c}" for c in BATCH_LISTING_COLUMNS[1:])}
+    FROM unnest({", ".join(f"%({c})s::{BATCH_COLUMN_TYPES[c]}" for c in BATCH_LISTING_COLUMNS)})
+        AS v({", ".join(BATCH_LISTING_COLUMNS)})
+    WHERE l.id = v.id
+        AND ({", ".join(f"l.{c}" for c in BATCH_LISTING_COLUMNS[1:])})
+            IS DISTINCT FROM ({", ".join(f"v.{c}" for c in BATCH_LISTING_COLUMNS[1:])})
+    RETURNING l.id;
+"""
+
+
+def batch_reference_params(items):
+    return {
+        "address_ids": list({item.address_id for item in items}),
+        "property_type_ids": list({item.property_type_id for item in items}),
+        "realtor_ids": list({item.realtor_id for item in items}),
+        "status_ids": list({item.status_id for item in items}),
+        # Feed items (ListingFeedItem) have no features and no id
+        "feature_ids": list(
+            {f for item in items for f in getattr(item, "feature_ids", None) or []}
+        ),
+        "listing_ids": list(
+            {item.id for item in items if getattr(item, "id", None) is not None}
+        ),
+    }
+
+
+def batch_errors(items, found):
+    """
+    Check every item against the ids that exist (a row of
+    BATCH_REFERENCES_SQL). Returns {index: error message} for bad items.
+    """
+    found = {key: set(ids) for key, ids in found.items()}
+    errors = {}
+    seen = set()
+    for index, item in enumerate(items):
+        listing_id = getattr(item, "id", None)
+        if listing_id is not None:
+            if listing_id not in found["listing_ids"]:
+                errors[index] = f"Listing {listing_id} not found"
+                continue
+            # Which of the two would win is up to Postgres
+            if listing_id in seen:
+                errors[index] = f"Listing {listing_id} is already in this batch"
+                continue
+            seen.add(listing_id)
+        missing = [
+            f"{name} {value}"
+            for name, value, key in [
+                ("address_id", item.address_id, "address_ids"),
+                ("property_type_id", item.property_type_id, "property_type_ids"),
+                ("realtor_id", item.realtor_id, "realtor_ids"),
+                ("status_id", item.status_id, "status_ids"),
+            ]
+            if value not in found[key]
+        ]
+        missing += [
+            f"feature_id {f}"
+            for f in getattr(item, "feature_ids", None) or []
+            if f not in found["feature_ids"]
+        ]
+        if missing:
+            errors[index] = "Unknown " + ", ".join(missing)
+    return errors
+
+
+def batch_rows(items, ids):
+    """The listing, image and feature rows for items, which get the given ids."""
+    listings, images, features = [], [], []
+    for listing_id, item in zip(ids, items):
+        listings.append(
+            (listing_id,) + tuple(getattr(item, c) for c in BATCH_LISTING_COLUMNS[1:])
+        )
+        images += [
+            (listing_id, image.caption, image.url) for image in item.images or []
+        ]
+        # The same feature twice would break the primary key
+        features += [(listing_id, f) for f in sorted(set(item.feature_ids or []))]
+    return listings, images, features
+
+
+def batch_update_params(items):
+    """BATCH_UPDATE_SQL parameters: one list per column."""
+    return {c: [getattr(item, c) for item in items] for c in BATCH_LISTING_COLUMNS}
+
+
+def batch_replaced(items):
+    """
+    The ids of the updated listings whose images, and whose features, are
+    replaced (the ones that sent them).
+    """
+    return (
+        [item.id for item in items if item.images is not None],
+        [item.id for item in items if item.feature_ids is not None],
+    )
+
+
+def batch_results(items, errors, ids, changed):
+    """
+    Per item {"index", "id", "status"} or {"index", "error"}, in request
+    order. status is created, updated or unchanged.
+    """
+    new_ids = iter(ids)
+    results = []
+    for index, item in enumerate(items):
+        if index in errors:
+            results.append({"index": index, "error": errors[index]})
+        elif item.id is None:
+            results.append({"index": index, "id": next(new_ids), "status": "created"})
+        else:
+            status = "updated" if item.id in changed else "unchanged"
+            results.append({"index": index, "id": item.id, "status": status})
+    return results
+
+
+def save_listings_batch(con, items):
+    """
+    Create and update many listings (ListingBatchItem) with their images and
+    features in one transaction. Items that refer to ids that don't exist
+    are skipped and reported, the others are saved.
+    """
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(BATCH_REFERENCES_SQL, batch_reference_params(items))
+            errors = batch_errors(items, cur.fetchone())
+            valid = [item for index, item in enumerate(items) if index not in errors]
+            new = [item for item in valid if item.id is None]
+            existing = [item for item in valid if item.id is not None]
+
+            ids = []
+            images, features = [], []
+            if new:
+                # Take the ids first, so we know which images belong to which
+                # listing without relying on the order of RETURNING
+                cur.execute(
+                    """
+                    SELECT nextval(pg_get_serial_sequence('listings', 'id')) AS id
+                    FROM generate_series(1, %s);
+                    """,
+                    (len(new),),
+                )
+                ids = [row["id"] for row in cur.fetchall()]
+                listings, images, features = batch_rows(new, ids)
+
+                execute_values(
+                    cur,
+                    f"INSERT INTO listings ({', '.join(BATCH_LISTING_COLUMNS)}) VALUES %s",
+                    listings,
+                    page_size=1000,
+                )
+
+            changed = set()
+            if existing:
+                cur.execute(BATCH_UPDATE_SQL, batch_update_params(existing))
+                changed = {row["id"] for row in cur.fetchall()}
+
+                image_ids, feature_ids = batch_replaced(existing)
+                if image_ids:
+                    cur.execute(
+                        "DELETE FROM listing_images WHERE listing_id = ANY(%s);",
+                        (image_ids,),
+                    )
+                if feature_ids:
+                    cur.execute(
+                        "DELETE FROM listing_features WHERE listing_id = ANY(%s);",
+                        (feature_ids,),
+                    )
+                changed.update(image_ids, feature_ids)
+                _, more_images, more_features = batch_rows(
+                    existing, [item.id for item in existing]
+                )
+                images += more_images
+                features += more_features
+
+            if images:
+                execute_values(
+                    cur,
+                    "INSERT INTO listing_images (listing_id, caption, url) VALUES %s",
+                    images,
+                    page_size=1000,
+                )
+            if features:
+                execute_values(
+                    cur,
+                    "INSERT INTO listing_features (listing_id, feature_id) VALUES %s",
+                    features,
+                    page_size=1000,
+                )
+
+    return batch_results(items, errors, ids, changed)
+
+
 def delete_listing(con, listing_id):
     with con:
         with con.cursor() as cur:
@@ -175,11 +1139,14 @@ def update_listing(
 # USERS FUNCTIONS
 
 
-def get_all_users(con):
+def get_all_users(con, page=None):
+    if page is None:
+        page = PageParams()
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM users;")
-            return cur.fetchall()
+            return fetch_page(
+                cur, "SELECT * FROM users", [], [], BY_ID, page.limit, page.cursor
+            )
 
 
 def create_user(
@@ -218,10 +1185,13 @@ def create_user(
 
 
 def get_one_user(con, user_id):
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-            return cur.fetchone()
+    def load():
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT * FROM users WHERE id = %s", (user_id,))
+                return cur.fetchone()
+
+    return row_cache.get_or_load(("users", user_id), load)
 
 
 def delete_user(con, user_id):
@@ -280,11 +1250,20 @@ def update_user(
 # COMPANIES FUNCTIONS
 
 
-def get_all_companies(con):
+def get_all_companies(con, page=None):
+    if page is None:
+        page = PageParams()
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM realtor_companies;")
-            return cur.fetchall()
+            return fetch_page(
+                cur,
+                "SELECT * FROM realtor_companies",
+                [],
+                [],
+                BY_ID,
+                page.limit,
+                page.cursor,
+            )
 
 
 def get_one_company(con, company_id):
@@ -327,11 +1306,14 @@ def update_company(con, company_id, name, address_id):
 # ADDRESSES FUNCTIONS
 
 
-def get_all_addresses(con):
+def get_all_addresses(con, page=None):
+    if page is None:
+        page = PageParams()
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM addresses;")
-            return cur.fetchall()
+            return fetch_page(
+                cur, "SELECT * FROM addresses", [], [], BY_ID, page.limit, page.cursor
+            )
 
 
 def get_one_address(con, address_id):
@@ -341,12 +1323,12 @@ def get_one_address(con, address_id):
             return cur.fetchone()
 
 
-def create_address(con, street, city, postcode, country):
+def create_address(con, street, city, postcode, country, latitude=None, longitude=None):
     with con:
         with con.cursor() as cur:
             cur.execute(
-                "INSERT INTO addresses (street, city, postcode, country) VALUES (%s, %s, %s, %s) RETURNING id;",
-                (street, city, postcode, country),
+                "INSERT INTO addresses (street, city, postcode, country, latitude, longitude) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id;",
+                (street, city, postcode, country, latitude, longitude),
             )
             return cur.fetchone()[0]
 
@@ -360,12 +1342,14 @@ def delete_address(con, address_id):
             return cur.fetchone()
 
 
-def update_address(con, address_id, street, city, postcode, country):
+def update_address(
+    con, address_id, street, city, postcode, country, latitude=None, longitude=None
+):
     with con:
         with con.cursor() as cur:
             cur.execute(
-                "UPDATE addresses SET street = %s, city = %s, postcode = %s, country = %s WHERE id = %s RETURNING id;",
-                (street, city, postcode, country, address_id),
+                "UPDATE addresses SET street = %s, city = %s, postcode = %s, country = %s, latitude = %s, longitude = %s WHERE id = %s RETURNING id;",
+                (street, city, postcode, country, latitude, longitude, address_id),
             )
             return cur.fetchone()
 
@@ -373,18 +1357,37 @@ def update_address(con, address_id, street, city, postcode, country):
 # FEATURE FUNCTIONS
 
 
-def get_all_features(con):
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM features;")
-            return cur.fetchall()
+def get_all_features(con, page=None):
+    if page is None:
+        page = PageParams()
+
+    def load():
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cur:
+                return fetch_page(
+                    cur,
+                    "SELECT * FROM features",
+                    [],
+                    [],
+                    BY_ID,
+                    page.limit,
+                    page.cursor,
+                )
+
+    # Features rarely change, so pages are served from the cache
+    return reference_cache.get_or_load(
+        ("features", "page", page.limit, page.cursor), load
+    )
 
 
 def get_one_feature(con, feature_id):
-    with con:
-        with con.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM features WHERE id = %s", (feature_id,))
-            return cur.fetchone()
+    def load():
+        with con:
+            with con.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT * FROM features WHERE id = %s", (feature_id,))
+                return cur.fetchone()
+
+    return reference_cache.get_or_load(("features", feature_id), load)
 
 
 def create_feature(con, name):
@@ -393,7 +1396,9 @@ def create_feature(con, name):
             cur.execute(
                 "INSERT INTO features (name) VALUES (%s) RETURNING id;", (name,)
             )
-            return cur.fetchone()[0]
+            new_id = cur.fetchone()[0]
+    reference_cache.invalidate("features")
+    return new_id
 
 
 def delete_feature(con, feature_id):
@@ -402,7 +1407,9 @@ def delete_feature(con, feature_id):
             cur.execute(
                 "DELETE FROM features WHERE id = %s RETURNING id;", (feature_id,)
             )
-            return cur.fetchone()
+            row = cur.fetchone()
+    reference_cache.invalidate("features")
+    return row
 
 
 def update_feature(con, feature_id, name):
@@ -412,7 +1419,40 @@ def update_feature(con, feature_id, name):
                 "UPDATE features SET name = %s WHERE id = %s RETURNING id;",
                 (name, feature_id),
             )
-            return cur.fetchone()
+            row = cur.fetchone()
+    reference_cache.invalidate("features")
+    return row
+
+
+# LOOKUP FUNCTIONS
+# Property types, statuses and roles are only changed by migrations and the
+# seed script, so they are always read from the cache.
+
+
+def _load_all(con, sql):
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(sql)
+            return cur.fetchall()
+
+
+def get_all_property_types(con):
+    return reference_cache.get_or_load(
+        ("property_types",),
+        lambda: _load_all(con, "SELECT * FROM property_types ORDER BY id;"),
+    )
+
+
+def get_all_statuses(con):
+    return reference_cache.get_or_load(
+        ("status",), lambda: _load_all(con, "SELECT * FROM status ORDER BY id;")
+    )
+
+
+def get_all_roles(con):
+    return reference_cache.get_or_load(
+        ("roles",), lambda: _load_all(con, "SELECT * FROM roles ORDER BY id;")
+    )
 
 
 # PATCH LISTINGS FUNCTIONS
@@ -443,43 +1483,383 @@ def update_listing_status(con, listing_id, new_status_id):
 # MESSAGE FUNCTIONS
 
 
+# Length of the last message shown in the inbox. Migration 0015 backfilled
+# the existing conversations with left(content, 200): change both together.
+MESSAGE_PREVIEW_LENGTH = 200
+
+# Inserts the message and updates its conversation in one statement: the
+# conversation (created on the first message) gets the new last message,
+# the receiver's unread count goes up and the sender's is reset, since
+# they obviously read the thread they reply to.
+CREATE_MESSAGE_SQL = f"""
+    WITH conversation AS (
+        INSERT INTO conversations (
+            listing_id, user_a_id, user_b_id,
+            last_sender_id, last_message_preview, message_count
+        )
+        VALUES (
+            %(listing_id)s,
+            LEAST(%(sender_id)s::int, %(receiver_id)s::int),
+            GREATEST(%(sender_id)s::int, %(receiver_id)s::int),
+            %(sender_id)s,
+            left(%(content)s, {MESSAGE_PREVIEW_LENGTH}),
+            1
+        )
+        ON CONFLICT (listing_id, user_a_id, user_b_id) DO UPDATE
+        SET last_message_at = EXCLUDED.last_message_at,
+            last_sender_id = EXCLUDED.last_sender_id,
+            last_message_preview = EXCLUDED.last_message_preview,
+            message_count = conversations.message_count + 1
+        RETURNING id, last_message_at
+    ),
+    members AS (
+        INSERT INTO conversation_members (
+            conversation_id, user_id, last_message_at, unread_count, last_read_at
+        )
+        -- A message to yourself only has the sender row
+        SELECT DISTINCT ON (member.user_id)
+            c.id,
+            member.user_id,
+            c.last_message_at,
+            member.unread,
+            CASE WHEN member.unread = 0 THEN c.last_message_at END
+        FROM conversation c
+        CROSS JOIN (
+            VALUES (%(sender_id)s::int, 0), (%(receiver_id)s::int, 1)
+        ) AS member(user_id, unread)
+        ORDER BY member.user_id, member.unread
+        ON CONFLICT (conversation_id, user_id) DO UPDATE
+        SET last_message_at = EXCLUDED.last_message_at,
+            unread_count = CASE
+                WHEN EXCLUDED.unread_count = 0 THEN 0
+                ELSE conversation_members.unread_count + 1
+            END,
+            last_read_at = COALESCE(
+                EXCLUDED.last_read_at, conversation_members.last_read_at
+            )
+    )
+    INSERT INTO messages (
+        conversation_id, sender_id, receiver_id, listing_id, content, created_at
+    )
+    SELECT id, %(sender_id)s, %(receiver_id)s, %(listing_id)s, %(content)s, last_message_at
+    FROM conversation
+    RETURNING id, conversation_id, sender_id, receiver_id, listing_id, content, created_at;
+"""
+
+
+def message_params(sender_id, receiver_id, listing_id, content):
+    return {
+        "sender_id": sender_id,
+        "receiver_id": receiver_id,
+        "listing_id": listing_id,
+        "content": content,
+    }
+
+
 def create_message(con, sender_id, receiver_id, listing_id, content):
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
-                """
-                INSERT INTO messages (sender_id, receiver_id, listing_id, content)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id, sender_id, receiver_id, listing_id, content, created_at;
-                """,
-                (sender_id, receiver_id, listing_id, content),
+                CREATE_MESSAGE_SQL,
+                message_params(sender_id, receiver_id, listing_id, content),
             )
             return cur.fetchone()
 
 
-def get_messages_for_listing(con, listing_id):
+# Newest messages first
+MESSAGE_SORT = Sort("created_at", "created_at", "DESC", "timestamptz")
+
+
+def get_messages_for_listing(con, listing_id, page=None):
+    if page is None:
+        page = PageParams()
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                """
-                SELECT * FROM messages
-                WHERE listing_id = %s
-                ORDER BY created_at DESC;
-                """,
-                (listing_id,),
+            return fetch_page(
+                cur,
+                "SELECT * FROM messages",
+                ["listing_id = %s"],
+                [listing_id],
+                MESSAGE_SORT,
+                page.limit,
+                page.cursor,
             )
-            return cur.fetchall()
 
 
-def get_messages_for_user(con, user_id):
+def messages_for_user_query(user_id, page):
+    """
+    Sent and received messages are each read newest first from their own
+    index and then merged, instead of scanning the whole table for
+    "sender_id = x OR receiver_id = x" and sorting it.
+    """
+    sent_sql, sent_params = page_query(
+        "SELECT * FROM messages",
+        ["sender_id = %s"],
+        [user_id],
+        MESSAGE_SORT,
+        page.limit,
+        page.cursor,
+    )
+    # Messages a user sent to themself already come from the first branch
+    received_sql, received_params = page_query(
+        "SELECT * FROM messages",
+        ["receiver_id = %s", "sender_id IS DISTINCT FROM %s"],
+        [user_id, user_id],
+        MESSAGE_SORT,
+        page.limit,
+        page.cursor,
+    )
+    return page_query(
+        f"SELECT * FROM (({sent_sql}) UNION ALL ({received_sql})) m",
+        [],
+        sent_params + received_params,
+        MESSAGE_SORT,
+        page.limit,
+    )
+
+
+def get_messages_for_user(con, user_id, page=None):
+    if page is None:
+        page = PageParams()
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(*messages_for_user_query(user_id, page))
+            return page_result(cur.fetchall(), MESSAGE_SORT, page.limit)
+
+
+# CONVERSATION FUNCTIONS
+
+
+# The inbox, newest conversation first
+CONVERSATION_SORT = Sort(
+    "cm.last_message_at", "last_message_at", "DESC", "timestamptz", "cm.conversation_id"
+)
+
+# One user's inbox entries (conversation_members) with their conversation,
+# the listing and the other user. Only the rows on the page are joined.
+INBOX_SQL = """
+    SELECT
+        cm.conversation_id AS id,
+        c.listing_id,
+        l.title AS listing_title,
+        other.id AS other_user_id,
+        other.first_name AS other_first_name,
+        other.surname AS other_surname,
+        cm.last_message_at,
+        c.last_sender_id,
+        c.last_message_preview,
+        c.message_count,
+        cm.unread_count
+    FROM conversation_members cm
+    JOIN conversations c ON c.id = cm.conversation_id
+    LEFT JOIN listings l ON l.id = c.listing_id
+    LEFT JOIN users other ON other.id = CASE
+        WHEN c.user_a_id = cm.user_id THEN c.user_b_id
+        ELSE c.user_a_id
+    END
+"""
+
+# Uses the partial index on the unread conversations only
+UNREAD_TOTAL_SQL = """
+    SELECT COALESCE(SUM(unread_count), 0) AS unread_total
+    FROM conversation_members
+    WHERE user_id = %s AND unread_count > 0;
+"""
+
+MARK_READ_SQL = """
+    UPDATE conversation_members
+    SET unread_count = 0, last_read_at = NOW()
+    WHERE conversation_id = %s AND user_id = %s
+    RETURNING conversation_id;
+"""
+
+
+def get_conversations_for_user(con, user_id, page=None):
+    """
+    One page of the user's conversations, newest first, with the cursor for
+    the next page and the user's total number of unread messages.
+    """
+    if page is None:
+        page = PageParams()
     with con:
         with con.cursor(cursor_factory=RealDictCursor) as cur:
+            conversations, next_cursor = fetch_page(
+                cur,
+                INBOX_SQL,
+                ["cm.user_id = %s"],
+                [user_id],
+                CONVERSATION_SORT,
+                page.limit,
+                page.cursor,
+            )
+            cur.execute(UNREAD_TOTAL_SQL, (user_id,))
+            return conversations, next_cursor, cur.fetchone()["unread_total"]
+
+
+def get_conversation_messages(con, conversation_id, page=None):
+    if page is None:
+        page = PageParams()
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cur:
+            return fetch_page(
+                cur,
+                "SELECT * FROM messages",
+                ["conversation_id = %s"],
+                [conversation_id],
+                MESSAGE_SORT,
+                page.limit,
+                page.cursor,
+            )
+
+
+def mark_conversation_read(con, conversation_id, user_id):
+    """Returns None if the user is not part of the conversation."""
+    with con:
+        with con.cursor() as cur:
+            cur.execute(MARK_READ_SQL, (conversation_id, user_id))
+            return cur.fetchone()
+
+
+# SAVED SEARCH FUNCTIONS
+# The alerts are made by a trigger on listings, see migration 0018.
+
+
+SAVED_SEARCH_SELECT = """
+    SELECT
+        s.id, s.user_id, s.name, s.city,
+        s.property_type_id, pt.name AS property_type,
+        s.price_min, s.price_max, s.rooms_min, s.rooms_max, s.created_at
+    FROM saved_searches s
+    LEFT JOIN property_types pt ON pt.id = s.property_type_id
+"""
+
+SAVED_SEARCH_SORT = Sort("s.id", "id")
+
+# The property type is given by name, like in the listing search. Nothing
+# is inserted (and no id returned) when the name is unknown.
+CREATE_SAVED_SEARCH_SQL = """
+    INSERT INTO saved_searches (
+        user_id, name, city, property_type_id,
+        price_min, price_max, rooms_min, rooms_max
+    )
+    SELECT
+        %(user_id)s, %(name)s, %(city)s, pt.id,
+        %(price_min)s, %(price_max)s, %(rooms_min)s, %(rooms_max)s
+    FROM (VALUES (%(property_type)s::text)) AS wanted(name)
+    LEFT JOIN property_types pt ON LOWER(pt.name) = LOWER(wanted.name)
+    WHERE wanted.name IS NULL OR pt.id IS NOT NULL
+    RETURNING id;
+"""
+
+ALERT_SORT = Sort("al.created_at", "created_at", "DESC", "timestamptz", "al.id")
+
+ALERTS_SQL = """
+    SELECT
+        al.id,
+        al.saved_search_id,
+        s.name AS saved_search_name,
+        al.listing_id,
+        l.title,
+        a.city,
+        al.reason,
+        al.price,
+        al.created_at
+    FROM saved_search_alerts al
+    JOIN saved_searches s ON s.id = al.saved_search_id
+    JOIN listings l ON l.id = al.listing_id
+    LEFT JOIN addresses a ON a.id = l.address_id
+"""
+
+
+def saved_search_params(search):
+    return {
+        "user_id": search.user_id,
+        "name": search.name,
+        "city": search.city,
+        "property_type": search.property_type,
+        "price_min": search.price_min,
+        "price_max": search.price_max,
+        "rooms_min": search.rooms_min,
+        "rooms_max": search.rooms_max,
+    }
+
+
+def get_saved_searches_for_user(con, user_id, page=None):
+    if page is None:
+        page = PageParams()
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cur:
+            return fetch_page(
+                cur,
+                SAVED_SEARCH_SELECT,
+                ["s.user_id = %s"],
+                [user_id],
+                SAVED_SEARCH_SORT,
+                page.limit,
+                page.cursor,
+            )
+
+
+def create_saved_search(con, search):
+    """Takes a SavedSearchCreate. Raises ValueError for an unknown property type."""
+    with con:
+        with con.cursor() as cur:
+            cur.execute(CREATE_SAVED_SEARCH_SQL, saved_search_params(search))
+            row = cur.fetchone()
+    if row is None:
+        raise ValueError(f"Unknown property type: {search.property_type}")
+    return row[0]
+
+
+def delete_saved_search(con, saved_search_id):
+    with con:
+        with con.cursor() as cur:
             cur.execute(
-                """
-                SELECT * FROM messages
-                WHERE sender_id = %s OR receiver_id = %s
-                ORDER BY created_at DESC;
-                """,
-                (user_id, user_id),
+                "DELETE FROM saved_searches WHERE id = %s RETURNING id;",
+                (saved_search_id,),
             )
-            return cur.fetchall()
+            return cur.fetchone()
+
+
+def get_alerts_for_user(con, user_id, page=None):
+    """The user's alerts from all their saved searches, newest first."""
+    if page is None:
+        page = PageParams()
+    with con:
+        with con.cursor(cursor_factory=RealDictCursor) as cur:
+            return fetch_page(
+                cur,
+                ALERTS_SQL,
+                ["al.user_id = %s"],
+                [user_id],
+                ALERT_SORT,
+                page.limit,
+                page.cursor,
+            )
+
+
+# STATS FUNCTIONS
+
+
+# From the listing_stats materialized view (0011, refreshed by server/stats.py)
+LISTING_STATS_SQL = """
+    SELECT * FROM listing_stats
+    WHERE %(dimension)s::text IS NULL OR dimension = %(dimension)s
+    ORDER BY dimension, listing_count DESC, name
+"""
+STATS_REFRESHED_AT_SQL = (
+    "SELECT refreshed_at FROM stats_refreshes WHERE name = 'listing_stats';"
+)
+
+
+def get_listing_stats(con, dimension=None):
+    """
+    The listing stats rows (all of them, or of one dimension: city,
+    property_type or status) and when they were last refreshed.
+    """
+    with con, con.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(LISTING_STATS_SQL, {"dimension": dimension})
+        rows = cur.fetchall()
+        cur.execute(STATS_REFRESHED_AT_SQL)
+        refreshed = cur.fetchone()
+    return rows, refreshed["refreshed_at"] if refreshed else None
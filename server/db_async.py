@@ -0,0 +1,737 @@
+"""
+Async version of server/db.py, used by server/app_async.py.
+
+Every function has the same name and arguments as in db.py, but takes a
+psycopg (version 3) AsyncConnection and must be awaited. The SQL is shared
+with db.py wherever it is built in code, so the two apps can be benchmarked
+against each other on exactly the same queries.
+"""
+
+from psycopg.rows import dict_row
+
+from server.cache import reference_cache, row_cache
+from server.db import (
+    ALERTS_SQL,
+    ALERT_SORT,
+    BATCH_LISTING_COLUMNS,
+    BATCH_REFERENCES_SQL,
+    BATCH_UPDATE_SQL,
+    CONVERSATION_SORT,
+    CREATE_MESSAGE_SQL,
+    CREATE_SAVED_SEARCH_SQL,
+    EXPORT_BATCH_SIZE,
+    INBOX_SQL,
+    LISTINGS_FULL_SQL,
+    LISTING_DETAIL_SQL,
+    LISTING_STATS_SQL,
+    MARK_READ_SQL,
+    MESSAGE_SORT,
+    SAVED_SEARCH_SELECT,
+    SAVED_SEARCH_SORT,
+    STATS_REFRESHED_AT_SQL,
+    UNREAD_TOTAL_SQL,
+    batch_errors,
+    batch_reference_params,
+    batch_replaced,
+    batch_results,
+    batch_rows,
+    batch_update_params,
+    facet_result,
+    listing_facets_query,
+    listing_clusters_query,
+    listing_page_queries,
+    listing_query,
+    message_params,
+    messages_for_user_query,
+    saved_search_params,
+)
+from server.pagination import BY_ID, page_query, page_result, sorted_query
+from server.schemas import ListingExport, ListingFilters, PageParams
+
+
+async def fetch_page(cur, select_sql, where, params, sort, limit, cursor=None):
+    await cur.execute(*page_query(select_sql, where, params, sort, limit, cursor))
+    return page_result(await cur.fetchall(), sort, limit)
+
+
+async def fetch_listing_page(cur, filters):
+    queries, sort = listing_page_queries(filters)
+    rows = []
+    for sql, params in queries:
+        await cur.execute(sql, params)
+        rows += await cur.fetchall()
+        if len(rows) > filters.limit:
+            break
+    return page_result(rows, sort, filters.limit)
+
+
+async def _fetch_one(con, sql, params):
+    async with con.cursor(row_factory=dict_row) as cur:
+        await cur.execute(sql, params)
+        return await cur.fetchone()
+
+
+async def _returning_id(con, sql, params):
+    # Run an INSERT/UPDATE/DELETE ... RETURNING id and give back the id row
+    async with con.cursor() as cur:
+        await cur.execute(sql, params)
+        return await cur.fetchone()
+
+
+async def _cached(cache, key, load):
+    # cache.get_or_load for an async load function
+    value = cache.get(key)
+    if value is None:
+        version = cache.version
+        value = await load()
+        if value is not None:
+            cache.set(key, value, version)
+    return value
+
+
+# LISTINGS FUNCTIONS
+
+
+async def get_all_listings_full(con, filters=None):
+    if filters is None:
+        filters = ListingFilters()
+
+    async with con.cursor(row_factory=dict_row) as cur:
+        return await fetch_listing_page(cur, filters)
+
+
+async def get_listing_facets(con, filters):
+    async with con.cursor(row_factory=dict_row) as cur:
+        await cur.execute(*listing_facets_query(filters))
+        return facet_result(await cur.fetchall())
+
+
+async def get_listing_clusters(con, filters):
+    sql, params = listing_clusters_query(filters)
+    async with con.cursor(row_factory=dict_row) as cur:
+        await cur.execute(sql, params)
+        return await cur.fetchall()
+
+
+async def iter_listing_batches(con, filters=None, batch_size=EXPORT_BATCH_SIZE):
+    if filters is None:
+        filters = ListingExport()
+
+    select_sql, where, params, sort = listing_query(filters)
+    sql, params = sorted_query(select_sql, where, params, sort)
+
+    async with con.cursor(name="listing_export", row_factory=dict_row) as cur:
+        await cur.execute(sql, params)
+        while True:
+            rows = await cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+async def get_one_listing_full(con, listing_id):
+    return await _cached(
+        row_cache,
+        ("listings", listing_id),
+        lambda: _fetch_one(con, LISTINGS_FULL_SQL + "WHERE l.id = %s;", (listing_id,)),
+    )
+
+
+async def get_listing_detail(con, listing_id):
+    return await _fetch_one(con, LISTING_DETAIL_SQL, (listing_id,))
+
+
+async def create_listing(
+    con,
+    title,
+    description,
+    price,
+    living_area,
+    lot_size,
+    room_count,
+    year_built,
+    floor_number,
+    energy_class,
+    renovation_year,
+    address_id,
+    property_type_id,
+    realtor_id,
+    status_id,
+):
+    row = await _returning_id(
+        con,
+        """
+        INSERT INTO listings (
+            title, description, price, living_area, lot_size, room_count,
+            year_built, floor_number, energy_class, renovation_year,
+            address_id, property_type_id, realtor_id, status_id
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id;
+        """,
+        (
+            title,
+            description,
+            price,
+            living_area,
+            lot_size,
+            room_count,
+            year_built,
+            floor_number,
+            energy_class,
+            renovation_year,
+            address_id,
+            property_type_id,
+            realtor_id,
+            status_id,
+        ),
+    )
+    return row[0]
+
+
+async def save_listings_batch(con, items):
+    async with con.cursor() as cur:
+        await cur.execute(BATCH_REFERENCES_SQL, batch_reference_params(items))
+        names = [column.name for column in cur.description]
+        errors = batch_errors(items, dict(zip(names, await cur.fetchone())))
+        valid = [item for index, item in enumerate(items) if index not in errors]
+        new = [item for item in valid if item.id is None]
+        existing = [item for item in valid if item.id is not None]
+
+        ids = []
+        listings, images, features = [], [], []
+        if new:
+            await cur.execute(
+                """
+                SELECT nextval(pg_get_serial_sequence('listings', 'id'))
+                FROM generate_series(1, %s);
+                """,
+                (len(new),),
+            )
+            ids = [row[0] for row in await cur.fetchall()]
+            listings, images, features = batch_rows(new, ids)
+
+        changed = set()
+        if existing:
+            await cur.execute(BATCH_UPDATE_SQL, batch_update_params(existing))
+            changed = {row[0] for row in await cur.fetchall()}
+
+            image_ids, feature_ids = batch_replaced(existing)
+            if image_ids:
+                await cur.execute(
+                    "DELETE FROM listing_images WHERE listing_id = ANY(%s);",
+                    (image_ids,),
+                )
+            if feature_ids:
+                await cur.execute(
+                    "DELETE FROM listing_features WHERE listing_id = ANY(%s);",
+                    (feature_ids,),
+                )
+            changed.update(image_ids, feature_ids)
+            _, more_images, more_features = batch_rows(
+                existing, [item.id for item in existing]
+            )
+            images += more_images
+            features += more_features
+
+        # COPY is the fastest way in with psycopg 3
+        for table, columns, rows in [
+            ("listings", BATCH_LISTING_COLUMNS, listings),
+            ("listing_images", ["listing_id", "caption", "url"], images),
+            ("listing_features", ["listing_id", "feature_id"], features),
+        ]:
+            if not rows:
+                continue
+            async with cur.copy(
+                f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+            ) as copy:
+                for row in rows:
+                    await copy.write_row(row)
+
+    return batch_results(items, errors, ids, changed)
+
+
+async def delete_listing(con, listing_id):
+    return await _returning_id(
+        con, "DELETE FROM listings WHERE id = %s RETURNING id;", (listing_id,)
+    )
+
+
+async def update_listing(
+    con,
+    listing_id,
+    title,
+    description,
+    price,
+    living_area,
+    lot_size,
+    room_count,
+    year_built,
+    floor_number,
+    energy_class,
+    renovation_year,
+    address_id,
+    property_type_id,
+    realtor_id,
+    status_id,
+):
+    return await _returning_id(
+        con,
+        """
+        UPDATE listings
+        SET title = %s,
+            description = %s,
+            price = %s,
+            living_area = %s,
+            lot_size = %s,
+            room_count = %s,
+            year_built = %s,
+            floor_number = %s,
+            energy_class = %s,
+            renovation_year = %s,
+            address_id = %s,
+            property_type_id = %s,
+            realtor_id = %s,
+            status_id = %s
+        WHERE id = %s
+        RETURNING id;
+        """,
+        (
+            title,
+            description,
+            price,
+            living_area,
+            lot_size,
+            room_count,
+            year_built,
+            floor_number,
+            energy_class,
+            renovation_year,
+            address_id,
+            property_type_id,
+            realtor_id,
+            status_id,
+            listing_id,
+        ),
+    )
+
+
+# USERS FUNCTIONS
+
+
+async def _get_page(con, table, page):
+    if page is None:
+        page = PageParams()
+    async with con.cursor(row_factory=dict_row) as cur:
+        return await fetch_page(
+            cur, f"SELECT * FROM {table}", [], [], BY_ID, page.limit, page.cursor
+        )
+
+
+async def get_all_users(con, page=None):
+    return await _get_page(con, "users", page)
+
+
+async def create_user(
+    con,
+    first_name,
+    surname,
+    mail,
+    password,
+    phone_number,
+    birthdate,
+    role_id,
+    address_id,
+    company_id,
+):
+    row = await _returning_id(
+        con,
+        """
+        INSERT INTO users (first_name, surname, mail, password, phone_number, birthdate, role_id, address_id, company_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id;
+        """,
+        (
+            first_name,
+            surname,
+            mail,
+            password,
+            phone_number,
+            birthdate,
+            role_id,
+            address_id,
+            company_id,
+        ),
+    )
+    return row[0]
+
+
+async def get_one_user(con, user_id):
+    return await _cached(
+        row_cache,
+        ("users", user_id),
+        lambda: _fetch_one(con, "SELECT * FROM users WHERE id = %s", (user_id,)),
+    )
+
+
+async def delete_user(con, user_id):
+    return await _returning_id(
+        con, "DELETE FROM users WHERE id = %s RETURNING id;", (user_id,)
+    )
+
+
+async def update_user(
+    con,
+    user_id,
+    first_name,
+    surname,
+    mail,
+    password,
+    phone_number,
+    birthdate,
+    role_id,
+    address_id,
+    company_id,
+):
+    return await _returning_id(
+        con,
+        """
+        UPDATE users
+        SET first_name = %s,
+            surname = %s,
+            mail = %s,
+            password = %s,
+            phone_number = %s,
+            birthdate = %s,
+            role_id = %s,
+            address_id = %s,
+            company_id = %s
+        WHERE id = %s
+        RETURNING id;
+        """,
+        (
+            first_name,
+            surname,
+            mail,
+            password,
+            phone_number,
+            birthdate,
+            role_id,
+            address_id,
+            company_id,
+            user_id,
+        ),
+    )
+
+
+# COMPANIES FUNCTIONS
+
+
+async def get_all_companies(con, page=None):
+    return await _get_page(con, "realtor_companies", page)
+
+
+async def get_one_company(con, company_id):
+    return await _fetch_one(
+        con, "SELECT * FROM realtor_companies WHERE id = %s", (company_id,)
+    )
+
+
+async def create_company(con, name, address_id):
+    row = await _returning_id(
+        con,
+        "INSERT INTO realtor_companies (name, address_id) VALUES (%s, %s) RETURNING id;",
+        (name, address_id),
+    )
+    return row[0]
+
+
+async def delete_company(con, company_id):
+    return await _returning_id(
+        con, "DELETE FROM realtor_companies WHERE id = %s RETURNING id;", (company_id,)
+    )
+
+
+async def update_company(con, company_id, name, address_id):
+    return await _returning_id(
+        con,
+        "UPDATE realtor_companies SET name = %s, address_id = %s WHERE id = %s RETURNING id;",
+        (name, address_id, company_id),
+    )
+
+
+# ADDRESSES FUNCTIONS
+
+
+async def get_all_addresses(con, page=None):
+    return await _get_page(con, "addresses", page)
+
+
+async def get_one_address(con, address_id):
+    return await _fetch_one(con, "SELECT * FROM addresses WHERE id = %s", (address_id,))
+
+
+async def create_address(
+    con, street, city, postcode, country, latitude=None, longitude=None
+):
+    row = await _returning_id(
+        con,
+        "INSERT INTO addresses (street, city, postcode, country, latitude, longitude) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id;",
+        (street, city, postcode, country, latitude, longitude),
+    )
+    return row[0]
+
+
+async def delete_address(con, address_id):
+    return await _returning_id(
+        con, "DELETE FROM addresses WHERE id = %s RETURNING id;", (address_id,)
+    )
+
+
+async def update_address(
+    con, address_id, street, city, postcode, country, latitude=None, longitude=None
+):
+    return await _returning_id(
+        con,
+        "UPDATE addresses SET street = %s, city = %s, postcode = %s, country = %s, latitude = %s, longitude = %s WHERE id = %s RETURNING id;",
+        (street, city, postcode, country, latitude, longitude, address_id),
+    )
+
+
+# FEATURE FUNCTIONS
+
+
+async def _commit_and_invalidate(con, table):
+    # Commit before dropping the cache entries, otherwise another request
+    # could cache the old rows again before our change is visible
+    await con.commit()
+    reference_cache.invalidate(table)
+
+
+async def get_all_features(con, page=None):
+    if page is None:
+        page = PageParams()
+    return await _cached(
+        reference_cache,
+        ("features", "page", page.limit, page.cursor),
+        lambda: _get_page(con, "features", page),
+    )
+
+
+async def get_one_feature(con, feature_id):
+    return await _cached(
+        reference_cache,
+        ("features", feature_id),
+        lambda: _fetch_one(con, "SELECT * FROM features WHERE id = %s", (feature_id,)),
+    )
+
+
+async def create_feature(con, name):
+    row = await _returning_id(
+        con, "INSERT INTO features (name) VALUES (%s) RETURNING id;", (name,)
+    )
+    await _commit_and_invalidate(con, "features")
+    return row[0]
+
+
+async def delete_feature(con, feature_id):
+    row = await _returning_id(
+        con, "DELETE FROM features WHERE id = %s RETURNING id;", (feature_id,)
+    )
+    await _commit_and_invalidate(con, "features")
+    return row
+
+
+async def update_feature(con, feature_id, name):
+    row = await _returning_id(
+        con,
+        "UPDATE features SET name = %s WHERE id = %s RETURNING id;",
+        (name, feature_id),
+    )
+    await _commit_and_invalidate(con, "features")
+    return row
+
+
+# LOOKUP FUNCTIONS
+
+
+async def _fetch_all(con, sql):
+    async with con.cursor(row_factory=dict_row) as cur:
+        await cur.execute(sql)
+        return await cur.fetchall()
+
+
+async def get_all_property_types(con):
+    return await _cached(
+        reference_cache,
+        ("property_types",),
+        lambda: _fetch_all(con, "SELECT * FROM property_types ORDER BY id;"),
+    )
+
+
+async def get_all_statuses(con):
+    return await _cached(
+        reference_cache,
+        ("status",),
+        lambda: _fetch_all(con, "SELECT * FROM status ORDER BY id;"),
+    )
+
+
+async def get_all_roles(con):
+    return await _cached(
+        reference_cache,
+        ("roles",),
+        lambda: _fetch_all(con, "SELECT * FROM roles ORDER BY id;"),
+    )
+
+
+# PATCH LISTINGS FUNCTIONS
+
+
+async def update_listing_price(con, listing_id, new_price):
+    return await _returning_id(
+        con,
+        "UPDATE listings SET price = %s WHERE id = %s RETURNING id;",
+        (new_price, listing_id),
+    )
+
+
+async def update_listing_status(con, listing_id, new_status_id):
+    return await _returning_id(
+        con,
+        "UPDATE listings SET status_id = %s WHERE id = %s RETURNING id;",
+        (new_status_id, listing_id),
+    )
+
+
+# MESSAGE FUNCTIONS
+
+
+async def create_message(con, sender_id, receiver_id, listing_id, content):
+    return await _fetch_one(
+        con,
+        CREATE_MESSAGE_SQL,
+        message_params(sender_id, receiver_id, listing_id, content),
+    )
+
+
+async def get_messages_for_listing(con, listing_id, page=None):
+    if page is None:
+        page = PageParams()
+    async with con.cursor(row_factory=dict_row) as cur:
+        return await fetch_page(
+            cur,
+            "SELECT * FROM messages",
+            ["listing_id = %s"],
+            [listing_id],
+            MESSAGE_SORT,
+            page.limit,
+            page.cursor,
+        )
+
+
+async def get_messages_for_user(con, user_id, page=None):
+    if page is None:
+        page = PageParams()
+    async with con.cursor(row_factory=dict_row) as cur:
+        await cur.execute(*messages_for_user_query(user_id, page))
+        return page_result(await cur.fetchall(), MESSAGE_SORT, page.limit)
+
+
+# CONVERSATION FUNCTIONS
+
+
+async def get_conversations_for_user(con, user_id, page=None):
+    if page is None:
+        page = PageParams()
+    async with con.cursor(row_factory=dict_row) as cur:
+        conversations, next_cursor = await fetch_page(
+            cur,
+            INBOX_SQL,
+            ["cm.user_id = %s"],
+            [user_id],
+            CONVERSATION_SORT,
+            page.limit,
+            page.cursor,
+        )
+        await cur.execute(UNREAD_TOTAL_SQL, (user_id,))
+        return conversations, next_cursor, (await cur.fetchone())["unread_total"]
+
+
+async def get_conversation_messages(con, conversation_id, page=None):
+    if page is None:
+        page = PageParams()
+    async with con.cursor(row_factory=dict_row) as cur:
+        return await fetch_page(
+            cur,
+            "SELECT * FROM messages",
+            ["conversation_id = %s"],
+            [conversation_id],
+            MESSAGE_SORT,
+            page.limit,
+            page.cursor,
+        )
+
+
+async def mark_conversation_read(con, conversation_id, user_id):
+    return await _returning_id(con, MARK_READ_SQL, (conversation_id, user_id))
+
+
+# SAVED SEARCH FUNCTIONS
+
+
+async def get_saved_searches_for_user(con, user_id, page=None):
+    if page is None:
+        page = PageParams()
+    async with con.cursor(row_factory=dict_row) as cur:
+        return await fetch_page(
+            cur,
+            SAVED_SEARCH_SELECT,
+            ["s.user_id = %s"],
+            [user_id],
+            SAVED_SEARCH_SORT,
+            page.limit,
+            page.cursor,
+        )
+
+
+async def create_saved_search(con, search):
+    row = await _returning_id(con, CREATE_SAVED_SEARCH_SQL, saved_search_params(search))
+    if row is None:
+        raise ValueError(f"Unknown property type: {search.property_type}")
+    return row[0]
+
+
+async def delete_saved_search(con, saved_search_id):
+    return await _returning_id(
+        con,
+        "DELETE FROM saved_searches WHERE id = %s RETURNING id;",
+        (saved_search_id,),
+    )
+
+
+async def get_alerts_for_user(con, user_id, page=None):
+    if page is None:
+        page = PageParams()
+    async with con.cursor(row_factory=dict_row) as cur:
+        return await fetch_page(
+            cur,
+            ALERTS_SQL,
+            ["al.user_id = %s"],
+            [user_id],
+            ALERT_SORT,
+            page.limit,
+            page.cursor,
+        )
+
+
+# STATS FUNCTIONS
+
+
+async def get_listing_stats(con, dimension=None):
+    async with con.cursor(row_factory=dict_row) as cur:
+        await cur.execute(LISTING_STATS_SQL, {"dimension": dimension})
+        rows = await cur.fetchall()
+        await cur.execute(STATS_REFRESHED_AT_SQL)
+        refreshed = await cur.fetchone()
+    return rows, refreshed["refreshed_at"] if refreshed else None
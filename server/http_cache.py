@@ -0,0 +1,85 @@
+"""
+HTTP conditional requests (ETag / Last-Modified).
+
+A client that already has a response sends its ETag back in If-None-Match
+(or its Last-Modified in If-Modified-Since). When nothing changed we answer
+304 Not Modified with no body, so the response is neither serialized nor
+sent again.
+
+The ETags are weak (W/"..."): they say the data is the same, not that the
+bytes are, which is all a client cache needs.
+"""
+
+import hashlib
+import json
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Response
+
+
+def _version(updated_at):
+    # Microseconds since the epoch, changes with every update
+    return int(updated_at.timestamp() * 1_000_000)
+
+
+def row_etag(table, row):
+    return f'W/"{table}-{row["id"]}-{_version(row["updated_at"])}"'
+
+
+def page_etag(query, rows, next_cursor, extra=None):
+    """
+    ETag for one page of a list. It changes when a row on the page is
+    updated, added or removed, and differs between query strings, since
+    the same rows can be sent with different fields. extra is anything
+    else the response contains (like facet counts), as JSON serializable
+    data.
+    """
+    digest = hashlib.md5(query.encode())
+    for row in rows:
+        digest.update(f"|{row['id']}:{_version(row['updated_at'])}".encode())
+    digest.update(f"|{next_cursor}".encode())
+    if extra is not None:
+        digest.update(json.dumps(extra, sort_keys=True).encode())
+    return f'W/"{digest.hexdigest()}"'
+
+
+def cache_headers(etag, last_modified=None):
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(
+            last_modified.astimezone(timezone.utc), usegmt=True
+        )
+    return headers
+
+
+def _strip_weak(tag):
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """True if the client's copy (If-None-Match / If-Modified-Since) is current."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match wins over If-Modified-Since when both are sent
+        if if_none_match.strip() == "*":
+            return True
+        tags = {_strip_weak(tag) for tag in if_none_match.split(",")}
+        return _strip_weak(etag) in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            return False
+        # HTTP dates have whole seconds only
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def not_modified_response(headers):
+    return Response(status_code=304, headers=headers)
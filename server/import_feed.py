@@ -0,0 +1,166 @@
+"""
+Import a realtor feed: a file with one listing per line as JSON (NDJSON),
+with the fields of ListingCreate plus the feed's own external_id.
+
+Feeds send the same listings again every day. Each listing is upserted on
+(source, external_id): new ones are inserted, and existing ones are only
+updated when a value actually changed. Unchanged listings are not written
+at all, so their updated_at, ETag and cached copies stay as they are.
+
+The file is read line by line and written in batches, each batch in its
+own transaction, so any file size works and a failed import can simply be
+run again.
+
+    python -m server.import_feed acme feed.ndjson
+    cat feed.ndjson | python -m server.import_feed acme -
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from psycopg2.extras import RealDictCursor, execute_values
+from pydantic import ValidationError
+
+from server.db import BATCH_REFERENCES_SQL, batch_errors, batch_reference_params
+from server.db_setup import get_connection
+from server.schemas import ListingFeedItem
+
+# The listing columns a feed sets
+FEED_COLUMNS = [
+    "title",
+    "description",
+    "price",
+    "living_area",
+    "lot_size",
+    "room_count",
+    "year_built",
+    "floor_number",
+    "energy_class",
+    "renovation_year",
+    "address_id",
+    "property_type_id",
+    "realtor_id",
+    "status_id",
+]
+
+# xmax is 0 for a row this statement inserted, and set for one it updated.
+# Rows the WHERE skipped (nothing changed) are not returned.
+UPSERT_SQL = f"""
+    INSERT INTO listings (external_source, external_id, {", ".join(FEED_COLUMNS)})
+    VALUES %s
+    ON CONFLICT (external_source, external_id) DO UPDATE
+    SET {", ".join(f"{c} = EXCLUDED.{c}" for c in FEED_COLUMNS)}
+    WHERE ({", ".join(f"listings.{c}" for c in FEED_COLUMNS)})
+        IS DISTINCT FROM ({", ".join(f"EXCLUDED.{c}" for c in FEED_COLUMNS)})
+    RETURNING (xmax = 0) AS inserted
+"""
+
+
+def read_feed(lines):
+    """Yield (line number, ListingFeedItem or error message) per line."""
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, ListingFeedItem.model_validate_json(line)
+        except ValidationError as e:
+            yield number, f"{e.error_count()} invalid field(s): " + "; ".join(
+                f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()
+            )
+
+
+def upsert_batch(cur, source, items):
+    """
+    Upsert one batch of (line number, item). Returns the number of inserted,
+    updated and unchanged listings and a list of (line number, error).
+    """
+    # A feed may list the same listing twice, the last line wins
+    by_external_id = {item.external_id: (number, item) for number, item in items}
+    numbers = [number for number, _ in by_external_id.values()]
+    items = [item for _, item in by_external_id.values()]
+
+    cur.execute(BATCH_REFERENCES_SQL, batch_reference_params(items))
+    errors = batch_errors(items, cur.fetchone())
+    valid = [item for index, item in enumerate(items) if index not in errors]
+
+    inserted = updated = 0
+    if valid:
+        rows = execute_values(
+            cur,
+            UPSERT_SQL,
+            [
+                (source, item.external_id)
+                + tuple(getattr(item, c) for c in FEED_COLUMNS)
+                for item in valid
+            ],
+            page_size=len(valid),
+            fetch=True,
+        )
+        inserted = sum(1 for row in rows if row["inserted"])
+        updated = len(rows) - inserted
+
+    unchanged = len(valid) - inserted - updated
+    return (
+        inserted,
+        updated,
+        unchanged,
+        [(numbers[index], message) for index, message in errors.items()],
+    )
+
+
+def import_feed(source, lines, batch_size=1000):
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "failed": 0}
+    errors = []
+    started = time.perf_counter()
+
+    con = get_connection()
+    try:
+
+        def flush(batch):
+            with con, con.cursor(cursor_factory=RealDictCursor) as cur:
+                inserted, updated, unchanged, failed = upsert_batch(cur, source, batch)
+            counts["inserted"] += inserted
+            counts["updated"] += updated
+            counts["unchanged"] += unchanged
+            counts["failed"] += len(failed)
+            errors.extend(failed)
+
+        batch = []
+        for number, item in read_feed(lines):
+            if isinstance(item, str):
+                counts["failed"] += 1
+                errors.append((number, item))
+                continue
+            batch.append((number, item))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        con.close()
+
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a realtor feed (NDJSON)")
+    parser.add_argument("source", help="name of the feed, e.g. the company")
+    parser.add_argument("file", help="NDJSON file, or - for stdin")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.file == "-":
+        counts, errors = import_feed(args.source, sys.stdin, args.batch_size)
+    else:
+        with open(args.file, encoding="utf-8") as f:
+            counts, errors = import_feed(args.source, f, args.batch_size)
+
+    for number, message in errors[:20]:
+        print(f"line {number}: {message}")
+    if len(errors) > 20:
+        print(f"... and {len(errors) - 20} more errors")
+    print(json.dumps(counts))
@@ -0,0 +1,146 @@
+"""
+Pushes new messages to the users over Server-Sent Events.
+
+Migration 0017 NOTIFYs every new message on the messages channel. Each
+worker gets them through its one listener connection (server/notify.py)
+and passes each message on to the open streams of its sender and receiver.
+A client keeps GET /messages/user/{user_id}/stream open instead of polling
+the messages, and costs no database work while it waits.
+
+The stream sends these events:
+
+    event: message    data: the message as JSON
+    event: resync     data: {}
+
+resync means messages may have been missed (the listener reconnected, or
+the client read too slowly), so the client should reload its inbox. New
+messages are not replayed on connect either: load the inbox, then open
+the stream.
+"""
+
+import asyncio
+import json
+import os
+import threading
+
+MESSAGES_CHANNEL = "messages"
+# Events waiting for a slow client before it is told to resync instead
+STREAM_QUEUE_SIZE = int(os.getenv("MESSAGE_STREAM_QUEUE_SIZE", "100"))
+# Proxies close connections that stay silent for too long
+KEEPALIVE_INTERVAL = float(os.getenv("MESSAGE_STREAM_KEEPALIVE", "15"))
+# Don't let proxies buffer the stream
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+RESYNC = ("resync", "{}")
+# Ends the stream, sent when the worker shuts down
+CLOSE = None
+
+
+class MessageStream:
+    """The events of one connected client, queued on its event loop."""
+
+    def __init__(self, user_id, loop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+    def send(self, event):
+        # Called from the listener thread, the queue belongs to the loop
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            pass  # The loop is closed, the stream is gone
+
+    def _put(self, event):
+        if self.queue.full():
+            # Too far behind, the client has to reload anyway
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            if event is not CLOSE:
+                event = RESYNC
+        self.queue.put_nowait(event)
+
+
+class MessageHub:
+    def __init__(self):
+        self._streams = {}  # user_id -> {MessageStream}
+        self._lock = threading.Lock()
+
+    def open(self, user_id):
+        stream = MessageStream(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._streams.setdefault(user_id, set()).add(stream)
+        return stream
+
+    def close(self, stream):
+        with self._lock:
+            streams = self._streams.get(stream.user_id)
+            if streams is not None:
+                streams.discard(stream)
+                if not streams:
+                    del self._streams[stream.user_id]
+
+    def _send(self, user_ids, event):
+        with self._lock:
+            streams = [
+                stream
+                for user_id in user_ids
+                for stream in self._streams.get(user_id, ())
+            ]
+        for stream in streams:
+            stream.send(event)
+
+    def send_to_all(self, event):
+        with self._lock:
+            user_ids = list(self._streams)
+        self._send(user_ids, event)
+
+    def on_notification(self, payload):
+        """Listener callback for the messages channel."""
+        if payload is None:
+            # The listener reconnected and may have missed messages
+            self.send_to_all(RESYNC)
+            return
+        message = json.loads(payload)
+        # The sender's other devices get their own message too. The
+        # payload is already JSON, so it is sent as it is.
+        self._send({message["sender_id"], message["receiver_id"]}, ("message", payload))
+
+    async def events(self, user_id):
+        """
+        The user's messages as Server-Sent Events, for a StreamingResponse.
+        The stream is open while the response is being sent.
+        """
+        stream = self.open(user_id)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        stream.queue.get(), KEEPALIVE_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is CLOSE:
+                    return
+                name, data = event
+                yield f"event: {name}\ndata: {data}\n\n"
+        finally:
+            self.close(stream)
+
+
+message_hub = MessageHub()
+
+
+def start_message_stream(listener):
+    listener.subscribe(MESSAGES_CHANNEL, message_hub.on_notification)
+    listener.start()
+    # Messages sent before the LISTEN would never reach the streams
+    if not listener.wait_listening(MESSAGES_CHANNEL, timeout=5):
+        print("Could not start the message listener, streams get no messages yet")
+
+
+def stop_message_stream(listener):
+    listener.unsubscribe(MESSAGES_CHANNEL, message_hub.on_notification)
+    message_hub.send_to_all(CLOSE)
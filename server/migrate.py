@@ -0,0 +1,225 @@
+"""
+Versioned schema migrations.
+
+Migrations are the .sql files in server/migrations, applied in file name
+order (0001_..., 0002_..., ...). Every applied version is recorded in the
+schema_migrations table, so each file runs exactly once per database.
+
+A migration normally runs in one transaction together with the insert into
+schema_migrations. Files whose first line is
+
+    -- migrate: no-transaction
+
+run statement by statement in autocommit mode instead. That is needed for
+CREATE INDEX CONCURRENTLY, which builds an index without blocking writes
+but is not allowed inside a transaction, and for backfills that commit
+after every batch (a DO block with COMMIT). Write those statements so a
+migration that was interrupted can simply be run again (IF NOT EXISTS, or
+a backfill that only touches the rows still missing their value).
+
+    python -m server.migrate             apply pending migrations
+    python -m server.migrate --dry-run   only print what would run
+    python -m server.migrate --status    list applied and pending versions
+"""
+
+import argparse
+import os
+import re
+
+from server.db_setup import get_connection
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+NO_TRANSACTION = "-- migrate: no-transaction"
+# Any constant works, it only has to be the same for every process
+LOCK_ID = 7_345_001
+
+
+class MigrationError(Exception):
+    pass
+
+
+def load_migrations():
+    """Return [(version, name, sql, in_transaction)] sorted by version."""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.match(r"^(\d+)_(\w+)\.sql$", filename)
+        if not match:
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename), encoding="utf-8") as f:
+            sql = f.read()
+        in_transaction = not sql.lstrip().startswith(NO_TRANSACTION)
+        migrations.append((match.group(1), match.group(2), sql, in_transaction))
+
+    versions = [m[0] for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise MigrationError("Two migration files have the same version number")
+    return migrations
+
+
+def split_statements(sql):
+    """
+    Split a migration into single statements on the ";" that ends a line.
+    Semicolons inside $$ quoted function bodies are left alone.
+    """
+    statements = []
+    current = []
+    in_dollar_quote = False
+    for line in sql.splitlines():
+        # Skip blank lines and comments between statements
+        if not current and (not line.strip() or line.strip().startswith("--")):
+            continue
+        current.append(line)
+        if line.count("$$") % 2 == 1:
+            in_dollar_quote = not in_dollar_quote
+        if not in_dollar_quote and line.rstrip().endswith(";"):
+            statements.append("\n".join(current).strip())
+            current = []
+    if "\n".join(current).strip():
+        statements.append("\n".join(current).strip())
+    return statements
+
+
+def managed_indexes():
+    """Names of the indexes the migrations create (and do not drop again)."""
+    created = set()
+    for _, _, sql, _ in load_migrations():
+        for statement in split_statements(sql):
+            match = re.match(
+                r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?"
+                r"(?:IF\s+NOT\s+EXISTS\s+)?(\w+)",
+                statement,
+                re.I,
+            )
+            if match:
+                created.add(match.group(1))
+            match = re.match(
+                r"DROP\s+INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+EXISTS\s+)?(\w+)",
+                statement,
+                re.I,
+            )
+            if match:
+                created.discard(match.group(1))
+    return created
+
+
+def _create_version_table(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(20) PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        """
+    )
+
+
+def _applied_versions(cur):
+    cur.execute("SELECT to_regclass('schema_migrations');")
+    if cur.fetchone()[0] is None:
+        return set()
+    cur.execute("SELECT version FROM schema_migrations;")
+    return {row[0] for row in cur.fetchall()}
+
+
+def _invalid_indexes(cur):
+    # A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind
+    cur.execute(
+        """
+        SELECT c.relname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND NOT i.indisvalid;
+        """
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def migrate(dry_run=False):
+    """
+    Apply all pending migrations.
+    Returns the versions that were applied (or would be, with dry_run).
+    """
+    con = get_connection()
+    # Autocommit, so no-transaction migrations can run CONCURRENTLY;
+    # the other migrations open their own transaction below.
+    con.autocommit = True
+    applied_now = []
+    try:
+        with con.cursor() as cur:
+            # Only one process may migrate at a time
+            cur.execute("SELECT pg_advisory_lock(%s);", (LOCK_ID,))
+            try:
+                if not dry_run:
+                    _create_version_table(cur)
+                applied = _applied_versions(cur)
+                for version, name, sql, in_transaction in load_migrations():
+                    if version in applied:
+                        continue
+                    print(f"Applying {version}_{name}")
+                    if dry_run:
+                        for statement in split_statements(sql):
+                            print(f"  {statement}")
+                    elif in_transaction:
+                        cur.execute("BEGIN;")
+                        try:
+                            cur.execute(sql)
+                            cur.execute(
+                                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                                (version, name),
+                            )
+                            cur.execute("COMMIT;")
+                        except Exception:
+                            cur.execute("ROLLBACK;")
+                            raise
+                    else:
+                        for statement in split_statements(sql):
+                            cur.execute(statement)
+                        invalid = _invalid_indexes(cur)
+                        if invalid:
+                            raise MigrationError(
+                                f"{version}_{name} left invalid indexes {invalid}; "
+                                "drop them and run the migration again"
+                            )
+                        cur.execute(
+                            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                            (version, name),
+                        )
+                    applied_now.append(version)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s);", (LOCK_ID,))
+    finally:
+        con.close()
+
+    if not applied_now:
+        print("Database is up to date.")
+    return applied_now
+
+
+def status():
+    con = get_connection()
+    try:
+        with con, con.cursor() as cur:
+            applied = _applied_versions(cur)
+    finally:
+        con.close()
+    for version, name, _, in_transaction in load_migrations():
+        state = "applied" if version in applied else "pending"
+        mode = "" if in_transaction else " (no transaction)"
+        print(f"{version}_{name}: {state}{mode}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema migrations")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="print pending migrations only"
+    )
+    parser.add_argument(
+        "--status", action="store_true", help="list applied and pending migrations"
+    )
+    args = parser.parse_args()
+    if args.status:
+        status()
+    else:
+        migrate(dry_run=args.dry_run)
@@ -0,0 +1,44 @@
+-- migrate: no-transaction
+-- Secondary indexes for foreign keys and the columns we filter and sort on.
+-- Built CONCURRENTLY so writes to a live listings table are not blocked.
+
+-- Listings: joins and filters
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_address_id_idx
+    ON listings (address_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_realtor_id_idx
+    ON listings (realtor_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_status_id_idx
+    ON listings (status_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_room_count_idx
+    ON listings (room_count);
+
+-- Listings: one index per sort option of GET /listings, with the id as
+-- tie breaker so the keyset pagination can read pages straight from it
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_created_at_idx
+    ON listings (created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_price_idx
+    ON listings (price, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_living_area_idx
+    ON listings (living_area DESC, id DESC);
+
+-- Listings: property type filter combined with the sort options
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_type_created_at_idx
+    ON listings (property_type_id, created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_type_price_idx
+    ON listings (property_type_id, price, id);
+
+-- Messages, newest first per listing / sender / receiver
+CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_listing_created_at_idx
+    ON messages (listing_id, created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_sender_created_at_idx
+    ON messages (sender_id, created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_receiver_created_at_idx
+    ON messages (receiver_id, created_at DESC, id DESC);
+
+-- Child tables of listings
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listing_images_listing_id_idx
+    ON listing_images (listing_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listing_features_feature_id_idx
+    ON listing_features (feature_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS favorite_listing_id_idx
+    ON favorite (listing_id);
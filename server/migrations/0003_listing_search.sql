@@ -0,0 +1,61 @@
+-- Full text search over listings.
+-- listings.search_vector holds the title, street, city, property type and
+-- description (in that order of weight), stemmed with the Swedish
+-- dictionary. It is kept up to date by triggers.
+
+ALTER TABLE listings ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION listings_search_vector_update() RETURNS trigger AS $$
+DECLARE
+    v_street TEXT;
+    v_city TEXT;
+    v_type TEXT;
+BEGIN
+    SELECT street, city INTO v_street, v_city FROM addresses WHERE id = NEW.address_id;
+    SELECT name INTO v_type FROM property_types WHERE id = NEW.property_type_id;
+    NEW.search_vector :=
+        setweight(to_tsvector('swedish', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('swedish', coalesce(v_street, '') || ' ' || coalesce(v_city, '')), 'B') ||
+        setweight(to_tsvector('swedish', coalesce(v_type, '')), 'B') ||
+        setweight(to_tsvector('swedish', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS listings_search_vector_trigger ON listings;
+CREATE TRIGGER listings_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description, address_id, property_type_id
+    ON listings
+    FOR EACH ROW EXECUTE FUNCTION listings_search_vector_update();
+
+-- When an address or a property type is renamed, rebuild the vectors of the
+-- listings using it. Setting the column to itself fires the trigger above.
+CREATE OR REPLACE FUNCTION addresses_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    UPDATE listings SET address_id = address_id WHERE address_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS addresses_search_vector_trigger ON addresses;
+CREATE TRIGGER addresses_search_vector_trigger
+    AFTER UPDATE OF street, city ON addresses
+    FOR EACH ROW
+    WHEN (OLD.street IS DISTINCT FROM NEW.street OR OLD.city IS DISTINCT FROM NEW.city)
+    EXECUTE FUNCTION addresses_search_vector_update();
+
+CREATE OR REPLACE FUNCTION property_types_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    UPDATE listings SET property_type_id = property_type_id WHERE property_type_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS property_types_search_vector_trigger ON property_types;
+CREATE TRIGGER property_types_search_vector_trigger
+    AFTER UPDATE OF name ON property_types
+    FOR EACH ROW
+    WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION property_types_search_vector_update();
+
+-- The listings that already exist are filled in batches by 0024
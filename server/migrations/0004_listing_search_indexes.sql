@@ -0,0 +1,11 @@
+-- migrate: no-transaction
+-- Indexes for the listing search: GIN over the search vector, and trigram
+-- GIN over the street so partial street names ("kungsg") can be found
+-- with ILIKE without scanning all addresses.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_search_vector_idx
+    ON listings USING gin (search_vector);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS addresses_street_trgm_idx
+    ON addresses USING gin (street gin_trgm_ops);
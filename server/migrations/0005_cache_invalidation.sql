@@ -0,0 +1,77 @@
+-- Tell every API worker when cached rows change.
+-- Changes to listings and users send a NOTIFY on the cache_invalidation
+-- channel with "<table>:<id>" as payload, or "<table>:*" when so many rows
+-- changed that the worker should just drop everything for that table.
+-- Notifications are only delivered when the transaction commits.
+
+CREATE OR REPLACE FUNCTION notify_cache_invalidation() RETURNS trigger AS $$
+DECLARE
+    -- The cache to invalidate, given as trigger argument
+    v_cache TEXT := TG_ARGV[0];
+    v_ids INT[];
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('cache_invalidation', v_cache || ':*');
+        RETURN NULL;
+    END IF;
+
+    IF TG_TABLE_NAME = 'addresses' THEN
+        -- A changed address changes the listings that use it
+        SELECT array_agg(l.id) INTO v_ids
+        FROM listings l JOIN changed_rows c ON l.address_id = c.id;
+    ELSE
+        SELECT array_agg(id) INTO v_ids FROM changed_rows;
+    END IF;
+
+    IF cardinality(v_ids) > 100 THEN
+        PERFORM pg_notify('cache_invalidation', v_cache || ':*');
+    ELSE
+        PERFORM pg_notify('cache_invalidation', v_cache || ':' || id)
+        FROM unnest(v_ids) AS id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- One trigger per statement, not per row, so a bulk update sends a
+-- single "*" instead of thousands of notifications.
+DROP TRIGGER IF EXISTS listings_cache_update_trigger ON listings;
+CREATE TRIGGER listings_cache_update_trigger
+    AFTER UPDATE ON listings
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('listings');
+
+DROP TRIGGER IF EXISTS listings_cache_delete_trigger ON listings;
+CREATE TRIGGER listings_cache_delete_trigger
+    AFTER DELETE ON listings
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('listings');
+
+DROP TRIGGER IF EXISTS listings_cache_truncate_trigger ON listings;
+CREATE TRIGGER listings_cache_truncate_trigger
+    AFTER TRUNCATE ON listings
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('listings');
+
+DROP TRIGGER IF EXISTS users_cache_update_trigger ON users;
+CREATE TRIGGER users_cache_update_trigger
+    AFTER UPDATE ON users
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('users');
+
+DROP TRIGGER IF EXISTS users_cache_delete_trigger ON users;
+CREATE TRIGGER users_cache_delete_trigger
+    AFTER DELETE ON users
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('users');
+
+DROP TRIGGER IF EXISTS users_cache_truncate_trigger ON users;
+CREATE TRIGGER users_cache_truncate_trigger
+    AFTER TRUNCATE ON users
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('users');
+
+-- Listings show their address, so address changes invalidate them too
+DROP TRIGGER IF EXISTS addresses_cache_update_trigger ON addresses;
+CREATE TRIGGER addresses_cache_update_trigger
+    AFTER UPDATE ON addresses
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('listings');
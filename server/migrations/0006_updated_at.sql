@@ -0,0 +1,87 @@
+-- updated_at on listings and the tables shown together with them, used for
+-- ETag and Last-Modified in the API.
+-- listings.updated_at changes whenever anything a listing response shows
+-- changes: the listing itself, its address, property type, images or
+-- features.
+
+ALTER TABLE listings ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+ALTER TABLE addresses ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+-- clock_timestamp() and not NOW(), so a change is never stamped earlier
+-- than a response that was sent while its transaction was running
+CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS listings_updated_at_trigger ON listings;
+CREATE TRIGGER listings_updated_at_trigger
+    BEFORE UPDATE ON listings
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+DROP TRIGGER IF EXISTS addresses_updated_at_trigger ON addresses;
+CREATE TRIGGER addresses_updated_at_trigger
+    BEFORE UPDATE ON addresses
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+DROP TRIGGER IF EXISTS users_updated_at_trigger ON users;
+CREATE TRIGGER users_updated_at_trigger
+    BEFORE UPDATE ON users
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+-- Address changes: the trigger from 0003 already updates the listings when
+-- the street or city changes. Let it run for every address column, so a new
+-- postcode also moves listings.updated_at.
+DROP TRIGGER IF EXISTS addresses_search_vector_trigger ON addresses;
+CREATE TRIGGER addresses_search_vector_trigger
+    AFTER UPDATE ON addresses
+    FOR EACH ROW
+    WHEN (
+        (OLD.street, OLD.city, OLD.postcode, OLD.country)
+        IS DISTINCT FROM (NEW.street, NEW.city, NEW.postcode, NEW.country)
+    )
+    EXECUTE FUNCTION addresses_search_vector_update();
+
+-- Images and features: touch the listings they belong to. Statement level,
+-- so a bulk insert runs one UPDATE and not one per row. The seeders skip
+-- it altogether (app.bulk_load, 0025).
+CREATE OR REPLACE FUNCTION touch_listings() RETURNS trigger AS $$
+BEGIN
+    UPDATE listings SET updated_at = clock_timestamp()
+    WHERE id IN (SELECT listing_id FROM changed_rows);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS listing_images_insert_touch_trigger ON listing_images;
+CREATE TRIGGER listing_images_insert_touch_trigger
+    AFTER INSERT ON listing_images
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION touch_listings();
+
+DROP TRIGGER IF EXISTS listing_images_update_touch_trigger ON listing_images;
+CREATE TRIGGER listing_images_update_touch_trigger
+    AFTER UPDATE ON listing_images
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION touch_listings();
+
+DROP TRIGGER IF EXISTS listing_images_delete_touch_trigger ON listing_images;
+CREATE TRIGGER listing_images_delete_touch_trigger
+    AFTER DELETE ON listing_images
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION touch_listings();
+
+DROP TRIGGER IF EXISTS listing_features_insert_touch_trigger ON listing_features;
+CREATE TRIGGER listing_features_insert_touch_trigger
+    AFTER INSERT ON listing_features
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION touch_listings();
+
+DROP TRIGGER IF EXISTS listing_features_delete_touch_trigger ON listing_features;
+CREATE TRIGGER listing_features_delete_touch_trigger
+    AFTER DELETE ON listing_features
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION touch_listings();
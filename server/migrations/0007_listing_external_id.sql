@@ -0,0 +1,6 @@
+-- Listings imported from realtor feeds (server/import_feed.py) remember
+-- which feed they came from and the feed's own id for them. Listings
+-- created through the API leave both NULL.
+
+ALTER TABLE listings ADD COLUMN IF NOT EXISTS external_source VARCHAR(100);
+ALTER TABLE listings ADD COLUMN IF NOT EXISTS external_id VARCHAR(255);
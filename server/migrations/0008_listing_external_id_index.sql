@@ -0,0 +1,6 @@
+-- migrate: no-transaction
+-- The key of the feed import upsert (INSERT ... ON CONFLICT). NULLs never
+-- conflict, so listings without an external id are not affected.
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS listings_external_id_key
+    ON listings (external_source, external_id);
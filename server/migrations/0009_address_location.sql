@@ -0,0 +1,37 @@
+-- Coordinates for addresses, for the map search on GET /listings (bbox and
+-- radius) and GET /listings/clusters. Addresses without coordinates are
+-- simply never found by a map search.
+
+ALTER TABLE addresses ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION
+    CHECK (latitude BETWEEN -90 AND 90);
+ALTER TABLE addresses ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION
+    CHECK (longitude BETWEEN -180 AND 180);
+
+ALTER TABLE addresses DROP CONSTRAINT IF EXISTS addresses_location_check;
+ALTER TABLE addresses ADD CONSTRAINT addresses_location_check
+    CHECK ((latitude IS NULL) = (longitude IS NULL));
+
+-- Great circle distance in km (haversine). A plain SQL function, so
+-- Postgres inlines it into the query.
+CREATE OR REPLACE FUNCTION distance_km(
+    lat1 DOUBLE PRECISION, lon1 DOUBLE PRECISION,
+    lat2 DOUBLE PRECISION, lon2 DOUBLE PRECISION
+) RETURNS DOUBLE PRECISION AS $$
+    SELECT 2 * 6371.0 * asin(least(1, sqrt(
+        sin(radians(lat2 - lat1) / 2) ^ 2
+        + cos(radians(lat1)) * cos(radians(lat2)) * sin(radians(lon2 - lon1) / 2) ^ 2
+    )))
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Listings show their address coordinates, so moving an address also
+-- moves listings.updated_at (see 0006)
+DROP TRIGGER IF EXISTS addresses_search_vector_trigger ON addresses;
+CREATE TRIGGER addresses_search_vector_trigger
+    AFTER UPDATE ON addresses
+    FOR EACH ROW
+    WHEN (
+        (OLD.street, OLD.city, OLD.postcode, OLD.country, OLD.latitude, OLD.longitude)
+        IS DISTINCT FROM
+        (NEW.street, NEW.city, NEW.postcode, NEW.country, NEW.latitude, NEW.longitude)
+    )
+    EXECUTE FUNCTION addresses_search_vector_update();
@@ -0,0 +1,7 @@
+-- migrate: no-transaction
+-- Spatial index for the map search. A GiST index on the built in point
+-- type answers "point inside box" (<@) without any extension. The map
+-- queries use exactly this expression, point(longitude, latitude).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS addresses_location_idx
+    ON addresses USING gist (point(longitude, latitude));
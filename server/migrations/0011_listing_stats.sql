@@ -0,0 +1,71 @@
+-- Market statistics for GET /stats, precomputed so a dashboard never scans
+-- the listings. One row per city, property type and status, plus one row
+-- over all listings (dimension 'all').
+-- Refreshed by server/stats.py with REFRESH MATERIALIZED VIEW CONCURRENTLY,
+-- which needs the unique index below.
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS listing_stats AS
+WITH priced AS (
+    SELECT
+        a.city,
+        pt.name AS property_type,
+        s.status,
+        l.price::float8 AS price,
+        l.living_area,
+        l.price::float8 / NULLIF(l.living_area, 0)::float8 AS price_per_m2
+    FROM listings l
+    LEFT JOIN addresses a ON a.id = l.address_id
+    LEFT JOIN property_types pt ON pt.id = l.property_type_id
+    LEFT JOIN status s ON s.id = l.status_id
+),
+grouped AS (
+    SELECT
+        CASE
+            WHEN GROUPING(city) = 0 THEN 'city'
+            WHEN GROUPING(property_type) = 0 THEN 'property_type'
+            WHEN GROUPING(status) = 0 THEN 'status'
+            ELSE 'all'
+        END AS dimension,
+        CASE
+            WHEN GROUPING(city, property_type, status) = 7 THEN 'all'
+            ELSE COALESCE(city, property_type, status)
+        END AS name,
+        COUNT(*) AS listing_count,
+        percentile_cont(ARRAY[0.25, 0.5, 0.75, 0.9])
+            WITHIN GROUP (ORDER BY price) AS price,
+        percentile_cont(ARRAY[0.25, 0.5, 0.75, 0.9])
+            WITHIN GROUP (ORDER BY price_per_m2) AS price_per_m2,
+        AVG(living_area) AS avg_living_area
+    FROM priced
+    GROUP BY GROUPING SETS ((city), (property_type), (status), ())
+)
+SELECT
+    dimension,
+    name,
+    listing_count,
+    round(price[1]::numeric, 2) AS price_p25,
+    round(price[2]::numeric, 2) AS price_median,
+    round(price[3]::numeric, 2) AS price_p75,
+    round(price[4]::numeric, 2) AS price_p90,
+    round(price_per_m2[1]::numeric, 2) AS price_per_m2_p25,
+    round(price_per_m2[2]::numeric, 2) AS price_per_m2_median,
+    round(price_per_m2[3]::numeric, 2) AS price_per_m2_p75,
+    round(price_per_m2[4]::numeric, 2) AS price_per_m2_p90,
+    round(avg_living_area, 2) AS avg_living_area
+FROM grouped
+-- Listings without a city, type or status are only counted in 'all'
+WHERE name IS NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS listing_stats_key
+    ON listing_stats (dimension, name);
+
+-- When each view was last refreshed, and the number of row changes in its
+-- source tables at that time (see server/stats.py)
+CREATE TABLE IF NOT EXISTS stats_refreshes (
+    name TEXT PRIMARY KEY,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    changes BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO stats_refreshes (name) VALUES ('listing_stats')
+ON CONFLICT (name) DO NOTHING;
@@ -0,0 +1,7 @@
+-- migrate: no-transaction
+-- Everything the facet counts of GET /listings?facets=true read from a
+-- listing, so they come from an index only scan of a few MB instead of a
+-- scan over the whole (wide) listings table.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_facets_idx
+    ON listings (property_type_id, status_id, room_count, price) INCLUDE (id);
@@ -0,0 +1,67 @@
+-- listings.feature_ids: the ids of the listing's features, sorted, copied
+-- from listing_features by triggers. Filtering on several features is then
+-- one containment test (feature_ids @> ARRAY[...]) answered by the GIN
+-- index from 0014, instead of one join per feature.
+
+ALTER TABLE listings ADD COLUMN IF NOT EXISTS feature_ids INT[] NOT NULL DEFAULT '{}';
+
+CREATE OR REPLACE FUNCTION sync_listing_feature_ids() RETURNS trigger AS $$
+DECLARE
+    v_ids INT[];
+BEGIN
+    -- Only the transition tables of this trigger's event exist
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT listing_id) INTO v_ids FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(DISTINCT listing_id) INTO v_ids FROM old_rows;
+    ELSE
+        SELECT array_agg(DISTINCT listing_id) INTO v_ids FROM (
+            SELECT listing_id FROM old_rows
+            UNION ALL
+            SELECT listing_id FROM new_rows
+        ) changed;
+    END IF;
+
+    -- Statement level: one UPDATE for all listings the statement changed.
+    -- Setting feature_ids also moves updated_at (trigger from 0006).
+    UPDATE listings l SET feature_ids = ARRAY(
+        SELECT lf.feature_id FROM listing_features lf
+        WHERE lf.listing_id = l.id
+        ORDER BY lf.feature_id
+    )
+    WHERE l.id = ANY(v_ids);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- These replace the listing_features touch triggers from 0006, the UPDATE
+-- above already moves updated_at
+DROP TRIGGER IF EXISTS listing_features_insert_touch_trigger ON listing_features;
+DROP TRIGGER IF EXISTS listing_features_delete_touch_trigger ON listing_features;
+
+DROP TRIGGER IF EXISTS listing_features_insert_sync_trigger ON listing_features;
+CREATE TRIGGER listing_features_insert_sync_trigger
+    AFTER INSERT ON listing_features
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_listing_feature_ids();
+
+DROP TRIGGER IF EXISTS listing_features_update_sync_trigger ON listing_features;
+CREATE TRIGGER listing_features_update_sync_trigger
+    AFTER UPDATE ON listing_features
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_listing_feature_ids();
+
+DROP TRIGGER IF EXISTS listing_features_delete_sync_trigger ON listing_features;
+CREATE TRIGGER listing_features_delete_sync_trigger
+    AFTER DELETE ON listing_features
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_listing_feature_ids();
+
+-- Fill the column for the listings that already have features
+UPDATE listings l SET feature_ids = f.ids
+FROM (
+    SELECT listing_id, array_agg(feature_id ORDER BY feature_id) AS ids
+    FROM listing_features
+    GROUP BY listing_id
+) f
+WHERE f.listing_id = l.id AND l.feature_ids IS DISTINCT FROM f.ids;
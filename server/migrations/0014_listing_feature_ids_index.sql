@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+-- For the features filter of GET /listings (feature_ids @> ARRAY[...])
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_feature_ids_idx
+    ON listings USING gin (feature_ids);
@@ -0,0 +1,84 @@
+-- Message threads. A conversation is one listing and two users (user_a_id
+-- is the lower id, so both directions share it). create_message keeps the
+-- summary columns and the per member unread counters up to date, so an
+-- inbox reads one row per conversation and never the messages themselves.
+
+CREATE TABLE IF NOT EXISTS conversations (
+    id SERIAL PRIMARY KEY,
+    listing_id INT NOT NULL REFERENCES listings(id),
+    user_a_id INT NOT NULL REFERENCES users(id),
+    user_b_id INT NOT NULL REFERENCES users(id),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_message_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_sender_id INT REFERENCES users(id),
+    last_message_preview TEXT,
+    message_count INT NOT NULL DEFAULT 0,
+    CHECK (user_a_id <= user_b_id),
+    UNIQUE (listing_id, user_a_id, user_b_id)
+);
+
+-- One row per user in a conversation: their inbox entry. last_message_at
+-- is copied from the conversation so the inbox is one index range scan.
+CREATE TABLE IF NOT EXISTS conversation_members (
+    conversation_id INT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    last_message_at TIMESTAMPTZ NOT NULL,
+    unread_count INT NOT NULL DEFAULT 0,
+    last_read_at TIMESTAMPTZ,
+    PRIMARY KEY (conversation_id, user_id)
+);
+
+-- The inbox, newest conversation first
+CREATE INDEX IF NOT EXISTS conversation_members_inbox_idx
+    ON conversation_members (user_id, last_message_at DESC, conversation_id DESC);
+-- The unread total only has to look at the unread conversations
+CREATE INDEX IF NOT EXISTS conversation_members_unread_idx
+    ON conversation_members (user_id) WHERE unread_count > 0;
+
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS conversation_id INT REFERENCES conversations(id);
+
+-- Existing messages: one conversation per listing and pair of users, with
+-- everything already read. Messages without a listing or user stay
+-- outside of conversations.
+-- The preview length 200 is MESSAGE_PREVIEW_LENGTH in server/db.py, which
+-- new messages use. Change both together.
+INSERT INTO conversations (
+    listing_id, user_a_id, user_b_id, created_at, last_message_at,
+    last_sender_id, last_message_preview, message_count
+)
+SELECT
+    listing_id, user_a_id, user_b_id, first_at, created_at,
+    sender_id, left(content, 200), total
+FROM (
+    SELECT
+        m.*,
+        LEAST(m.sender_id, m.receiver_id) AS user_a_id,
+        GREATEST(m.sender_id, m.receiver_id) AS user_b_id,
+        row_number() OVER thread AS number,
+        COUNT(*) OVER (PARTITION BY m.listing_id, LEAST(m.sender_id, m.receiver_id), GREATEST(m.sender_id, m.receiver_id)) AS total,
+        MIN(m.created_at) OVER (PARTITION BY m.listing_id, LEAST(m.sender_id, m.receiver_id), GREATEST(m.sender_id, m.receiver_id)) AS first_at
+    FROM messages m
+    WHERE m.conversation_id IS NULL
+      AND m.listing_id IS NOT NULL
+      AND m.sender_id IS NOT NULL
+      AND m.receiver_id IS NOT NULL
+    WINDOW thread AS (
+        PARTITION BY m.listing_id, LEAST(m.sender_id, m.receiver_id), GREATEST(m.sender_id, m.receiver_id)
+        ORDER BY m.created_at DESC, m.id DESC
+    )
+) latest
+WHERE number = 1
+ON CONFLICT (listing_id, user_a_id, user_b_id) DO NOTHING;
+
+UPDATE messages m SET conversation_id = c.id
+FROM conversations c
+WHERE m.conversation_id IS NULL
+  AND c.listing_id = m.listing_id
+  AND c.user_a_id = LEAST(m.sender_id, m.receiver_id)
+  AND c.user_b_id = GREATEST(m.sender_id, m.receiver_id);
+
+INSERT INTO conversation_members (conversation_id, user_id, last_message_at)
+SELECT id, user_a_id, last_message_at FROM conversations
+UNION
+SELECT id, user_b_id, last_message_at FROM conversations
+ON CONFLICT (conversation_id, user_id) DO NOTHING;
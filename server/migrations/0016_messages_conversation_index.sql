@@ -0,0 +1,5 @@
+-- migrate: no-transaction
+-- The messages of one conversation, newest first (GET /messages/conversation/{id})
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_conversation_created_at_idx
+    ON messages (conversation_id, created_at DESC, id DESC);
@@ -0,0 +1,39 @@
+-- Push new messages to the API workers, which stream them to the users
+-- (GET /messages/user/{user_id}/stream).
+-- Every inserted message sends a NOTIFY on the messages channel with the
+-- message as JSON. A NOTIFY payload must stay under 8000 bytes, so a long
+-- content is left out ("content_omitted": true) and the client loads the
+-- message from the conversation instead.
+-- Notifications are only delivered when the transaction commits.
+
+CREATE OR REPLACE FUNCTION notify_new_messages() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        'messages',
+        CASE
+            WHEN octet_length(m.message::text) < 7900 THEN m.message::text
+            ELSE (m.message - 'content' || '{"content_omitted": true}')::text
+        END
+    )
+    FROM (
+        SELECT jsonb_build_object(
+            'id', id,
+            'conversation_id', conversation_id,
+            'sender_id', sender_id,
+            'receiver_id', receiver_id,
+            'listing_id', listing_id,
+            'content', content,
+            'created_at', created_at
+        ) AS message
+        FROM new_messages
+        ORDER BY id
+    ) AS m;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS messages_notify_trigger ON messages;
+CREATE TRIGGER messages_notify_trigger
+    AFTER INSERT ON messages
+    REFERENCING NEW TABLE AS new_messages
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_new_messages();
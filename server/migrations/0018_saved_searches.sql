@@ -0,0 +1,125 @@
+-- Saved searches and their alerts.
+-- A saved search is a set of filters a user wants to hear about: a city, a
+-- property type, a price range and a room range, each optional. When a
+-- listing is added, or its price drops (or moves into the range), every
+-- saved search it matches gets an alert.
+--
+-- Only the new or changed listings are matched, never the whole table. The
+-- match starts from the listing: saved_searches_match_idx is an inverted
+-- index from (city, property type, lowest price) to the searches that ask
+-- for them, with '' and 0 standing for "any". A listing in Malmö of type 2
+-- looks up the four keys (malmö, 2), (malmö, any), (any, 2) and (any, any),
+-- each as a range of price_min_key up to the listing's price, so the work
+-- grows with the number of matching searches, not with all of them.
+
+CREATE TABLE IF NOT EXISTS saved_searches (
+    id SERIAL PRIMARY KEY,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    name VARCHAR(255) NOT NULL,
+    city VARCHAR(255),
+    property_type_id INT REFERENCES property_types(id) ON DELETE CASCADE,
+    price_min NUMERIC,
+    price_max NUMERIC,
+    rooms_min INT,
+    rooms_max INT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    -- The keys of the inverted index, "any" is '' and 0
+    city_key TEXT GENERATED ALWAYS AS (COALESCE(LOWER(city), '')) STORED,
+    property_type_key INT GENERATED ALWAYS AS (COALESCE(property_type_id, 0)) STORED,
+    price_min_key NUMERIC GENERATED ALWAYS AS (COALESCE(price_min, 0)) STORED,
+    CONSTRAINT saved_searches_price_check CHECK (price_min <= price_max),
+    CONSTRAINT saved_searches_rooms_check CHECK (rooms_min <= rooms_max)
+);
+
+CREATE INDEX IF NOT EXISTS saved_searches_match_idx
+    ON saved_searches (city_key, property_type_key, price_min_key);
+CREATE INDEX IF NOT EXISTS saved_searches_user_idx ON saved_searches (user_id);
+
+CREATE TABLE IF NOT EXISTS saved_search_alerts (
+    id BIGSERIAL PRIMARY KEY,
+    saved_search_id INT NOT NULL REFERENCES saved_searches(id) ON DELETE CASCADE,
+    -- Copied from the saved search, so a user's alerts are one index range
+    user_id INT NOT NULL,
+    listing_id INT NOT NULL REFERENCES listings(id) ON DELETE CASCADE,
+    reason TEXT NOT NULL CHECK (reason IN ('new', 'price')),
+    price NUMERIC NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS saved_search_alerts_user_idx
+    ON saved_search_alerts (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS saved_search_alerts_search_idx
+    ON saved_search_alerts (saved_search_id);
+CREATE INDEX IF NOT EXISTS saved_search_alerts_listing_idx
+    ON saved_search_alerts (listing_id);
+
+-- One trigger per statement, so a feed import or batch insert is matched
+-- with one join instead of once per listing. A trigger with transition
+-- tables can't be limited to UPDATE OF price, so updates compare the
+-- prices themselves and only changed prices are matched.
+-- The lookup keys of each listing are computed first (MATERIALIZED), so
+-- the planner can use all three of them as index conditions. Taken from
+-- listings and addresses directly it only uses the city.
+CREATE OR REPLACE FUNCTION match_saved_searches() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        WITH changed AS MATERIALIZED (
+            SELECT
+                n.id, n.price, n.room_count, n.property_type_id,
+                LOWER(a.city) AS city_key
+            FROM new_listings n
+            LEFT JOIN addresses a ON a.id = n.address_id
+        )
+        INSERT INTO saved_search_alerts (saved_search_id, user_id, listing_id, reason, price)
+        SELECT s.id, s.user_id, c.id, 'new', c.price
+        FROM changed c
+        JOIN saved_searches s
+            ON s.city_key = ANY(ARRAY[c.city_key, ''])
+            AND s.property_type_key = ANY(ARRAY[c.property_type_id, 0])
+            AND s.price_min_key <= c.price
+        WHERE (s.price_max IS NULL OR s.price_max >= c.price)
+            AND (s.rooms_min IS NULL OR c.room_count >= s.rooms_min)
+            AND (s.rooms_max IS NULL OR c.room_count <= s.rooms_max);
+    ELSE
+        WITH changed AS MATERIALIZED (
+            SELECT
+                n.id, n.price, n.room_count, n.property_type_id,
+                LOWER(a.city) AS city_key,
+                o.price AS old_price
+            FROM new_listings n
+            JOIN old_listings o ON o.id = n.id AND o.price IS DISTINCT FROM n.price
+            LEFT JOIN addresses a ON a.id = n.address_id
+        )
+        INSERT INTO saved_search_alerts (saved_search_id, user_id, listing_id, reason, price)
+        SELECT s.id, s.user_id, c.id, 'price', c.price
+        FROM changed c
+        JOIN saved_searches s
+            ON s.city_key = ANY(ARRAY[c.city_key, ''])
+            AND s.property_type_key = ANY(ARRAY[c.property_type_id, 0])
+            AND s.price_min_key <= c.price
+        WHERE (s.price_max IS NULL OR s.price_max >= c.price)
+            AND (s.rooms_min IS NULL OR c.room_count >= s.rooms_min)
+            AND (s.rooms_max IS NULL OR c.room_count <= s.rooms_max)
+            -- A price drop, or a price that just moved into the range. A
+            -- listing that already matched and got more expensive is no news.
+            AND (
+                c.price < c.old_price
+                OR c.old_price < s.price_min_key
+                OR c.old_price > s.price_max
+            );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS listings_saved_search_insert_trigger ON listings;
+CREATE TRIGGER listings_saved_search_insert_trigger
+    AFTER INSERT ON listings
+    REFERENCING NEW TABLE AS new_listings
+    FOR EACH STATEMENT EXECUTE FUNCTION match_saved_searches();
+
+DROP TRIGGER IF EXISTS listings_saved_search_update_trigger ON listings;
+CREATE TRIGGER listings_saved_search_update_trigger
+    AFTER UPDATE ON listings
+    REFERENCING OLD TABLE AS old_listings NEW TABLE AS new_listings
+    FOR EACH STATEMENT EXECUTE FUNCTION match_saved_searches();
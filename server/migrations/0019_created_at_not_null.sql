@@ -0,0 +1,51 @@
+-- migrate: no-transaction
+-- created_at is the key of the "newest" sort of GET /listings and of the
+-- message lists. Keyset pagination compares (created_at, id) with the last
+-- row of the previous page, which is NULL (so false) for a row without
+-- created_at: those rows were never returned. The column always had
+-- DEFAULT NOW(), so only rows inserted with an explicit NULL are missing
+-- one; they get their last update time, or now.
+--
+-- Without a transaction, so the tables stay writable: the missing values
+-- are filled one range of ids at a time, and a NOT VALID check constraint
+-- is validated without blocking writes. SET NOT NULL then trusts the
+-- check instead of scanning the table under an exclusive lock, and the
+-- check is dropped again.
+
+DO $$
+DECLARE
+    v_batch CONSTANT INT := 10000;
+    v_last INT := 0;
+    v_max INT;
+BEGIN
+    SELECT max(id) INTO v_max FROM listings;
+    WHILE v_last < v_max LOOP
+        UPDATE listings SET created_at = COALESCE(updated_at, NOW())
+        WHERE id > v_last AND id <= v_last + v_batch AND created_at IS NULL;
+        v_last := v_last + v_batch;
+        COMMIT;
+    END LOOP;
+
+    v_last := 0;
+    SELECT max(id) INTO v_max FROM messages;
+    WHILE v_last < v_max LOOP
+        UPDATE messages SET created_at = NOW()
+        WHERE id > v_last AND id <= v_last + v_batch AND created_at IS NULL;
+        v_last := v_last + v_batch;
+        COMMIT;
+    END LOOP;
+END $$;
+
+ALTER TABLE listings DROP CONSTRAINT IF EXISTS listings_created_at_not_null;
+ALTER TABLE listings ADD CONSTRAINT listings_created_at_not_null
+    CHECK (created_at IS NOT NULL) NOT VALID;
+ALTER TABLE listings VALIDATE CONSTRAINT listings_created_at_not_null;
+ALTER TABLE listings ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE listings DROP CONSTRAINT listings_created_at_not_null;
+
+ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_created_at_not_null;
+ALTER TABLE messages ADD CONSTRAINT messages_created_at_not_null
+    CHECK (created_at IS NOT NULL) NOT VALID;
+ALTER TABLE messages VALIDATE CONSTRAINT messages_created_at_not_null;
+ALTER TABLE messages ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE messages DROP CONSTRAINT messages_created_at_not_null;
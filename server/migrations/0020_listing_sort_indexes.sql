@@ -0,0 +1,22 @@
+-- migrate: no-transaction
+-- Price and living area can be NULL, so GET /listings sorts on them with
+-- NULL replaced by +/-Infinity (nulls_last() in server/pagination.py),
+-- which puts those listings last. The sort indexes need the very same
+-- expressions, otherwise the planner can't read pages from them.
+-- listings_price_idx and listings_type_price_idx stay for the price filters.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_price_asc_sort_idx
+    ON listings (COALESCE(price, 'Infinity'::numeric), id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_price_desc_sort_idx
+    ON listings (COALESCE(price, '-Infinity'::numeric) DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_living_area_sort_idx
+    ON listings (COALESCE(living_area, '-Infinity'::numeric) DESC, id DESC);
+
+-- Property type filter combined with the price sorts
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_type_price_asc_sort_idx
+    ON listings (property_type_id, COALESCE(price, 'Infinity'::numeric), id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS listings_type_price_desc_sort_idx
+    ON listings (property_type_id, COALESCE(price, '-Infinity'::numeric) DESC, id DESC);
+
+-- Only served the old area_desc sort
+DROP INDEX CONCURRENTLY IF EXISTS listings_living_area_idx;
@@ -0,0 +1,63 @@
+-- Listings without a price (price is nullable) never matched a saved
+-- search in 0018: price_min_key <= NULL is NULL. They now match the
+-- searches without a price filter. The lookup uses COALESCE(price, 0), so
+-- it stays an index range (price_min_key <= 0 is "no minimum"), and the
+-- price_max test lets only the searches without a maximum through.
+-- A listing that gets its first price is news as well, like a price drop.
+-- The alert of a listing without a price has no price.
+
+ALTER TABLE saved_search_alerts ALTER COLUMN price DROP NOT NULL;
+
+CREATE OR REPLACE FUNCTION match_saved_searches() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        WITH changed AS MATERIALIZED (
+            SELECT
+                n.id, n.price, n.room_count, n.property_type_id,
+                LOWER(a.city) AS city_key
+            FROM new_listings n
+            LEFT JOIN addresses a ON a.id = n.address_id
+        )
+        INSERT INTO saved_search_alerts (saved_search_id, user_id, listing_id, reason, price)
+        SELECT s.id, s.user_id, c.id, 'new', c.price
+        FROM changed c
+        JOIN saved_searches s
+            ON s.city_key = ANY(ARRAY[c.city_key, ''])
+            AND s.property_type_key = ANY(ARRAY[c.property_type_id, 0])
+            AND s.price_min_key <= COALESCE(c.price, 0)
+        WHERE (s.price_max IS NULL OR s.price_max >= c.price)
+            AND (s.rooms_min IS NULL OR c.room_count >= s.rooms_min)
+            AND (s.rooms_max IS NULL OR c.room_count <= s.rooms_max);
+    ELSE
+        WITH changed AS MATERIALIZED (
+            SELECT
+                n.id, n.price, n.room_count, n.property_type_id,
+                LOWER(a.city) AS city_key,
+                o.price AS old_price
+            FROM new_listings n
+            JOIN old_listings o ON o.id = n.id AND o.price IS DISTINCT FROM n.price
+            LEFT JOIN addresses a ON a.id = n.address_id
+        )
+        INSERT INTO saved_search_alerts (saved_search_id, user_id, listing_id, reason, price)
+        SELECT s.id, s.user_id, c.id, 'price', c.price
+        FROM changed c
+        JOIN saved_searches s
+            ON s.city_key = ANY(ARRAY[c.city_key, ''])
+            AND s.property_type_key = ANY(ARRAY[c.property_type_id, 0])
+            AND s.price_min_key <= COALESCE(c.price, 0)
+        WHERE (s.price_max IS NULL OR s.price_max >= c.price)
+            AND (s.rooms_min IS NULL OR c.room_count >= s.rooms_min)
+            AND (s.rooms_max IS NULL OR c.room_count <= s.rooms_max)
+            -- A first price, a price drop, or a price that just moved into
+            -- the range. A listing that already matched and got more
+            -- expensive is no news.
+            AND (
+                c.old_price IS NULL
+                OR c.price < c.old_price
+                OR c.old_price < s.price_min_key
+                OR c.old_price > s.price_max
+            );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
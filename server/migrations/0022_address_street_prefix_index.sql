@@ -0,0 +1,13 @@
+-- migrate: no-transaction
+-- The listing search matches streets by the start of their name ("kungsg"
+-- finds Kungsgatan), case insensitive, instead of anywhere in the name.
+-- A prefix is a range in this btree, so a page of street matches is read
+-- in order instead of collecting and sorting every address containing the
+-- text. text_pattern_ops makes LIKE 'abc%' use the index whatever the
+-- database collation is.
+-- The trigram index from 0004 is no longer used by any query.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS addresses_street_prefix_idx
+    ON addresses (lower(street) text_pattern_ops);
+
+DROP INDEX CONCURRENTLY IF EXISTS addresses_street_trgm_idx;
@@ -0,0 +1,36 @@
+-- Bulk writes can turn off the listing triggers that are only there for
+-- changes made through the API, for the rest of their transaction:
+--
+--     SET LOCAL app.bulk_load = 'on';
+--
+-- It is meant for backfills of columns the API does not show, like the
+-- search vectors in 0024. Those must not move updated_at (and with it the
+-- ETags), drop the listing caches of every worker or match the saved
+-- searches again. The search vector trigger from 0003 keeps running.
+
+CREATE OR REPLACE FUNCTION bulk_loading() RETURNS boolean AS $$
+    SELECT COALESCE(current_setting('app.bulk_load', true), '') = 'on';
+$$ LANGUAGE sql STABLE;
+
+DROP TRIGGER IF EXISTS listings_updated_at_trigger ON listings;
+CREATE TRIGGER listings_updated_at_trigger
+    BEFORE UPDATE ON listings
+    FOR EACH ROW
+    WHEN (NOT bulk_loading())
+    EXECUTE FUNCTION set_updated_at();
+
+DROP TRIGGER IF EXISTS listings_cache_update_trigger ON listings;
+CREATE TRIGGER listings_cache_update_trigger
+    AFTER UPDATE ON listings
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT
+    WHEN (NOT bulk_loading())
+    EXECUTE FUNCTION notify_cache_invalidation('listings');
+
+DROP TRIGGER IF EXISTS listings_saved_search_update_trigger ON listings;
+CREATE TRIGGER listings_saved_search_update_trigger
+    AFTER UPDATE ON listings
+    REFERENCING OLD TABLE AS old_listings NEW TABLE AS new_listings
+    FOR EACH STATEMENT
+    WHEN (NOT bulk_loading())
+    EXECUTE FUNCTION match_saved_searches();
@@ -0,0 +1,24 @@
+-- migrate: no-transaction
+-- Fill listings.search_vector for the listings that existed before 0003.
+-- 0003 used to do it with one UPDATE of the whole table inside the
+-- migration's transaction, which kept every listing locked until it was
+-- done. Here every range of ids is its own short transaction. Setting the
+-- title to itself fires the search vector trigger, app.bulk_load (0023)
+-- keeps the other listing triggers out of it. Running it again only fills
+-- the vectors that are still missing.
+
+DO $$
+DECLARE
+    v_batch CONSTANT INT := 10000;
+    v_last INT := 0;
+    v_max INT;
+BEGIN
+    SELECT max(id) INTO v_max FROM listings;
+    WHILE v_last < v_max LOOP
+        PERFORM set_config('app.bulk_load', 'on', true);
+        UPDATE listings SET title = title
+        WHERE id > v_last AND id <= v_last + v_batch AND search_vector IS NULL;
+        v_last := v_last + v_batch;
+        COMMIT;
+    END LOOP;
+END $$;
@@ -0,0 +1,33 @@
+-- app.bulk_load (0023) also turns off the insert triggers that the seeders
+-- don't need. Without it, every COPY into listing_features or
+-- listing_images ran an UPDATE of the listings it had just inserted, which
+-- fired the search vector, updated_at, cache and saved-search triggers of
+-- those listings once more. A bulk load with app.bulk_load on must:
+--
+--   * write listings.feature_ids itself, together with the listing,
+--   * only insert new listings: their updated_at is already now, and new
+--     listings from a seed are no news to the saved searches.
+
+DROP TRIGGER IF EXISTS listing_features_insert_sync_trigger ON listing_features;
+CREATE TRIGGER listing_features_insert_sync_trigger
+    AFTER INSERT ON listing_features
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    WHEN (NOT bulk_loading())
+    EXECUTE FUNCTION sync_listing_feature_ids();
+
+DROP TRIGGER IF EXISTS listing_images_insert_touch_trigger ON listing_images;
+CREATE TRIGGER listing_images_insert_touch_trigger
+    AFTER INSERT ON listing_images
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT
+    WHEN (NOT bulk_loading())
+    EXECUTE FUNCTION touch_listings();
+
+DROP TRIGGER IF EXISTS listings_saved_search_insert_trigger ON listings;
+CREATE TRIGGER listings_saved_search_insert_trigger
+    AFTER INSERT ON listings
+    REFERENCING NEW TABLE AS new_listings
+    FOR EACH STATEMENT
+    WHEN (NOT bulk_loading())
+    EXECUTE FUNCTION match_saved_searches();
@@ -0,0 +1,143 @@
+"""
+Postgres LISTEN/NOTIFY for the API workers.
+
+Each worker process runs one Listener: a background thread with its own
+database connection that LISTENs on the channels somebody subscribed to and
+calls their callbacks for every notification. One idle connection per
+worker is enough however many channels and subscribers there are.
+
+    listener.subscribe("cache_invalidation", callback)
+    listener.start()
+
+Callbacks run on the listener thread and get the payload string. They
+should be quick and must not block. If the connection is lost, the
+listener reconnects and calls every callback with None, because
+notifications sent in the meantime are gone.
+"""
+
+import os
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions, sql
+
+from server.db_setup import DB_CONFIG
+
+# Seconds to wait before reconnecting after the connection was lost
+RECONNECT_DELAY = float(os.getenv("NOTIFY_RECONNECT_DELAY", "1"))
+
+
+class Listener:
+    def __init__(self):
+        self._callbacks = {}  # channel -> [callback]
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._con = None
+        # Channels the current connection is listening on
+        self._listening = set()
+        # Set while the connection is up and listening
+        self._ready = threading.Event()
+        # Notified whenever _listening changes
+        self._listening_changed = threading.Condition()
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            self._callbacks.setdefault(channel, []).append(callback)
+
+    def unsubscribe(self, channel, callback):
+        with self._lock:
+            callbacks = self._callbacks.get(channel, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="pg-listener", daemon=True
+        )
+        self._thread.start()
+
+    def wait_ready(self, timeout=None):
+        """Wait until the listener is connected. Returns False on timeout."""
+        return self._ready.wait(timeout)
+
+    def wait_listening(self, channel, timeout=None):
+        """
+        Wait until the connection LISTENs on channel. Returns False on
+        timeout. Unlike wait_ready() this also works for a channel that was
+        subscribed after the listener was already up.
+        """
+        with self._listening_changed:
+            return self._listening_changed.wait_for(
+                lambda: channel in self._listening, timeout
+            )
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _connect(self):
+        con = psycopg2.connect(**DB_CONFIG)
+        con.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        self._con = con
+        with self._listening_changed:
+            self._listening = set()
+
+    def _listen_to_new_channels(self):
+        with self._lock:
+            channels = set(self._callbacks) - self._listening
+        with self._con.cursor() as cur:
+            for channel in channels:
+                cur.execute(sql.SQL("LISTEN {};").format(sql.Identifier(channel)))
+                with self._listening_changed:
+                    self._listening.add(channel)
+                    self._listening_changed.notify_all()
+
+    def _dispatch(self, channel, payload):
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, []))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception as e:
+                print(f"Listener callback for {channel} failed: {e}")
+
+    def _run(self):
+        reconnected = False
+        while not self._stop.is_set():
+            try:
+                self._connect()
+                if reconnected:
+                    # Anything sent while we were away is lost
+                    for channel in list(self._callbacks):
+                        self._dispatch(channel, None)
+                while not self._stop.is_set():
+                    # Subscriptions can be added while we run
+                    self._listen_to_new_channels()
+                    self._ready.set()
+                    # Wake up regularly to notice stop() and new channels
+                    if select.select([self._con], [], [], 0.5) == ([], [], []):
+                        continue
+                    self._con.poll()
+                    while self._con.notifies:
+                        notify = self._con.notifies.pop(0)
+                        self._dispatch(notify.channel, notify.payload)
+            except psycopg2.Error as e:
+                print(f"Listener connection lost, reconnecting: {e}")
+                reconnected = True
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                self._ready.clear()
+                if self._con is not None:
+                    self._con.close()
+                    self._con = None
+
+
+listener = Listener()
@@ -0,0 +1,137 @@
+import base64
+import json
+import os
+from typing import NamedTuple, Optional
+
+# Page sizes can be tuned per deployment in .env
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "20"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "100"))
+
+
+class Sort(NamedTuple):
+    """
+    How a list is ordered. The id column is always used as a tie breaker,
+    so two rows never compare equal and no row is skipped between pages.
+    """
+
+    column: str  # SQL expression to order by, e.g. "l.created_at"
+    field: str  # Name of that value in the result row, e.g. "created_at"
+    direction: str = "ASC"
+    sql_type: str = "int"  # Type used to cast the cursor value back in SQL
+    id_column: str = "id"
+    # What column becomes for rows where the value is NULL, see nulls_last()
+    null_value: Optional[str] = None
+
+
+BY_ID = Sort("id", "id")
+
+
+def nulls_last(column, field, direction="ASC", sql_type="numeric", id_column="id"):
+    """
+    Sort on a nullable column, with the NULL rows last in either direction.
+
+    A NULL makes the (column, id) > (value, id) comparison NULL, so those
+    rows would be skipped between pages. Instead we sort on the column with
+    NULL replaced by +/-Infinity. The index that serves the sort has to use
+    the same expression (see migration 0020).
+    """
+    null_value = "Infinity" if direction == "ASC" else "-Infinity"
+    return Sort(
+        f"COALESCE({column}, '{null_value}'::{sql_type})",
+        field,
+        direction,
+        sql_type,
+        id_column,
+        null_value,
+    )
+
+
+def encode_cursor(sort, sort_value, row_id):
+    # The cursor is the sort value and id of the last row on the page, and
+    # which sort it belongs to, so it can't be reused with another sort
+    if hasattr(sort_value, "isoformat"):
+        sort_value = sort_value.isoformat()
+    elif sort_value is not None and not isinstance(sort_value, int):
+        sort_value = str(sort_value)
+    raw = json.dumps([sort.field, sort.direction, sort_value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor, sort):
+    """
+    Return the (sort value, id) stored in the cursor. Raises ValueError for a
+    cursor that is malformed or was made for a different sort.
+    """
+    try:
+        field, direction, sort_value, row_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode())
+        )
+        row_id = int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if field != sort.field or direction != sort.direction:
+        raise ValueError("Invalid cursor")
+    # The sort columns are never NULL (see nulls_last), and a NULL would
+    # match no row at all
+    if sort_value is None and sort.column != sort.id_column:
+        raise ValueError("Invalid cursor")
+    return sort_value, row_id
+
+
+def page_query(select_sql, where, params, sort, limit, cursor=None):
+    """
+    Add the WHERE conditions, ORDER BY and LIMIT for one page to select_sql.
+    Returns the SQL and its parameters.
+
+    Instead of OFFSET we continue from the (sort value, id) of the last row
+    we sent, so page 100 costs the same as page 1.
+    """
+    where = list(where)
+    params = list(params)
+
+    if cursor:
+        last_value, last_id = decode_cursor(cursor, sort)
+        operator = "<" if sort.direction == "DESC" else ">"
+        if sort.column == sort.id_column:
+            where.append(f"{sort.id_column} {operator} %s")
+            params.append(last_id)
+        else:
+            where.append(
+                f"({sort.column}, {sort.id_column}) {operator} (%s::{sort.sql_type}, %s)"
+            )
+            params += [last_value, last_id]
+
+    sql, params = sorted_query(select_sql, where, params, sort)
+    # We ask for one extra row to know if there is a next page
+    return f"{sql} LIMIT %s", params + [limit + 1]
+
+
+def sorted_query(select_sql, where, params, sort):
+    """Add the WHERE conditions and ORDER BY (but no LIMIT) to select_sql."""
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+    order_sql = f"ORDER BY {sort.column} {sort.direction}"
+    if sort.column != sort.id_column:
+        order_sql += f", {sort.id_column} {sort.direction}"
+    return f"{select_sql} {where_sql} {order_sql}", list(params)
+
+
+def page_result(rows, sort, limit):
+    """Cut the extra row off and build the cursor for the next page."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        sort_value = last[sort.field]
+        if sort_value is None:
+            sort_value = sort.null_value
+        next_cursor = encode_cursor(sort, sort_value, last["id"])
+    return rows, next_cursor
+
+
+def fetch_page(cur, select_sql, where, params, sort, limit, cursor=None):
+    """
+    Run select_sql with the given WHERE conditions and return one page of
+    rows plus the cursor for the next page (None on the last page).
+    """
+    cur.execute(*page_query(select_sql, where, params, sort, limit, cursor))
+    return page_result(cur.fetchall(), sort, limit)
@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool
+
+from server.db_setup import DB_CONFIG
+
+# Pool settings, can be changed in .env
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN", "2"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX", "20"))
+ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# Connections idle for longer than this are pinged before they are handed out
+HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))
+
+
+class PoolTimeout(Exception):
+    """No connection became free within the acquire timeout."""
+
+
+class ConnectionPool:
+    """
+    A thread safe pool of psycopg2 connections.
+
+    Connections are reused between requests instead of opening a new
+    TCP connection (and doing the login) for every request.
+    """
+
+    def __init__(
+        self,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        acquire_timeout=ACQUIRE_TIMEOUT,
+        health_check_after=HEALTH_CHECK_AFTER,
+    ):
+        self._pool = pool.ThreadedConnectionPool(min_size, max_size, **DB_CONFIG)
+        # psycopg2 raises at once when the pool is empty, so we wait for a
+        # free slot here first
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+        self._stats = {
+            "acquired": 0,
+            "timeouts": 0,
+            "broken_connections": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+        }
+
+    def getconn(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(
+                f"No database connection available after {self.acquire_timeout}s"
+            )
+
+        try:
+            con = self._pool.getconn()
+            if not self._is_healthy(con):
+                with self._lock:
+                    self._stats["broken_connections"] += 1
+                self._last_used.pop(id(con), None)
+                self._pool.putconn(con, close=True)
+                con = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        wait_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._in_use += 1
+            self._stats["acquired"] += 1
+            self._stats["total_wait_ms"] += wait_ms
+            self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+        return con
+
+    def putconn(self, con):
+        try:
+            close = bool(con.closed)
+            if not close:
+                # Never hand out a connection with an open or failed transaction
+                status = con.get_transaction_status()
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    con.rollback()
+            if close:
+                self._last_used.pop(id(con), None)
+            else:
+                self._last_used[id(con)] = time.monotonic()
+            self._pool.putconn(con, close=close)
+        except psycopg2.Error:
+            self._last_used.pop(id(con), None)
+            self._pool.putconn(con, close=True)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def _is_healthy(self, con):
+        if con.closed:
+            return False
+        last_used = self._last_used.get(id(con))
+        if (
+            last_used is not None
+            and time.monotonic() - last_used < self.health_check_after
+        ):
+            return True
+        # The connection has been idle for a while, the server may have dropped it
+        try:
+            with con.cursor() as cur:
+                cur.execute("SELECT 1;")
+            con.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            in_use = self._in_use
+        acquired = stats["acquired"]
+        stats["avg_wait_ms"] = stats["total_wait_ms"] / acquired if acquired else 0.0
+        stats["in_use"] = in_use
+        # Connections that can be borrowed without waiting
+        stats["available"] = self.max_size - in_use
+        stats["max_size"] = self.max_size
+        return stats
+
+    def close(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+@contextmanager
+def connection():
+    """
+    Borrow a pooled connection for the with block. The connection always
+    goes back to the pool, also when the block raises an exception.
+    """
+    db_pool = get_pool()
+    con = db_pool.getconn()
+    try:
+        yield con
+    finally:
+        db_pool.putconn(con)
+
+
+def get_db():
+    """FastAPI dependency that lends a pooled connection to one request."""
+    with connection() as con:
+        yield con
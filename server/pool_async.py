@@ -0,0 +1,25 @@
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+from server.db_setup import DB_CONFIG
+from server.pool import ACQUIRE_TIMEOUT, POOL_MAX_SIZE, POOL_MIN_SIZE
+
+# Same settings as the sync pool in server/pool.py. The pool is opened in
+# the lifespan of server/app_async.py, inside the running event loop.
+async_pool = AsyncConnectionPool(
+    make_conninfo(**DB_CONFIG),
+    min_size=POOL_MIN_SIZE,
+    max_size=POOL_MAX_SIZE,
+    timeout=ACQUIRE_TIMEOUT,
+    check=AsyncConnectionPool.check_connection,
+    open=False,
+)
+
+
+async def get_async_db():
+    """
+    FastAPI dependency that lends a pooled async connection to one request.
+    The pool rolls back any open transaction when the connection comes back.
+    """
+    async with async_pool.connection() as con:
+        yield con
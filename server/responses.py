@@ -0,0 +1,183 @@
+"""
+Faster JSON responses and response compression.
+
+FastJSONResponse serializes with orjson, which handles datetime, date and
+(through _default) Decimal itself. Endpoints that return many rows hand
+their result straight to FastJSONResponse, which skips FastAPI's
+jsonable_encoder pass over every value.
+
+CompressionMiddleware compresses responses above a size threshold with
+brotli when the client accepts it (and the brotli package is installed),
+otherwise with gzip. Bodies of 128 KiB and more are compressed in a
+worker thread, so they don't hold up the other requests on the event loop.
+
+See server/bench_responses.py for the numbers.
+"""
+
+import csv
+import io
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+import anyio
+import orjson
+from anyio.lowlevel import RunVar
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, IdentityResponder
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, we fall back to gzip
+    brotli = None
+
+# Responses smaller than this are sent as they are
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1000"))
+# Speed over size: level 6 gzip and quality 4 brotli compress a page of
+# listings almost as well as the maximum, at a fraction of the CPU
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+
+def _default(obj):
+    # NUMERIC columns come back as Decimal. Sent as numbers, like before.
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content):
+    return orjson.dumps(content, default=_default)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+
+def accepts_encoding(accept_encoding, encoding):
+    """True if the Accept-Encoding header allows encoding (q > 0)."""
+    for part in accept_encoding.split(","):
+        name, *params = part.split(";")
+        if name.strip().lower() != encoding:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        return q > 0
+    return False
+
+
+# Like starlette's gzip: big bodies are compressed in a worker thread, with
+# a limiter of their own so they don't take the threads of sync endpoints
+_brotli_capacity_limiter = RunVar("_brotli_capacity_limiter")
+
+
+def _get_brotli_capacity_limiter():
+    try:
+        return _brotli_capacity_limiter.get()
+    except LookupError:
+        limiter = anyio.CapacityLimiter(40)
+        _brotli_capacity_limiter.set(limiter)
+        return limiter
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(
+        self,
+        app,
+        minimum_size,
+        quality,
+        *,
+        thread_minimum_size,
+        exclude_content_types,
+    ):
+        super().__init__(app, minimum_size, exclude_content_types=exclude_content_types)
+        self.quality = quality
+        self.thread_minimum_size = thread_minimum_size
+        self._compressor = None
+
+    async def apply_compression(self, body, *, more_body):
+        if len(body) >= self.thread_minimum_size:
+            # Compressing it here would block the event loop
+            return await anyio.to_thread.run_sync(
+                self._compress_body,
+                body,
+                more_body,
+                limiter=_get_brotli_capacity_limiter(),
+            )
+        return self._compress_body(body, more_body)
+
+    def _compress_body(self, body, more_body):
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(quality=self.quality)
+        if more_body:
+            # Streaming response: send what we have compressed so far
+            return self._compressor.process(body) + self._compressor.flush()
+        return self._compressor.process(body) + self._compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    def __init__(
+        self,
+        app,
+        minimum_size=COMPRESS_MIN_SIZE,
+        compresslevel=GZIP_LEVEL,
+        brotli_quality=BROTLI_QUALITY,
+    ):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and brotli is not None:
+            accept_encoding = Headers(scope=scope).get("Accept-Encoding", "")
+            if accepts_encoding(accept_encoding, "br"):
+                responder = BrotliResponder(
+                    self.app,
+                    self.minimum_size,
+                    self.brotli_quality,
+                    thread_minimum_size=self.thread_minimum_size,
+                    exclude_content_types=self.exclude_content_types,
+                )
+                await responder(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
+
+
+# Streaming exports: each batch of rows is encoded to one chunk of bytes
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, list):
+        return "|".join(str(item) for item in value)
+    return value
+
+
+def encode_export(rows, format, first=False):
+    """
+    NDJSON: one JSON object per line.
+    CSV: the first batch starts with a header row. List values (like
+    features) are joined with |.
+    """
+    if format == "ndjson":
+        return b"".join(dumps(row) + b"\n" for row in rows)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if first:
+        writer.writerow(rows[0].keys())
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row.values()])
+    return buffer.getvalue().encode()
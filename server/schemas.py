@@ -2,9 +2,10 @@
 # Pydantic schemas are used to validate data that you receive, or to make sure that whatever data
 # you send back to the client follows a certain structure
 
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field, model_validator
+from typing import Literal, Optional
 from datetime import date
+from server.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 
 # This is the "Form" a user fills out to create a listing
@@ -27,6 +28,101 @@ class ListingCreate(BaseModel):
     status_id: int
 
 
+class ListingImageCreate(BaseModel):
+    url: str
+    caption: Optional[str] = None
+
+
+# One listing in POST /listings/batch, with its images and features.
+# Without an id it is created. With an id that listing is updated, and its
+# images and features are replaced when they are given (left as they are
+# when not).
+class ListingBatchItem(ListingCreate):
+    id: Optional[int] = None
+    images: Optional[list[ListingImageCreate]] = None
+    feature_ids: Optional[list[int]] = None
+
+
+# Most listings accepted in one batch request
+MAX_BATCH_SIZE = 1000
+
+
+class ListingBatch(BaseModel):
+    listings: list[ListingBatchItem] = Field(min_length=1, max_length=MAX_BATCH_SIZE)
+
+
+# One line of a realtor feed file, see server/import_feed.py
+class ListingFeedItem(ListingCreate):
+    external_id: str = Field(min_length=1, max_length=255)
+
+
+# Query parameters shared by every list endpoint:
+# how many rows to return and where the previous page ended
+class PageParams(BaseModel):
+    limit: int = Field(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+    cursor: Optional[str] = None
+
+
+# Largest radius for a radius search
+MAX_RADIUS_KM = 500
+
+
+# Listing search parameters (the same names the web MainPage sends)
+class ListingSearch(BaseModel):
+    # Free text search over title, address, property type and description.
+    # The start of a street name also matches ("kungsg" finds Kungsgatan).
+    q: Optional[str] = None
+    property_type: Optional[str] = None  # Property type name, case insensitive
+    rooms_min: Optional[int] = None
+    rooms_max: Optional[int] = None
+    price_min: Optional[float] = None
+    price_max: Optional[float] = None
+    # Comma separated feature names (case insensitive), the listing must have
+    # all of them, e.g. "Balcony,Garage"
+    features: Optional[str] = None
+    # Map viewport: listings inside the box, all four values are needed
+    lat_min: Optional[float] = Field(default=None, ge=-90, le=90)
+    lat_max: Optional[float] = Field(default=None, ge=-90, le=90)
+    lon_min: Optional[float] = Field(default=None, ge=-180, le=180)
+    lon_max: Optional[float] = Field(default=None, ge=-180, le=180)
+    # Listings within radius_km of a point (lat, lon)
+    lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    lon: Optional[float] = Field(default=None, ge=-180, le=180)
+    radius_km: Optional[float] = Field(default=None, gt=0, le=MAX_RADIUS_KM)
+    # "relevance" only applies together with q and "distance" only together
+    # with a radius search, otherwise "newest" is used
+    sort: Literal[
+        "newest", "price_asc", "price_desc", "area_desc", "relevance", "distance"
+    ] = "newest"
+    # "card" only returns what a listing card shows (id, title, price, area,
+    # rooms, address, city, type, cover image and features)
+    fields: Literal["full", "card"] = "full"
+
+
+# Query parameters for GET /listings: the search plus paging
+class ListingFilters(PageParams, ListingSearch):
+    # Also return the number of matching listings per property type, status,
+    # room and price bucket and feature, for the filter panel
+    facets: bool = False
+
+
+# Query parameters for GET /listings/export: the search, but no paging,
+# every matching listing is sent
+class ListingExport(ListingSearch):
+    format: Literal["ndjson", "csv"] = "ndjson"
+
+
+# Query parameters for GET /listings/clusters: the search (a viewport is
+# required) and the map zoom level, which decides how close listings must
+# be to end up in the same cluster
+class ListingClusters(ListingSearch):
+    zoom: int = Field(ge=0, le=22)
+
+
+# GET /stats/{dimension}
+StatsDimension = Literal["city", "property_type", "status"]
+
+
 class UserCreate(BaseModel):
     first_name: str
     surname: str
@@ -53,6 +149,15 @@ class AddressCreate(BaseModel):
     city: str
     postcode: str
     country: str
+    # Optional, but an address with coordinates needs both
+    latitude: Optional[float] = Field(default=None, ge=-90, le=90)
+    longitude: Optional[float] = Field(default=None, ge=-180, le=180)
+
+    @model_validator(mode="after")
+    def both_coordinates(self):
+        if (self.latitude is None) != (self.longitude is None):
+            raise ValueError("latitude and longitude must be given together")
+        return self
 
 
 class FeatureCreate(BaseModel):
@@ -72,3 +177,36 @@ class MessageCreate(BaseModel):
     receiver_id: int
     listing_id: int
     content: str
+
+
+class ConversationRead(BaseModel):
+    user_id: int
+
+
+# Filters a user wants alerts for when matching listings are added or get
+# cheaper. Every filter is optional, a missing one matches anything.
+class SavedSearchCreate(BaseModel):
+    user_id: int
+    name: str = Field(min_length=1, max_length=255)
+    city: Optional[str] = Field(default=None, max_length=255)
+    property_type: Optional[str] = None  # Property type name, case insensitive
+    price_min: Optional[float] = Field(default=None, ge=0)
+    price_max: Optional[float] = Field(default=None, ge=0)
+    rooms_min: Optional[int] = Field(default=None, ge=0)
+    rooms_max: Optional[int] = Field(default=None, ge=0)
+
+    @model_validator(mode="after")
+    def ranges_in_order(self):
+        if (
+            self.price_min is not None
+            and self.price_max is not None
+            and self.price_min > self.price_max
+        ):
+            raise ValueError("price_min must not be above price_max")
+        if (
+            self.rooms_min is not None
+            and self.rooms_max is not None
+            and self.rooms_min > self.rooms_max
+        ):
+            raise ValueError("rooms_min must not be above rooms_max")
+        return self
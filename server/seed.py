@@ -1,3 +1,7 @@
+import argparse
+import csv
+import io
+import math
 import os
 import random
 import psycopg2
@@ -20,15 +24,19 @@ def get_connection():
     )
 
 
+# City, postcode and the coordinates of the city center
 CITIES = [
-    ("Stockholm", "11122"),
-    ("Gothenburg", "41100"),
-    ("Malmö", "21100"),
-    ("Uppsala", "75310"),
-    ("Västerås", "72210"),
-    ("Linköping", "58220"),
+    ("Stockholm", "11122", 59.3293, 18.0686),
+    ("Gothenburg", "41100", 57.7089, 11.9746),
+    ("Malmö", "21100", 55.6050, 13.0038),
+    ("Uppsala", "75310", 59.8586, 17.6389),
+    ("Västerås", "72210", 59.6099, 16.5448),
+    ("Linköping", "58220", 58.4108, 15.6214),
 ]
 
+# Addresses are spread around the city center, about this many km
+CITY_SPREAD_KM = 4
+
 STREETS = [
     "Storgatan",
     "Kungsgatan",
@@ -91,17 +99,100 @@ def rand_email(first, last, i):
     return f"{first.lower()}.{last.lower()}{i}@moonhem.example"
 
 
+def rand_location(lat, lon):
+    # Normally distributed around the center, 1 degree latitude is ~111 km
+    return (
+        round(random.gauss(lat, CITY_SPREAD_KM / 111), 6),
+        round(random.gauss(lon, CITY_SPREAD_KM / 111 / math.cos(math.radians(lat))), 6),
+    )
+
+
 def insert_address(cur):
-    city, postcode = random.choice(CITIES)
+    city, postcode, lat, lon = random.choice(CITIES)
     street = random.choice(STREETS)
     street_full = f"{street} {random.randint(1, 99)}"
     cur.execute(
-        "INSERT INTO addresses (street, city, postcode, country) VALUES (%s,%s,%s,%s) RETURNING id",
-        (street_full, city, postcode, "Sweden"),
+        "INSERT INTO addresses (street, city, postcode, country, latitude, longitude) VALUES (%s,%s,%s,%s,%s,%s) RETURNING id",
+        (street_full, city, postcode, "Sweden", *rand_location(lat, lon)),
     )
     return cur.fetchone()[0]
 
 
+TABLES = [
+    "messages",
+    "favorite",
+    "listing_features",
+    "listing_images",
+    "realtor_agent",
+    "listings",
+    "features",
+    "status",
+    "property_types",
+    "users",
+    "realtor_companies",
+    "addresses",
+    "roles",
+    "user_images",
+]
+
+
+def clear_tables(cur):
+    for table in TABLES:
+        cur.execute(f"TRUNCATE TABLE {table} RESTART IDENTITY CASCADE;")
+
+
+def insert_reference_data(cur):
+    """Insert the small lookup tables and return their ids."""
+    # 2) ROLES
+    print("Inserting roles...")
+    roles = [
+        ("Admin", "Super user"),
+        ("Realtor", "Can sell houses"),
+        ("User", "Looking to buy"),
+    ]
+    role_ids = {}
+    for name, desc in roles:
+        cur.execute(
+            "INSERT INTO roles (name, description) VALUES (%s,%s) RETURNING id",
+            (name, desc),
+        )
+        role_ids[name] = cur.fetchone()[0]
+
+    # 3) STATUS
+    print("Inserting statuses...")
+    statuses = ["For Sale", "Sold", "Bidding in progress"]
+    status_ids = {}
+    for s in statuses:
+        cur.execute("INSERT INTO status (status) VALUES (%s) RETURNING id", (s,))
+        status_ids[s] = cur.fetchone()[0]
+
+    # 4) PROPERTY TYPES
+    print("Inserting property types...")
+    types = ["Villa", "Apartment", "Cottage", "Row House"]
+    type_ids = {}
+    for t in types:
+        cur.execute("INSERT INTO property_types (name) VALUES (%s) RETURNING id", (t,))
+        type_ids[t] = cur.fetchone()[0]
+
+    # 5) FEATURES
+    print("Inserting features...")
+    features = [
+        "Balcony",
+        "Fireplace",
+        "Pool",
+        "Garage",
+        "Elevator",
+        "Garden",
+        "Sauna",
+    ]
+    feature_ids = []
+    for f in features:
+        cur.execute("INSERT INTO features (name) VALUES (%s) RETURNING id", (f,))
+        feature_ids.append(cur.fetchone()[0])
+
+    return role_ids, status_ids, type_ids, feature_ids
+
+
 def seed_database(
     n_companies=6,
     n_realtors=10,
@@ -116,73 +207,10 @@ def seed_database(
     try:
         # 1) CLEANUP (order doesn't matter if CASCADE is used)
         print("Clearing old data...")
-        tables = [
-            "messages",
-            "favorite",
-            "listing_features",
-            "listing_images",
-            "realtor_agent",
-            "listings",
-            "features",
-            "status",
-            "property_types",
-            "users",
-            "realtor_companies",
-            "addresses",
-            "roles",
-            "user_images",
-        ]
-        for table in tables:
-            cur.execute(f"TRUNCATE TABLE {table} RESTART IDENTITY CASCADE;")
-
-        # 2) ROLES
-        print("Inserting roles...")
-        roles = [
-            ("Admin", "Super user"),
-            ("Realtor", "Can sell houses"),
-            ("User", "Looking to buy"),
-        ]
-        role_ids = {}
-        for name, desc in roles:
-            cur.execute(
-                "INSERT INTO roles (name, description) VALUES (%s,%s) RETURNING id",
-                (name, desc),
-            )
-            role_ids[name] = cur.fetchone()[0]
-
-        # 3) STATUS
-        print("Inserting statuses...")
-        statuses = ["For Sale", "Sold", "Bidding in progress"]
-        status_ids = {}
-        for s in statuses:
-            cur.execute("INSERT INTO status (status) VALUES (%s) RETURNING id", (s,))
-            status_ids[s] = cur.fetchone()[0]
-
-        # 4) PROPERTY TYPES
-        print("Inserting property types...")
-        types = ["Villa", "Apartment", "Cottage", "Row House"]
-        type_ids = {}
-        for t in types:
-            cur.execute(
-                "INSERT INTO property_types (name) VALUES (%s) RETURNING id", (t,)
-            )
-            type_ids[t] = cur.fetchone()[0]
-
-        # 5) FEATURES
-        print("Inserting features...")
-        features = [
-            "Balcony",
-            "Fireplace",
-            "Pool",
-            "Garage",
-            "Elevator",
-            "Garden",
-            "Sauna",
-        ]
-        feature_ids = []
-        for f in features:
-            cur.execute("INSERT INTO features (name) VALUES (%s) RETURNING id", (f,))
-            feature_ids.append(cur.fetchone()[0])
+        clear_tables(cur)
+
+        # 2-5) ROLES, STATUS, PROPERTY TYPES, FEATURES
+        role_ids, status_ids, type_ids, feature_ids = insert_reference_data(cur)
 
         # 6) REALTOR COMPANIES
         print("Inserting realtor companies...")
@@ -343,5 +371,291 @@ def seed_database(
         con.close()
 
 
+# BULK SEEDING
+# For large synthetic datasets (load testing search). Rows are generated in
+# batches in memory and streamed to Postgres with COPY instead of one
+# INSERT ... RETURNING round trip per row.
+
+
+def reserve_ids(cur, table, n):
+    """
+    Take n ids from the table's id sequence in one call and return the
+    first one. The ids first, first + 1, ..., first + n - 1 are ours.
+    """
+    if n == 0:
+        return None
+    cur.execute(
+        "SELECT setval(pg_get_serial_sequence(%s, 'id'), nextval(pg_get_serial_sequence(%s, 'id')) + %s - 1)",
+        (table, table, n),
+    )
+    return cur.fetchone()[0] - n + 1
+
+
+def int_array(values):
+    """An INT[] value for copy_rows."""
+    return "{" + ",".join(map(str, values)) + "}"
+
+
+def copy_rows(cur, table, columns, rows):
+    """Stream rows into table with COPY. None values become NULL."""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf
+    )
+
+
+ADDRESS_COLUMNS = [
+    "id",
+    "street",
+    "city",
+    "postcode",
+    "country",
+    "latitude",
+    "longitude",
+]
+USER_COLUMNS = [
+    "id",
+    "first_name",
+    "surname",
+    "mail",
+    "password",
+    "phone_number",
+    "role_id",
+    "address_id",
+    "company_id",
+    "birthdate",
+]
+LISTING_COLUMNS = [
+    "id",
+    "title",
+    "description",
+    "price",
+    "living_area",
+    "lot_size",
+    "room_count",
+    "year_built",
+    "floor_number",
+    "energy_class",
+    "renovation_year",
+    "address_id",
+    "property_type_id",
+    "realtor_id",
+    "status_id",
+    "feature_ids",
+]
+
+# Turns off the listing triggers that a bulk load doesn't need until the
+# transaction ends (migrations 0023 and 0025). feature_ids is then written
+# with the listings instead of by the listing_features triggers.
+BULK_LOAD_SQL = "SET LOCAL app.bulk_load = 'on';"
+
+
+def rand_address_row(address_id):
+    city, postcode, lat, lon = random.choice(CITIES)
+    street = f"{random.choice(STREETS)} {random.randint(1, 99)}"
+    return (address_id, street, city, postcode, "Sweden", *rand_location(lat, lon))
+
+
+def bulk_insert_users(cur, n, role_id, company_ids, mail_offset):
+    """Insert n users (and an address for each). Returns their ids."""
+    first_user = reserve_ids(cur, "users", n)
+    first_address = reserve_ids(cur, "addresses", n)
+    addresses = []
+    users = []
+    for i in range(n):
+        first, last = rand_name()
+        addresses.append(rand_address_row(first_address + i))
+        users.append(
+            (
+                first_user + i,
+                first,
+                last,
+                rand_email(first, last, mail_offset + i),
+                "secret123",
+                rand_phone(),
+                role_id,
+                first_address + i,
+                random.choice(company_ids) if company_ids else None,
+                rand_birthdate(),
+            )
+        )
+    copy_rows(cur, "addresses", ADDRESS_COLUMNS, addresses)
+    copy_rows(cur, "users", USER_COLUMNS, users)
+    return list(range(first_user, first_user + n))
+
+
+def seed_database_bulk(
+    n_companies=50,
+    n_realtors=500,
+    n_buyers=10_000,
+    n_listings=1_000_000,
+    batch_size=10_000,
+):
+    print("Starting to bulk seed database...")
+
+    con = get_connection()
+    cur = con.cursor()
+
+    try:
+        print("Clearing old data...")
+        clear_tables(cur)
+        cur.execute(BULK_LOAD_SQL)
+
+        role_ids, status_ids, type_ids, feature_ids = insert_reference_data(cur)
+        status_id_list = list(status_ids.values())
+        type_id_list = list(type_ids.values())
+
+        print("Inserting realtor companies...")
+        first_address = reserve_ids(cur, "addresses", n_companies)
+        first_company = reserve_ids(cur, "realtor_companies", n_companies)
+        copy_rows(
+            cur,
+            "addresses",
+            ADDRESS_COLUMNS,
+            [rand_address_row(first_address + i) for i in range(n_companies)],
+        )
+        copy_rows(
+            cur,
+            "realtor_companies",
+            ["id", "name", "address_id"],
+            [
+                (first_company + i, f"MoonHem Agency {i + 1}", first_address + i)
+                for i in range(n_companies)
+            ],
+        )
+        company_ids = list(range(first_company, first_company + n_companies))
+
+        print("Inserting users...")
+        realtor_user_ids = bulk_insert_users(
+            cur, n_realtors, role_ids["Realtor"], company_ids, 1000
+        )
+        copy_rows(
+            cur,
+            "realtor_agent",
+            ["user_id", "license_number"],
+            [
+                (user_id, f"LIC-{random.randint(100000, 999999)}")
+                for user_id in realtor_user_ids
+            ],
+        )
+        buyer_user_ids = []
+        for start in range(0, n_buyers, batch_size):
+            n = min(batch_size, n_buyers - start)
+            buyer_user_ids += bulk_insert_users(
+                cur, n, role_ids["User"], [], 1000 + n_realtors + start
+            )
+
+        print("Inserting listings...")
+        for start in range(0, n_listings, batch_size):
+            n = min(batch_size, n_listings - start)
+            first_address = reserve_ids(cur, "addresses", n)
+            first_listing = reserve_ids(cur, "listings", n)
+
+            addresses = []
+            listings = []
+            images = []
+            listing_features = []
+            for i in range(n):
+                listing_id = first_listing + i
+                addresses.append(rand_address_row(first_address + i))
+
+                features = sorted(
+                    random.sample(
+                        feature_ids, k=random.randint(0, min(5, len(feature_ids)))
+                    )
+                )
+                living_area = round(random.uniform(25, 240), 2)
+                listings.append(
+                    (
+                        listing_id,
+                        f"Modern home #{start + i + 1}",
+                        "Bright and well-planned home with great location, close to transport and services.",
+                        round(living_area * random.randint(25000, 65000), 2),
+                        living_area,
+                        round(random.uniform(0, 2500), 2),
+                        random.randint(1, 8),
+                        random.randint(1930, 2024),
+                        random.randint(0, 12),
+                        random.choice(ENERGY_CLASSES),
+                        random.choice([None, None, random.randint(1995, 2024)]),
+                        first_address + i,
+                        random.choice(type_id_list),
+                        random.choice(realtor_user_ids),
+                        random.choice(status_id_list),
+                        int_array(features),
+                    )
+                )
+                for j in range(random.randint(1, 5)):
+                    images.append(
+                        (
+                            listing_id,
+                            f"Photo {j + 1}",
+                            random.choice(LISTING_IMAGE_URLS),
+                        )
+                    )
+                for fid in features:
+                    listing_features.append((listing_id, fid))
+
+            copy_rows(cur, "addresses", ADDRESS_COLUMNS, addresses)
+            copy_rows(cur, "listings", LISTING_COLUMNS, listings)
+            copy_rows(cur, "listing_images", ["listing_id", "caption", "url"], images)
+            copy_rows(
+                cur, "listing_features", ["listing_id", "feature_id"], listing_features
+            )
+            print(f"  {start + n}/{n_listings} listings")
+
+        con.commit()
+
+        # Fresh statistics, so the planner knows how big the tables are now
+        con.autocommit = True
+        cur.execute("ANALYZE;")
+
+        print("✅ Database seeded successfully!")
+        print(
+            f"Inserted: {n_companies} companies, {len(realtor_user_ids)} realtors, {len(buyer_user_ids)} buyers, {n_listings} listings"
+        )
+
+    except Exception as e:
+        print(f"❌ Error seeding database: {e}")
+        con.rollback()
+    finally:
+        con.close()
+
+
 if __name__ == "__main__":
-    seed_database()
+    parser = argparse.ArgumentParser(description="Fill the database with test data")
+    parser.add_argument(
+        "--bulk", action="store_true", help="use COPY, for large datasets"
+    )
+    parser.add_argument("--companies", type=int)
+    parser.add_argument("--realtors", type=int)
+    parser.add_argument("--buyers", type=int)
+    parser.add_argument("--listings", type=int)
+    parser.add_argument(
+        "--batch-size", type=int, default=10_000, help="rows per COPY (bulk only)"
+    )
+    parser.add_argument(
+        "--seed", type=int, help="random seed, the same seed gives the same data"
+    )
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    # Only pass the counts that were given, so each mode keeps its defaults
+    counts = {
+        name: value
+        for name, value in [
+            ("n_companies", args.companies),
+            ("n_realtors", args.realtors),
+            ("n_buyers", args.buyers),
+            ("n_listings", args.listings),
+        ]
+        if value is not None
+    }
+    if args.bulk:
+        seed_database_bulk(batch_size=args.batch_size, **counts)
+    else:
+        seed_database(**counts)
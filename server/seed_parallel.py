@@ -0,0 +1,297 @@
+"""
+Parallel version of the bulk seeder in server/seed.py, for datasets with
+millions of listings.
+
+The listing ids are split into fixed size chunks. Each chunk is generated
+column by column with NumPy and written with COPY by a worker process over
+its own connection, so the load scales with the number of cores.
+
+Every chunk has its own random generator, seeded with (seed, chunk number).
+The chunk boundaries only depend on --chunk-size, so the same seed gives
+exactly the same rows (and ids) no matter how many workers are used.
+
+    python -m server.seed_parallel --listings 5000000 --workers 8 --seed 42
+"""
+
+import argparse
+import os
+import random
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from server.seed import (
+    ADDRESS_COLUMNS,
+    BULK_LOAD_SQL,
+    CITIES,
+    CITY_SPREAD_KM,
+    ENERGY_CLASSES,
+    LISTING_COLUMNS,
+    LISTING_IMAGE_URLS,
+    STREETS,
+    bulk_insert_users,
+    clear_tables,
+    copy_rows,
+    get_connection,
+    insert_reference_data,
+    int_array,
+    rand_address_row,
+    reserve_ids,
+)
+
+MAX_IMAGES_PER_LISTING = 5
+# Chance that a listing has a given feature
+FEATURE_PROBABILITY = 0.35
+
+DESCRIPTION = (
+    "Bright and well-planned home with great location, close to transport and services."
+)
+
+
+def generate_chunk(seed, chunk, start, n, plan):
+    """
+    Generate listing number start ... start + n - 1 and everything that
+    belongs to them. Returns the rows per table.
+    """
+    rng = np.random.default_rng([seed, chunk])
+
+    listing_ids = plan["first_listing"] + start + np.arange(n)
+    address_ids = plan["first_address"] + start + np.arange(n)
+
+    # Addresses
+    cities = rng.integers(0, len(CITIES), n)
+    streets = rng.integers(0, len(STREETS), n)
+    numbers = rng.integers(1, 100, n)
+    centers = np.array([(lat, lon) for _, _, lat, lon in CITIES])[cities]
+    spread = CITY_SPREAD_KM / 111
+    latitudes = rng.normal(centers[:, 0], spread).round(6)
+    longitudes = rng.normal(
+        centers[:, 1], spread / np.cos(np.radians(centers[:, 0]))
+    ).round(6)
+    addresses = [
+        (
+            address_id,
+            f"{STREETS[street]} {number}",
+            CITIES[city][0],
+            CITIES[city][1],
+            "Sweden",
+            latitude,
+            longitude,
+        )
+        for address_id, city, street, number, latitude, longitude in zip(
+            address_ids.tolist(),
+            cities.tolist(),
+            streets.tolist(),
+            numbers.tolist(),
+            latitudes.tolist(),
+            longitudes.tolist(),
+        )
+    ]
+
+    # Listings
+    living_area = rng.uniform(25, 240, n).round(2)
+    price = (living_area * rng.integers(25000, 65001, n)).round(2)
+    lot_size = rng.uniform(0, 2500, n).round(2)
+    room_count = rng.integers(1, 9, n)
+    year_built = rng.integers(1930, 2025, n)
+    floor_number = rng.integers(0, 13, n)
+    energy_class = np.array(ENERGY_CLASSES)[rng.integers(0, len(ENERGY_CLASSES), n)]
+    # Every third listing has been renovated
+    renovated = rng.random(n) < 1 / 3
+    renovation_year = np.where(renovated, rng.integers(1995, 2025, n), 0)
+    property_type_id = rng.choice(plan["type_ids"], n)
+    realtor_id = rng.choice(plan["realtor_ids"], n)
+    status_id = rng.choice(plan["status_ids"], n)
+
+    # Features as a bitset per listing: bit f is set when the listing
+    # has feature f. The set bits become listing_features rows, and each
+    # listing's own feature_ids (sorted, like the 0013 trigger keeps them).
+    feature_ids = np.asarray(plan["feature_ids"])
+    feature_bits = rng.random((n, len(feature_ids))) < FEATURE_PROBABILITY
+    rows, bit = np.nonzero(feature_bits)
+    listing_features = list(zip(listing_ids[rows].tolist(), feature_ids[bit].tolist()))
+    listing_feature_ids = [
+        int_array(sorted(feature_ids[bits].tolist())) for bits in feature_bits
+    ]
+
+    titles = [f"Modern home #{start + i + 1}" for i in range(n)]
+    # 0 means "not renovated" and is written as NULL
+    renovation_years = [year or None for year in renovation_year.tolist()]
+    listings = list(
+        zip(
+            listing_ids.tolist(),
+            titles,
+            [DESCRIPTION] * n,
+            price.tolist(),
+            living_area.tolist(),
+            lot_size.tolist(),
+            room_count.tolist(),
+            year_built.tolist(),
+            floor_number.tolist(),
+            energy_class.tolist(),
+            renovation_years,
+            address_ids.tolist(),
+            property_type_id.tolist(),
+            realtor_id.tolist(),
+            status_id.tolist(),
+            listing_feature_ids,
+        )
+    )
+
+    # Images: 1-5 per listing. Each listing owns MAX_IMAGES_PER_LISTING
+    # image ids, so the ids do not depend on the order chunks finish in.
+    image_counts = rng.integers(1, MAX_IMAGES_PER_LISTING + 1, n)
+    image_listing = np.repeat(np.arange(n), image_counts)
+    image_number = np.arange(len(image_listing)) - np.repeat(
+        np.cumsum(image_counts) - image_counts, image_counts
+    )
+    image_ids = (
+        plan["first_image"]
+        + (start + image_listing) * MAX_IMAGES_PER_LISTING
+        + image_number
+    )
+    image_urls = rng.integers(0, len(LISTING_IMAGE_URLS), len(image_listing))
+    images = [
+        (image_id, listing_id, f"Photo {number + 1}", LISTING_IMAGE_URLS[url])
+        for image_id, listing_id, number, url in zip(
+            image_ids.tolist(),
+            listing_ids[image_listing].tolist(),
+            image_number.tolist(),
+            image_urls.tolist(),
+        )
+    ]
+
+    return addresses, listings, images, listing_features
+
+
+# Each worker process keeps one connection for all the chunks it writes
+_worker_con = None
+
+
+def _init_worker():
+    global _worker_con
+    _worker_con = get_connection()
+
+
+def write_chunk(task):
+    seed, chunk, start, n, plan = task
+    addresses, listings, images, listing_features = generate_chunk(
+        seed, chunk, start, n, plan
+    )
+    with _worker_con, _worker_con.cursor() as cur:
+        cur.execute(BULK_LOAD_SQL)
+        copy_rows(cur, "addresses", ADDRESS_COLUMNS, addresses)
+        copy_rows(cur, "listings", LISTING_COLUMNS, listings)
+        copy_rows(cur, "listing_images", ["id", "listing_id", "caption", "url"], images)
+        copy_rows(
+            cur, "listing_features", ["listing_id", "feature_id"], listing_features
+        )
+    return n
+
+
+def seed_database_parallel(
+    n_companies=50,
+    n_realtors=500,
+    n_buyers=10_000,
+    n_listings=1_000_000,
+    workers=None,
+    chunk_size=50_000,
+    seed=42,
+):
+    print("Starting to seed database in parallel...")
+    started = time.perf_counter()
+    random.seed(seed)
+
+    # Reference data, companies and users are small: the parent writes them
+    # with the COPY helpers from seed.py and commits before the workers start,
+    # so their foreign keys are visible to the workers.
+    con = get_connection()
+    try:
+        with con, con.cursor() as cur:
+            print("Clearing old data...")
+            clear_tables(cur)
+            role_ids, status_ids, type_ids, feature_ids = insert_reference_data(cur)
+
+            print("Inserting realtor companies and users...")
+            first_address = reserve_ids(cur, "addresses", n_companies)
+            first_company = reserve_ids(cur, "realtor_companies", n_companies)
+            copy_rows(
+                cur,
+                "addresses",
+                ADDRESS_COLUMNS,
+                [rand_address_row(first_address + i) for i in range(n_companies)],
+            )
+            copy_rows(
+                cur,
+                "realtor_companies",
+                ["id", "name", "address_id"],
+                [
+                    (first_company + i, f"MoonHem Agency {i + 1}", first_address + i)
+                    for i in range(n_companies)
+                ],
+            )
+            company_ids = list(range(first_company, first_company + n_companies))
+            realtor_ids = bulk_insert_users(
+                cur, n_realtors, role_ids["Realtor"], company_ids, 1000
+            )
+            bulk_insert_users(cur, n_buyers, role_ids["User"], [], 1000 + n_realtors)
+
+            # All listing, address and image ids are taken up front
+            plan = {
+                "first_listing": reserve_ids(cur, "listings", n_listings),
+                "first_address": reserve_ids(cur, "addresses", n_listings),
+                "first_image": reserve_ids(
+                    cur, "listing_images", n_listings * MAX_IMAGES_PER_LISTING
+                ),
+                "type_ids": list(type_ids.values()),
+                "status_ids": list(status_ids.values()),
+                "realtor_ids": realtor_ids,
+                "feature_ids": feature_ids,
+            }
+    finally:
+        con.close()
+
+    tasks = [
+        (seed, chunk, start, min(chunk_size, n_listings - start), plan)
+        for chunk, start in enumerate(range(0, n_listings, chunk_size))
+    ]
+    workers = workers or os.cpu_count()
+    print(
+        f"Inserting {n_listings} listings in {len(tasks)} chunks, {workers} workers..."
+    )
+    done = 0
+    with Pool(workers, initializer=_init_worker) as pool:
+        for n in pool.imap_unordered(write_chunk, tasks):
+            done += n
+            print(f"  {done}/{n_listings} listings")
+
+    con = get_connection()
+    con.autocommit = True
+    with con.cursor() as cur:
+        cur.execute("ANALYZE;")
+    con.close()
+
+    print(f"✅ Database seeded in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a large dataset in parallel")
+    parser.add_argument("--companies", type=int, default=50)
+    parser.add_argument("--realtors", type=int, default=500)
+    parser.add_argument("--buyers", type=int, default=10_000)
+    parser.add_argument("--listings", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, help="default: number of CPUs")
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    seed_database_parallel(
+        n_companies=args.companies,
+        n_realtors=args.realtors,
+        n_buyers=args.buyers,
+        n_listings=args.listings,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        seed=args.seed,
+    )
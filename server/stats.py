@@ -0,0 +1,153 @@
+"""
+Keeps the listing_stats materialized view (migration 0011) up to date.
+
+REFRESH MATERIALIZED VIEW CONCURRENTLY recomputes the view while the old
+rows stay readable, so GET /stats is never blocked by a refresh.
+
+Every API worker runs a StatsRefresher thread. Every STATS_REFRESH_INTERVAL
+seconds it looks at the insert/update/delete counters of the tables the
+view is built from (pg_stat_user_tables) and only refreshes when they moved
+since the last refresh. An advisory lock lets one worker refresh at a time,
+and the counters of the last refresh are stored in stats_refreshes, so the
+other workers know it was already done.
+
+    python -m server.stats            refresh now if anything changed
+    python -m server.stats --force    refresh now
+
+Set STATS_REFRESH_INTERVAL=0 to turn the thread off, e.g. when cron runs
+the command above instead.
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import psycopg2
+
+from server.db_setup import get_connection
+
+# Seconds between checks for changes, 0 turns the refresher off
+STATS_REFRESH_INTERVAL = float(os.getenv("STATS_REFRESH_INTERVAL", "60"))
+# Any constant works, it only has to differ from the one in migrate.py
+LOCK_ID = 7_345_002
+# The tables listing_stats reads
+STATS_SOURCE_TABLES = ["listings", "addresses", "property_types", "status"]
+
+STATS_DIMENSIONS = ["city", "property_type", "status"]
+
+
+def refresh_listing_stats(con, force=False):
+    """
+    Refresh listing_stats if its source tables changed since the last
+    refresh (or always with force=True). Returns True if it was refreshed.
+    """
+    with con, con.cursor() as cur:
+        # Released at the end of the transaction
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s);", (LOCK_ID,))
+        if not cur.fetchone()[0]:
+            # Another worker is refreshing right now
+            return False
+
+        cur.execute(
+            """
+            SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0)
+            FROM pg_stat_user_tables
+            WHERE relname = ANY(%s);
+            """,
+            (STATS_SOURCE_TABLES,),
+        )
+        changes = cur.fetchone()[0]
+        cur.execute("SELECT changes FROM stats_refreshes WHERE name = 'listing_stats';")
+        row = cur.fetchone()
+        if not force and row is not None and row[0] == changes:
+            return False
+
+        cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY listing_stats;")
+        cur.execute(
+            """
+            INSERT INTO stats_refreshes (name, refreshed_at, changes)
+            VALUES ('listing_stats', NOW(), %s)
+            ON CONFLICT (name) DO UPDATE
+            SET refreshed_at = EXCLUDED.refreshed_at, changes = EXCLUDED.changes;
+            """,
+            (changes,),
+        )
+        return True
+
+
+def group_stats(rows):
+    """Arrange listing_stats rows as {"all": row, "city": [rows], ...}."""
+    stats = {"all": None, **{dimension: [] for dimension in STATS_DIMENSIONS}}
+    for row in rows:
+        row = dict(row)
+        dimension = row.pop("dimension")
+        if dimension == "all":
+            row.pop("name")
+            stats["all"] = row
+        else:
+            stats[dimension].append(row)
+    return stats
+
+
+class StatsRefresher:
+    """Background thread that calls refresh_listing_stats every interval."""
+
+    def __init__(self, interval=STATS_REFRESH_INTERVAL):
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="stats-refresher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        con = None
+        while not self._stop.wait(self.interval):
+            try:
+                if con is None:
+                    con = get_connection()
+                refresh_listing_stats(con)
+            except psycopg2.Error as e:
+                print(f"Refreshing the listing stats failed: {e}")
+                if con is not None:
+                    con.close()
+                    con = None
+        if con is not None:
+            con.close()
+
+
+stats_refresher = StatsRefresher()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the listing stats")
+    parser.add_argument(
+        "--force", action="store_true", help="refresh even if nothing changed"
+    )
+    args = parser.parse_args()
+
+    con = get_connection()
+    try:
+        started = time.perf_counter()
+        refreshed = refresh_listing_stats(con, force=args.force)
+    finally:
+        con.close()
+    if refreshed:
+        print(f"Refreshed listing_stats in {time.perf_counter() - started:.2f}s")
+    else:
+        print("Nothing changed (or another refresh is running)")
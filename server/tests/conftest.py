@@ -0,0 +1,21 @@
+import psycopg2
+import pytest
+
+from server.db_setup import get_connection
+
+
+@pytest.fixture
+def con():
+    """
+    A connection to the database in .env (migrated and seeded). Everything
+    a test writes is rolled back. Tests using it are skipped without one.
+    """
+    try:
+        con = get_connection()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"no database: {e}")
+    try:
+        yield con
+    finally:
+        con.rollback()
+        con.close()
@@ -0,0 +1,85 @@
+import pytest
+from psycopg2.extras import RealDictCursor
+
+from server.db import (
+    BATCH_REFERENCES_SQL,
+    BATCH_UPDATE_SQL,
+    batch_errors,
+    batch_reference_params,
+    batch_results,
+    batch_update_params,
+)
+from server.schemas import ListingBatchItem
+
+
+@pytest.fixture
+def cur(con):
+    with con.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            """
+            SELECT id, title, description, price, living_area, lot_size,
+                room_count, year_built, floor_number, energy_class,
+                renovation_year, address_id, property_type_id, realtor_id,
+                status_id
+            FROM listings
+            WHERE address_id IS NOT NULL AND property_type_id IS NOT NULL
+                AND realtor_id IS NOT NULL AND status_id IS NOT NULL
+                AND description IS NOT NULL AND price IS NOT NULL
+                AND living_area IS NOT NULL AND lot_size IS NOT NULL
+                AND room_count IS NOT NULL AND year_built IS NOT NULL
+                AND floor_number IS NOT NULL AND energy_class IS NOT NULL
+            ORDER BY id
+            LIMIT 2;
+            """
+        )
+        if cur.rowcount < 2:
+            pytest.skip("not enough listings in the database")
+        cur.listings = cur.fetchall()
+        yield cur
+
+
+def batch_item(row, **changes):
+    return ListingBatchItem(**{**row, **changes})
+
+
+def update(cur, items):
+    cur.execute(BATCH_REFERENCES_SQL, batch_reference_params(items))
+    errors = batch_errors(items, cur.fetchone())
+    valid = [item for index, item in enumerate(items) if index not in errors]
+    cur.execute(BATCH_UPDATE_SQL, batch_update_params(valid))
+    changed = {row["id"] for row in cur.fetchall()}
+    return batch_results(items, errors, [], changed)
+
+
+def test_batch_updates_only_changed_listings(cur):
+    first, second = cur.listings
+    results = update(
+        cur,
+        [batch_item(first, price=float(first["price"]) + 1000), batch_item(second)],
+    )
+
+    assert [result["status"] for result in results] == ["updated", "unchanged"]
+    cur.execute("SELECT price FROM listings WHERE id = %s;", (first["id"],))
+    assert cur.fetchone()["price"] == first["price"] + 1000
+
+
+def test_batch_update_reports_unknown_and_repeated_listings(cur):
+    first, _ = cur.listings
+    cur.execute("SELECT MAX(id) + 1 AS id FROM listings;")
+    missing_id = cur.fetchone()["id"]
+
+    results = update(
+        cur,
+        [
+            batch_item(first, title="batch test"),
+            batch_item(first, id=missing_id),
+            batch_item(first, title="batch test again"),
+        ],
+    )
+
+    assert results[0] == {"index": 0, "id": first["id"], "status": "updated"}
+    assert results[1] == {"index": 1, "error": f"Listing {missing_id} not found"}
+    assert results[2] == {
+        "index": 2,
+        "error": f"Listing {first['id']} is already in this batch",
+    }
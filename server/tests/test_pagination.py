@@ -0,0 +1,219 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+from psycopg2.extras import RealDictCursor
+
+from server.db import LISTING_SORTS, fetch_listing_page, listing_query
+from server.pagination import (
+    BY_ID,
+    decode_cursor,
+    encode_cursor,
+    fetch_page,
+    page_query,
+    page_result,
+)
+from server.schemas import ListingFilters
+
+
+def test_cursor_round_trip():
+    sort = LISTING_SORTS["price_asc"]
+    cursor = encode_cursor(sort, Decimal("1250000.00"), 42)
+    assert decode_cursor(cursor, sort) == ("1250000.00", 42)
+
+
+def test_cursor_round_trip_timestamp():
+    sort = LISTING_SORTS["newest"]
+    created_at = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+    cursor = encode_cursor(sort, created_at, 7)
+    assert decode_cursor(cursor, sort) == (created_at.isoformat(), 7)
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", "bnVsbA==", "WzEsIDJd"])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor, BY_ID)
+
+
+@pytest.mark.parametrize(
+    "made_for, used_with",
+    [
+        ("price_asc", "newest"),
+        ("newest", "price_asc"),
+        ("price_asc", "price_desc"),
+        ("area_desc", "price_desc"),
+    ],
+)
+def test_cursor_from_another_sort(made_for, used_with):
+    # A client that changes the sort but keeps its cursor gets a 400
+    # (ValueError), not a type error from Postgres
+    rows = [
+        {
+            "id": 1,
+            "price": Decimal("1000000"),
+            "living_area": Decimal("80"),
+            "created_at": datetime(2024, 5, 1, tzinfo=timezone.utc),
+        }
+    ] * 2
+    _, cursor = page_result(rows, LISTING_SORTS[made_for], 1)
+
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        page_query(
+            "SELECT * FROM listings l", [], [], LISTING_SORTS[used_with], 20, cursor
+        )
+
+
+def test_null_sort_value_in_cursor():
+    # The last row had no price: the cursor holds the value it sorts as
+    sort = LISTING_SORTS["price_asc"]
+    rows = [{"id": 5, "price": None}, {"id": 6, "price": None}]
+    _, cursor = page_result(rows, sort, 1)
+    assert decode_cursor(cursor, sort) == ("Infinity", 5)
+
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(encode_cursor(sort, None, 5), sort)
+
+
+def test_page_query_continues_after_cursor():
+    sort = LISTING_SORTS["price_asc"]
+    cursor = encode_cursor(sort, Decimal("500"), 9)
+    sql, params = page_query("SELECT * FROM listings l", [], [], sort, 20, cursor)
+    assert "(COALESCE(l.price, 'Infinity'::numeric), l.id) > (%s::numeric, %s)" in sql
+    assert "ORDER BY COALESCE(l.price, 'Infinity'::numeric) ASC, l.id ASC" in sql
+    assert params == ["500", 9, 21]
+
+
+def insert_listings(cur, values):
+    """Insert listings with the given (price, living_area), return their ids."""
+    cur.execute(
+        """
+        INSERT INTO listings (title, price, living_area)
+        SELECT 'pagination test', price, living_area
+        FROM unnest(%s::numeric[], %s::numeric[]) AS v(price, living_area)
+        RETURNING id;
+        """,
+        ([price for price, _ in values], [area for _, area in values]),
+    )
+    return [row["id"] for row in cur.fetchall()]
+
+
+def all_pages(cur, sort_name, ids, limit):
+    """Follow next_cursor through GET /listings?sort=... for the given ids."""
+    rows, cursor = [], None
+    while True:
+        filters = ListingFilters(sort=sort_name, limit=limit, cursor=cursor)
+        select_sql, where, params, sort = listing_query(filters)
+        page, cursor = fetch_page(
+            cur,
+            select_sql,
+            where + ["l.id = ANY(%s)"],
+            params + [ids],
+            sort,
+            limit,
+            cursor,
+        )
+        rows += page
+        if cursor is None:
+            return rows
+
+
+@pytest.mark.parametrize(
+    "sort_name", ["price_asc", "price_desc", "area_desc", "newest"]
+)
+@pytest.mark.parametrize("limit", [1, 3, 4])
+def test_pages_with_null_sort_values(con, sort_name, limit):
+    values = [
+        (Decimal(1_000_000 + (i % 4) * 250_000), Decimal(50 + i % 3 * 10))
+        for i in range(12)
+    ]
+    values += [
+        (None, Decimal(70)),
+        (None, None),
+        (Decimal(900_000), None),
+        (None, None),
+    ]
+    with con.cursor(cursor_factory=RealDictCursor) as cur:
+        ids = insert_listings(cur, values)
+        rows = all_pages(cur, sort_name, ids, limit)
+
+    # Every listing exactly once
+    assert sorted(row["id"] for row in rows) == sorted(ids)
+    assert len(rows) == len(ids)
+
+    # Listings without a value come last, in either direction
+    field = {"price_asc": "price", "price_desc": "price", "area_desc": "living_area"}
+    if sort_name in field:
+        present = [row[field[sort_name]] for row in rows]
+        nulls = present.count(None)
+        assert nulls > 0
+        assert present[-nulls:] == [None] * nulls
+        known = present[:-nulls]
+        assert known == sorted(known, reverse=sort_name != "price_asc")
+
+
+def insert_search_listings(cur):
+    """
+    Listings for q=zyxg: (title, street, price), the word is in the title,
+    at the start of the street name, or both.
+    """
+    values = [
+        ("zyxg villa", None, 2_000_000),
+        ("zyxg radhus", "Storgatan 1", None),
+        ("villa", "Zyxgatan 1", 1_500_000),
+        ("radhus", "Zyxgatan 2", None),
+        ("zyxg zyxg", "Zyxgatan 3", 3_000_000),
+        ("villa", "Storgatan 2", 1_000_000),  # No match
+    ] * 2
+    cur.execute(
+        """
+        INSERT INTO addresses (street, city)
+        SELECT street, 'Göteborg' FROM unnest(%s::text[]) AS v(street)
+        RETURNING id;
+        """,
+        ([street for _, street, _ in values],),
+    )
+    address_ids = [row["id"] for row in cur.fetchall()]
+    cur.execute(
+        """
+        INSERT INTO listings (title, address_id, price)
+        SELECT * FROM unnest(%s::text[], %s::int[], %s::numeric[])
+        RETURNING id, title,
+            (SELECT street FROM addresses WHERE id = address_id) AS street;
+        """,
+        (
+            [title for title, _, _ in values],
+            address_ids,
+            [price for _, _, price in values],
+        ),
+    )
+    return cur.fetchall()
+
+
+@pytest.mark.parametrize("sort_name", ["relevance", "newest", "price_asc"])
+@pytest.mark.parametrize("limit", [1, 3, 20])
+def test_search_pages(con, sort_name, limit):
+    with con.cursor(cursor_factory=RealDictCursor) as cur:
+        inserted = insert_search_listings(cur)
+        rows, cursor = [], None
+        while True:
+            filters = ListingFilters(
+                q="zyxg", sort=sort_name, limit=limit, cursor=cursor
+            )
+            page, cursor = fetch_listing_page(cur, filters)
+            rows += page
+            if cursor is None:
+                break
+
+    # Every matching listing exactly once, from both the text and the street
+    expected = [
+        row["id"]
+        for row in inserted
+        if "zyxg" in row["title"] or (row["street"] or "").startswith("Zyxg")
+    ]
+    assert sorted(row["id"] for row in rows) == sorted(expected)
+    assert len(rows) == len(expected)
+
+    if sort_name == "relevance":
+        # The listings with the word in the text come first
+        in_text = ["zyxg" in row["title"] for row in rows]
+        assert in_text == sorted(in_text, reverse=True)
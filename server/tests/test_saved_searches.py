@@ -0,0 +1,89 @@
+import pytest
+from psycopg2.extras import RealDictCursor
+
+from server.db import CREATE_SAVED_SEARCH_SQL, saved_search_params
+from server.schemas import SavedSearchCreate
+
+
+@pytest.fixture
+def cur(con):
+    with con.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT id FROM users ORDER BY id LIMIT 1;")
+        if cur.rowcount == 0:
+            pytest.skip("no users in the database")
+        cur.user_id = cur.fetchone()["id"]
+        yield cur
+
+
+def save_search(cur, **filters):
+    search = SavedSearchCreate(user_id=cur.user_id, name="test", **filters)
+    cur.execute(CREATE_SAVED_SEARCH_SQL, saved_search_params(search))
+    return cur.fetchone()["id"]
+
+
+def insert_listing(cur, price):
+    cur.execute(
+        "INSERT INTO listings (title, price) VALUES ('saved search test', %s) RETURNING id;",
+        (price,),
+    )
+    return cur.fetchone()["id"]
+
+
+def alerts(cur, listing_id):
+    cur.execute(
+        """
+        SELECT saved_search_id, reason, price
+        FROM saved_search_alerts
+        WHERE listing_id = %s
+        ORDER BY id;
+        """,
+        (listing_id,),
+    )
+    return [(row["saved_search_id"], row["reason"], row["price"]) for row in cur]
+
+
+def test_listing_without_price_matches_searches_without_price_filter(cur):
+    anything = save_search(cur)
+    cheap = save_search(cur, price_max=2_000_000)
+    from_one_million = save_search(cur, price_min=1_000_000)
+
+    listing_id = insert_listing(cur, None)
+
+    matched = {search_id for search_id, _, _ in alerts(cur, listing_id)}
+    assert anything in matched
+    assert cheap not in matched
+    assert from_one_million not in matched
+    assert (anything, "new", None) in alerts(cur, listing_id)
+
+
+def test_first_price_alerts_the_matching_searches(cur):
+    anything = save_search(cur)
+    cheap = save_search(cur, price_max=2_000_000)
+    expensive = save_search(cur, price_min=5_000_000)
+    listing_id = insert_listing(cur, None)
+
+    cur.execute("UPDATE listings SET price = 1500000 WHERE id = %s;", (listing_id,))
+
+    price_alerts = {
+        search_id
+        for search_id, reason, _ in alerts(cur, listing_id)
+        if reason == "price"
+    }
+    assert anything in price_alerts
+    assert cheap in price_alerts
+    assert expensive not in price_alerts
+
+
+def test_price_rise_is_no_news(cur):
+    anything = save_search(cur)
+    listing_id = insert_listing(cur, 1_000_000)
+
+    cur.execute("UPDATE listings SET price = 1200000 WHERE id = %s;", (listing_id,))
+    cur.execute("UPDATE listings SET price = 900000 WHERE id = %s;", (listing_id,))
+
+    reasons = [
+        reason
+        for search_id, reason, _ in alerts(cur, listing_id)
+        if search_id == anything
+    ]
+    assert reasons == ["new", "price"]